@@ -0,0 +1,133 @@
+"""Chuỗi thời gian cho tab Phân tích: kg và số món theo ngày / tuần / tháng, theo khách hàng và theo mặt hàng.
+
+Biểu đồ dựng từ bảng tổng hợp (Rollups), không từ từng phiếu: chuỗi ngày lấy
+từ các ô đã cộng sẵn rồi gộp xuống tuần / tháng. Khoảng dài thì tự chuyển
+sang mức thô hơn để mỗi chuỗi không quá MAX_POINTS điểm, nên trình duyệt chỉ
+nhận vài trăm điểm dù lịch sử nhiều năm. Kết quả được giữ theo version của
+bảng phiếu: đổi qua lại giữa các lựa chọn không phải tính lại.
+"""
+import collections
+import threading
+
+import pandas as pd
+
+from rollups import COUNT_COLUMN
+from storage import ITEMS
+
+DAY, WEEK, MONTH = "Ngày", "Tuần", "Tháng"
+LEVELS = [DAY, WEEK, MONTH]
+# Kỳ của pandas: tuần từ thứ Hai đến Chủ nhật
+PERIODS = {DAY: "D", WEEK: "W-SUN", MONTH: "M"}
+# Cửa sổ trung bình trượt (số kỳ): 7 ngày, 4 tuần, 3 tháng
+ROLLING = {DAY: 7, WEEK: 4, MONTH: 3}
+MAX_POINTS = 400
+# Theo khách cần ô ngày × khách hàng; khoảng dài hơn thì dùng bảng tháng × khách hàng
+CUSTOMER_DAYS_MAX = 366
+PIECES = "Số món"
+OTHERS = "Khác"
+TOP = 8
+
+
+def resolution(start, end, wanted, per_customer=False):
+    """Mức gộp dùng thật: `wanted`, hoặc thô hơn nếu [start, end] ra quá MAX_POINTS điểm."""
+    long_range = (pd.Timestamp(end) - pd.Timestamp(start)).days > CUSTOMER_DAYS_MAX
+    for level in LEVELS[LEVELS.index(wanted):]:
+        if per_customer and level != MONTH and long_range:
+            continue
+        if len(pd.period_range(start, end, freq=PERIODS[level])) <= MAX_POINTS:
+            return level
+    return MONTH
+
+
+def rolling_label(column, level):
+    return f"{column} (TB {ROLLING[level]} {level.lower()})"
+
+
+def _periods(days, level):
+    return pd.DatetimeIndex(days).to_period(PERIODS[level])
+
+
+def _complete(sums, start, end, level):
+    """Thêm các kỳ không có phiếu (= 0); chỉ mục là ngày đầu kỳ, tên chỉ mục là mức gộp."""
+    full = pd.period_range(start, end, freq=PERIODS[level])
+    sums = sums.reindex(full, fill_value=0)
+    sums.index = full.start_time.rename(level)
+    return sums
+
+
+def _top(frame, top):
+    """Giữ `top` cột lớn nhất (theo tổng), các cột còn lại gộp vào OTHERS."""
+    order = frame.sum().sort_values(ascending=False).index
+    kept = frame[order[:top]]
+    if len(order) > top:
+        kept = kept.assign(**{OTHERS: frame[order[top:]].sum(axis=1)})
+    return kept
+
+
+class Analytics:
+    """Các chuỗi đã gộp (DataFrame, người gọi không được sửa), giữ tối đa `max_entries` kết quả gần nhất."""
+
+    def __init__(self, rollups, max_entries=64):
+        self.rollups = rollups
+        self.max_entries = max_entries
+        self._memo = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, key, start, end, build):
+        table = self.rollups.table
+        # Đồng bộ trước (hết ttl / phân vùng chưa tải): bảng đổi thì version đổi -> tính lại
+        table.sync(start, end)
+        key = (table.version, pd.Timestamp(start), pd.Timestamp(end)) + key
+        with self._lock:
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                return self._memo[key]
+        result = build()
+        with self._lock:
+            self._memo[key] = result
+            while len(self._memo) > self.max_entries:
+                self._memo.popitem(last=False)
+        return result
+
+    # --- CÁC CHUỖI ---
+    def volume(self, start, end, wanted=DAY, customer=None):
+        """Số phiếu, Tổng Kg, Số món theo kỳ, kèm trung bình trượt của Tổng Kg và Số món."""
+        level = resolution(start, end, wanted)
+
+        def build():
+            daily = self.rollups.series(start, end, customer)
+            values = pd.DataFrame({
+                COUNT_COLUMN: daily[COUNT_COLUMN],
+                "Tổng Kg": daily["Tổng Kg"].astype(float),
+                PIECES: daily[ITEMS].sum(axis=1),
+            })
+            sums = _complete(values.groupby(_periods(daily["Ngày"], level)).sum(), start, end, level)
+            for column in ("Tổng Kg", PIECES):
+                sums[rolling_label(column, level)] = sums[column].rolling(ROLLING[level], min_periods=1).mean().round(1)
+            sums["Tổng Kg"] = sums["Tổng Kg"].round(2)
+            return sums
+        return self._cached(("volume", level, customer), start, end, build)
+
+    def by_item(self, start, end, wanted=DAY, customer=None, top=TOP):
+        """Số món của từng mặt hàng theo kỳ (top mặt hàng nhiều nhất, còn lại gộp "Khác")."""
+        level = resolution(start, end, wanted)
+
+        def build():
+            daily = self.rollups.series(start, end, customer)
+            sums = daily[ITEMS].groupby(_periods(daily["Ngày"], level)).sum()
+            return _top(_complete(sums, start, end, level), top)
+        return self._cached(("items", level, customer, top), start, end, build)
+
+    def by_customer(self, start, end, wanted=DAY, measure="Tổng Kg", top=TOP):
+        """`measure` (Tổng Kg / Số món / Số phiếu) của từng khách theo kỳ (top khách, còn lại gộp "Khác")."""
+        level = resolution(start, end, wanted, per_customer=True)
+
+        def build():
+            if level == MONTH:
+                cells = self.rollups.monthly(start, end).rename(columns={"Tháng": "Ngày"})
+            else:
+                cells = self.rollups.daily(start, end)
+            values = cells[ITEMS].sum(axis=1) if measure == PIECES else cells[measure]
+            sums = values.groupby([_periods(cells["Ngày"], level), cells["Khách hàng"].to_numpy()]).sum()
+            return _top(_complete(sums.unstack(fill_value=0), start, end, level), top)
+        return self._cached(("customers", level, measure, top), start, end, build)
@@ -0,0 +1,476 @@
+"""API JSON/HTTP cục bộ cho máy quét phiếu và hệ thống đối tác, không qua Streamlit.
+
+Dựng cùng các tầng dữ liệu như app.py (datastore.py: backend, nhật ký,
+ảnh chụp dùng chung, bảng phiếu chia tháng; thêm bảng tổng hợp, chỉ mục tìm
+phiếu) trong một tiến trình ThreadingHTTPServer: mỗi request một luồng, dữ
+liệu đã nằm sẵn trong bộ nhớ nên trả lời tính bằng mili giây, không phải
+chạy lại cả script giao diện. Chạy cạnh app trên cùng máy thì hai tiến
+trình dùng chung ảnh chụp và tín hiệu ghi (snapshot.py).
+
+    python api.py --port 8502 [--secrets .streamlit/secrets.toml]
+
+Đăng nhập   POST /api/login {"username", "password"} -> {"token", ...};
+            các request sau gửi "Authorization: Bearer <token>"
+Phiếu       GET    /api/invoices?from=&to=&customer=&page=&per_page=
+            GET    /api/invoices/<Số phiếu>
+            POST   /api/invoices                          (staff / admin)
+            PUT    /api/invoices/<Số phiếu> + If-Match    (staff / admin, thay cả phiếu)
+            PATCH  /api/invoices/<Số phiếu> + If-Match    (staff / admin, chỉ các trường gửi lên)
+            DELETE /api/invoices/<Số phiếu> + If-Match    (staff / admin)
+Báo cáo     GET /api/reports/{totals,customers,daily,monthly}?from=&to=   (admin)
+
+Phiếu gửi lên là object JSON theo tên cột (như INVOICE_COLUMNS), được kiểm
+tra như khi nhập từ file (importer.py). Mọi GET có ETag; gửi lại
+If-None-Match thì nhận 304 khi dữ liệu chưa đổi. ETag của một phiếu là
+phiên bản của nó (cột Cập nhật): sửa / xóa phải gửi If-Match với ETag đó
+(hoặc "*" để ghi đè), phiếu đã bị sửa ở nơi khác thì nhận 412.
+Khách hàng (role customer) chỉ xem được phiếu của mình.
+"""
+import argparse
+import datetime
+import http.server
+import json
+import logging
+import os
+import re
+import secrets
+import threading
+import time
+import tomllib
+import urllib.parse
+
+import numpy as np
+import pandas as pd
+
+from auth import CredentialIndex, LoginThrottled
+from cache import warm
+from datastore import gspread_client, open_backend, open_snapshots, open_table, start_journal
+from importer import ImportFileError, map_columns, validate_invoices
+from partitions import CustomerPartitions
+from rollups import Rollups
+from search import InvoiceSearch
+from storage import (
+    CATALOG_SHEET, INVOICE_COLUMNS, INVOICES_SHEET, REVISION_COLUMN, USERS_SHEET, RevisionConflict, StorageError,
+)
+from writequeue import WriteQueue
+
+logger = logging.getLogger("giatui.api")
+
+TOKEN_TTL = 12 * 3600
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+MAX_BODY_BYTES = 1 << 20
+WRITE_ROLES = ("staff", "admin")
+REPORTS = ("totals", "customers", "daily", "monthly")
+
+
+class ApiError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class Request:
+    """Những gì InvoiceApi cần từ một request HTTP (đã tách khỏi http.server)."""
+
+    def __init__(self, method, params, query, headers, body=None, client=None):
+        self.method = method
+        self.params = params
+        self.query = query
+        self.headers = headers
+        self.body = body
+        self.client = client
+        self.user = None
+
+    def arg(self, name, default=None):
+        values = self.query.get(name)
+        return values[0] if values else default
+
+    def date(self, name, default=None):
+        value = self.arg(name)
+        if value is None:
+            return default
+        try:
+            return datetime.date.fromisoformat(value)
+        except ValueError:
+            raise ApiError(400, f"Tham số {name} phải có dạng YYYY-MM-DD") from None
+
+    def number(self, name, default, low, high):
+        try:
+            value = int(self.arg(name, default))
+        except ValueError:
+            raise ApiError(400, f"Tham số {name} phải là số nguyên") from None
+        return min(max(value, low), high)
+
+    def tags(self, header):
+        """Các ETag trong If-Match / If-None-Match."""
+        value = self.headers.get(header)
+        if value is None:
+            return None
+        return [tag.strip() for tag in value.split(",")]
+
+
+class Response:
+    def __init__(self, status, body=None, etag=None, headers=None):
+        self.status = status
+        self.body = body
+        self.headers = dict(headers or {})
+        if etag is not None:
+            self.headers["ETag"] = etag
+
+
+def _records(frame):
+    """DataFrame phiếu -> list dict JSON (Ngày dạng YYYY-MM-DD)."""
+    if "Ngày" in frame:
+        frame = frame.assign(**{"Ngày": frame["Ngày"].dt.strftime("%Y-%m-%d")})
+    return json.loads(frame.to_json(orient="records", force_ascii=False))
+
+
+def _revision_tag(revision):
+    return '"' + str(revision).replace('"', "") + '"'
+
+
+class InvoiceApi:
+    """Nghiệp vụ của API, không phụ thuộc HTTP: mỗi hàm nhận Request, trả về Response."""
+
+    def __init__(self, users, invoices, token_ttl=TOKEN_TTL):
+        self.users = users
+        self.invoices = invoices
+        self.credentials = CredentialIndex(users)
+        self.rollups = Rollups(invoices)
+        self.search = InvoiceSearch(invoices)
+        self.partitions = CustomerPartitions(invoices)
+        self.token_ttl = token_ttl
+        # version chỉ là bộ đếm trong tiến trình (khởi động lại thì đếm lại từ đầu):
+        # thêm mã riêng của lần chạy này để ETag cũ không khớp nhầm sau khi khởi động lại
+        self._epoch = secrets.token_hex(4)
+        # token -> (thông tin user, hết hạn lúc)
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def warm(self):
+        """Tải trước Users, Catalog và mọi tháng phiếu (như lúc đăng nhập trên app)."""
+        warm([self.users], also=[CATALOG_SHEET] if self.invoices.catalog_stale else [])
+        warm(self.invoices.caches())
+
+    # --- ĐĂNG NHẬP ---
+    def login(self, request):
+        body = request.body or {}
+        try:
+            user = self.credentials.authenticate(body.get("username"), body.get("password"), client=request.client)
+        except LoginThrottled as e:
+            raise ApiError(429, f"Sai quá nhiều lần. {e}.", {"Retry-After": str(int(e.retry_after) + 1)}) from None
+        if user is None:
+            raise ApiError(401, "Sai thông tin đăng nhập")
+        token = secrets.token_urlsafe(32)
+        info = {"Username": user["Username"], "Role": user["Role"], "FullName": user["FullName"]}
+        now = time.monotonic()
+        with self._lock:
+            # Bỏ các phiên đã hết hạn khi có phiên mới
+            self._sessions = {t: s for t, s in self._sessions.items() if s[1] > now}
+            self._sessions[token] = (info, now + self.token_ttl)
+        return Response(200, {"token": token, "expires_in": self.token_ttl, "user": info})
+
+    def authorize(self, request, roles=None):
+        scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+        with self._lock:
+            session = self._sessions.get(token.strip()) if scheme.lower() == "bearer" else None
+        if session is None or session[1] <= time.monotonic():
+            raise ApiError(401, "Chưa đăng nhập hoặc phiên đã hết hạn", {"WWW-Authenticate": "Bearer"})
+        request.user = session[0]
+        if roles is not None and request.user["Role"] not in roles:
+            raise ApiError(403, "Tài khoản không có quyền này")
+
+    def _own_customer(self, request):
+        # Khách hàng chỉ thấy phiếu mang tên mình
+        return request.user["FullName"] if request.user["Role"] == "customer" else None
+
+    # --- ĐỌC ---
+    def _conditional(self, request, etag, build):
+        """304 nếu client đã có đúng bản này (If-None-Match), không cần dựng nội dung."""
+        tags = request.tags("If-None-Match") or []
+        if etag in tags or "*" in tags:
+            return Response(304, etag=etag)
+        return Response(200, build(), etag=etag)
+
+    def _version_tag(self):
+        return f'W/"{self._epoch}-{self.invoices.version}"'
+
+    def list_invoices(self, request):
+        self.authorize(request)
+        start, end = request.date("from"), request.date("to")
+        customer = self._own_customer(request) or request.arg("customer")
+        page = request.number("page", 1, 1, 1_000_000)
+        per_page = request.number("per_page", DEFAULT_PAGE_SIZE, 1, MAX_PAGE_SIZE)
+        # Đồng bộ trước rồi mới lấy version làm ETag
+        if start is not None and end is not None:
+            self.invoices.sync(start, end)
+        else:
+            self.invoices.sync()
+
+        def build():
+            if customer is not None and start is None and end is None:
+                part, total = self.partitions.page(customer, page, per_page)
+            else:
+                frame = self._select(start, end)
+                if customer is not None:
+                    frame = frame[frame["Khách hàng"].astype(str) == customer]
+                total = len(frame)
+                stop = max(total - (page - 1) * per_page, 0)
+                part = frame.iloc[max(stop - per_page, 0):stop].iloc[::-1]
+            return {"items": _records(part), "page": page, "per_page": per_page, "total": total}
+        return self._conditional(request, self._version_tag(), build)
+
+    def _select(self, start, end):
+        """Phiếu trong [start, end] (None = không giới hạn), sắp tăng dần theo ngày."""
+        if start is not None and end is not None:
+            return self.invoices.between(start, end)
+        frame = self.invoices.frame_ref()
+        days = frame["Ngày"].to_numpy()
+        lo = 0 if start is None else np.searchsorted(days, np.datetime64(start), side="left")
+        hi = len(frame) if end is None else np.searchsorted(
+            days, np.datetime64(end + datetime.timedelta(days=1)), side="left")
+        return frame.iloc[lo:hi]
+
+    def _find(self, request, key):
+        days = self.search.days_of(key)
+        row = self.search.row(key, days[0]) if days else None
+        own = self._own_customer(request)
+        if row is None or (own is not None and str(row["Khách hàng"]) != own):
+            raise ApiError(404, f"Không tìm thấy phiếu {key}")
+        return row
+
+    def get_invoice(self, request):
+        self.authorize(request)
+        row = self._find(request, request.params["key"])
+        return self._conditional(request, _revision_tag(row[REVISION_COLUMN]), lambda: self._record(row))
+
+    @staticmethod
+    def _record(row):
+        """Một dòng (pd.Series của bảng phiếu) -> dict JSON."""
+        return _records(pd.DataFrame([row]).astype({"Ngày": "datetime64[ns]"}))[0]
+
+    # --- GHI ---
+    def _validated(self, fields, key=None):
+        """Object JSON -> một dòng theo INVOICE_COLUMNS (kiểm tra như nhập từ file); lỗi thì 422."""
+        if not isinstance(fields, dict):
+            raise ApiError(400, "Nội dung phải là một object JSON")
+        try:
+            frame, unused = map_columns(pd.DataFrame([fields], dtype=object))
+        except ImportFileError as e:
+            raise ApiError(422, str(e)) from None
+        if unused:
+            raise ApiError(422, f"Trường không có trong phiếu: {', '.join(map(str, unused))}")
+        new_key = str(frame["Số phiếu"].iloc[0]).strip()
+        existing = [new_key] if new_key != key and self.search.days_of(new_key) else []
+        users = self.users.frame_ref()
+        customers = users[users["Role"] == "customer"].set_index("FullName")["Address"].to_dict()
+        rows, errors = validate_invoices(frame, customers, existing)
+        if len(errors):
+            raise ApiError(422, errors["Lỗi"].iloc[0])
+        return rows[0]
+
+    @staticmethod
+    def _expected(request):
+        tags = request.tags("If-Match")
+        if not tags:
+            raise ApiError(428, "Thiếu If-Match: gửi ETag của phiếu (hoặc \"*\" để ghi đè)")
+        if tags == ["*"]:
+            return None
+        return tags[0].strip('"')
+
+    @staticmethod
+    def _result(ticket, status, body=None, etag=None):
+        if not ticket.ok:
+            if isinstance(ticket.error, RevisionConflict):
+                raise ApiError(412, str(ticket.error))
+            raise ApiError(503, f"Lỗi ghi dữ liệu (đã thử {ticket.attempts} lần): {ticket.error}")
+        if not ticket.result:
+            raise ApiError(404, "Không tìm thấy phiếu cần ghi")
+        return Response(status, body, etag=etag)
+
+    def _written(self, ticket, status):
+        row = dict(zip(INVOICE_COLUMNS, ticket.row))
+        return self._result(ticket, status, row, _revision_tag(row[REVISION_COLUMN]))
+
+    def create_invoice(self, request):
+        self.authorize(request, WRITE_ROLES)
+        row = self._validated(request.body)
+        return self._written(self.invoices.append(row), 201)
+
+    def update_invoice(self, request):
+        self.authorize(request, WRITE_ROLES)
+        key = request.params["key"]
+        expected = self._expected(request)
+        fields = request.body
+        if request.method == "PATCH" and isinstance(fields, dict):
+            current = self._record(self._find(request, key))
+            current.pop(REVISION_COLUMN)
+            fields = {**current, **fields}
+        elif isinstance(fields, dict):
+            fields = {"Số phiếu": key, **fields}
+        row = self._validated(fields, key=key)
+        return self._written(self.invoices.update(key, row, expected=expected), 200)
+
+    def delete_invoice(self, request):
+        self.authorize(request, WRITE_ROLES)
+        ticket = self.invoices.delete(request.params["key"], expected=self._expected(request))
+        return self._result(ticket, 204)
+
+    # --- BÁO CÁO ---
+    def report(self, request):
+        self.authorize(request, ("admin",))
+        today = datetime.date.today()
+        start, end = request.date("from", today.replace(day=1)), request.date("to", today)
+        name = request.params["report"]
+        self.invoices.sync(start, end)
+
+        def build():
+            if name == "totals":
+                totals = self.rollups.totals(start, end)
+                # Số phiếu và số lượng mặt hàng là số nguyên, chỉ Tổng Kg là số thực
+                return {col: round(float(v), 2) if col == "Tổng Kg" else int(v) for col, v in totals.items()}
+            if name == "customers":
+                return _records(self.rollups.by_customer(start, end))
+            if name == "daily":
+                return _records(self.rollups.daily(start, end))
+            monthly = self.rollups.monthly(start, end)
+            return _records(monthly.assign(Tháng=monthly["Tháng"].dt.strftime("%Y-%m")))
+        return self._conditional(request, self._version_tag(), build)
+
+
+# --- HTTP ---
+ROUTES = [
+    ("POST", r"/api/login", "login"),
+    ("GET", r"/api/invoices", "list_invoices"),
+    ("POST", r"/api/invoices", "create_invoice"),
+    ("GET", r"/api/invoices/(?P<key>[^/]+)", "get_invoice"),
+    ("PUT", r"/api/invoices/(?P<key>[^/]+)", "update_invoice"),
+    ("PATCH", r"/api/invoices/(?P<key>[^/]+)", "update_invoice"),
+    ("DELETE", r"/api/invoices/(?P<key>[^/]+)", "delete_invoice"),
+    ("GET", r"/api/reports/(?P<report>" + "|".join(REPORTS) + ")", "report"),
+]
+_ROUTES = [(method, re.compile(pattern + "$"), handler) for method, pattern, handler in ROUTES]
+
+
+class ApiHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    api = None
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def do_PATCH(self):
+        self._dispatch("PATCH")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _dispatch(self, method):
+        url = urllib.parse.urlsplit(self.path)
+        path = urllib.parse.unquote(url.path)
+        try:
+            body = self._body()
+            allowed = []
+            for route_method, pattern, handler in _ROUTES:
+                match = pattern.match(path)
+                if match is None:
+                    continue
+                if route_method != method:
+                    allowed.append(route_method)
+                    continue
+                request = Request(method, match.groupdict(), urllib.parse.parse_qs(url.query),
+                                  self.headers, body, self.client_address[0])
+                return self._send(getattr(self.api, handler)(request))
+            if allowed:
+                raise ApiError(405, "Phương thức không được hỗ trợ", {"Allow": ", ".join(allowed)})
+            raise ApiError(404, "Không có đường dẫn này")
+        except ApiError as e:
+            self._send(Response(e.status, {"error": str(e)}, headers=e.headers))
+        except StorageError as e:
+            self._send(Response(503, {"error": str(e)}))
+        except Exception:
+            logger.exception("Lỗi xử lý %s %s", method, self.path)
+            self._send(Response(500, {"error": "Lỗi máy chủ"}))
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            raise ApiError(413, "Nội dung quá lớn")
+        if not length:
+            return None
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError:
+            raise ApiError(400, "Nội dung không phải JSON hợp lệ") from None
+
+    def _send(self, response):
+        data = b"" if response.body is None else json.dumps(response.body, ensure_ascii=False).encode("utf-8")
+        self.send_response(response.status)
+        for name, value in response.headers.items():
+            self.send_header(name, value)
+        # Nội dung tùy theo tài khoản (khách hàng chỉ thấy phiếu của mình)
+        self.send_header("Vary", "Authorization")
+        if response.status not in (204, 304):
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if response.status not in (204, 304):
+            self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug("%s " + format, self.client_address[0], *args)
+
+
+def serve(api, host="127.0.0.1", port=8502):
+    handler = type("BoundApiHandler", (ApiHandler,), {"api": api})
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+# --- DỰNG CÁC TẦNG DỮ LIỆU (datastore.py, như các hàm get_* trong app.py) ---
+def load_secrets(path):
+    """secrets.toml của Streamlit (cùng file với app); không có file thì dict rỗng."""
+    try:
+        with open(path, "rb") as f:
+            return tomllib.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def build_api(secrets_config):
+    cfg = dict(secrets_config.get("storage", {}))
+    backend = open_backend(cfg, lambda: gspread_client(secrets_config["gcp_service_account"]))
+    queue = WriteQueue(backend)
+    # Nhật ký riêng của tiến trình API, không dùng chung file với app
+    journal = start_journal(cfg, queue, owner="api")
+    snapshots = open_snapshots(cfg)
+    users = open_table(backend, USERS_SHEET, queue=queue, journal=journal, snapshots=snapshots)
+    invoices = open_table(backend, INVOICES_SHEET, queue=queue, journal=journal, snapshots=snapshots)
+    return InvoiceApi(users, invoices)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="API JSON cho phiếu giặt ủi")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8502)
+    parser.add_argument("--secrets", default=os.path.join(".streamlit", "secrets.toml"))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    api = build_api(load_secrets(args.secrets))
+    api.warm()
+    server = serve(api, args.host, args.port)
+    print(f"API đang chạy tại http://{args.host}:{args.port}/api")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -1,12 +1,28 @@
 import streamlit as st
 import pandas as pd
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from datetime import datetime, date
-import time
-import io
-import openpyxl
-import textwrap
+from datetime import date
+import math
+import functools
+from string import Template
+
+from storage import (
+    ITEMS, INVOICE_COLUMNS, REVISION_COLUMN, USERS_SHEET, INVOICES_SHEET, CATALOG_SHEET,
+    PRICES_SHEET, PRICE_COLUMNS, DEFAULT_PRICE, KG_PRICE,
+    StorageError, RevisionConflict, is_partition, plain_value,
+)
+from cache import warm
+from rollups import Rollups
+from analytics import LEVELS, MAX_POINTS, PIECES, Analytics, rolling_label
+from partitions import CustomerPartitions
+from search import InvoiceSearch
+from auth import CredentialIndex, LoginThrottled, hash_password
+from importer import ImportFileError, map_columns, read_upload, validate_invoices
+from export import XLSX_MIME, ExportCache, write_workbook
+from receipts import RECEIPT_CSS, print_document, receipt_fields, render_receipt
+from billing import compute_bill, print_statements, statements_archive
+from writequeue import WriteQueue
+from datastore import gspread_client, metrics_log, open_backend, open_snapshots, open_table, start_journal
+from metrics import Metrics, MeasuredBackend, instrument_client
 
 # --- CẤU HÌNH TRANG ---
 st.set_page_config(
@@ -16,22 +32,10 @@ st.set_page_config(
 )
 
 # --- CSS TÙY CHỈNH CHO HÓA ĐƠN (ĐÃ TỐI ƯU IN ẤN) ---
-st.markdown("""
+st.markdown(Template("""
 <style>
-    /* 1. Cấu hình hiển thị trên màn hình thường */
-    .invoice-box {
-        max-width: 800px;
-        margin: auto;
-        padding: 30px;
-        border: 1px solid #eee;
-        box-shadow: 0 0 10px rgba(0, 0, 0, .15);
-        font-size: 16px;
-        line-height: 24px;
-        font-family: 'Times New Roman', serif;
-        color: #555;
-        background-color: white;
-    }
-
+    /* 1. Style thân phiếu (receipts.RECEIPT_CSS) */
+$receipt_css
     /* 2. Cấu hình CHUYÊN DỤNG cho máy in (Ctrl+P) */
     @media print {
         /* Ẩn toàn bộ giao diện Streamlit (Header, Sidebar, Footer, Menu...) */
@@ -76,428 +80,492 @@ st.markdown("""
         }
     }
 
-    /* Style cho các thành phần bên trong hóa đơn */
-    .invoice-header {
-        text-align: center;
-        color: #003366;
-        margin-bottom: 20px;
-    }
-    .invoice-table {
-        width: 100%;
-        border-collapse: collapse;
-        margin-top: 20px;
-    }
-    .invoice-table th, .invoice-table td {
-        border: 1px solid #333;
-        padding: 8px;
-        text-align: left;
-    }
-    .invoice-table th {
-        background-color: #f2f2f2;
-        text-align: center;
-        -webkit-print-color-adjust: exact; /* Giữ màu nền xám khi in */
-    }
-    .total-section {
-        margin-top: 20px;
-        text-align: right;
-        font-weight: bold;
-        font-size: 18px;
-    }
-    .signature-section {
-        display: flex;
-        justify-content: space-between;
-        margin-top: 40px;
-        text-align: center;
-    }
 </style>
-""", unsafe_allow_html=True)
+""").substitute(receipt_css=RECEIPT_CSS), unsafe_allow_html=True)
 
-# --- DANH SÁCH MẶT HÀNG ---
-ITEMS = [
-    "Áo gối", "Áo choàng", "Bọc lớn", "Bọc nhỏ", "Bảo vệ nệm",
-    "Bọc mền", "Drap lớn", "Drap nhỏ", "Drap thun", "Khăn hồ bơi",
-    "Khăn tắm lớn trắng", "Khăn tay", "Khăn mặt", "Khăn Welcome",
-    "Khăn bàn", "Mền", "Thảm chân", "Tấm trang trí", "Rèm cửa",
-    "Mùng", "Gối ghế"
-]
+# --- HÀM KẾT NỐI ---
+@st.cache_resource
+def get_metrics():
+    """Số đo hiệu năng của tiến trình (tab Hiệu năng của admin).
 
-SHEET_NAME = "QuanLyGiatUi_HaiAu" 
+    Ghi thêm ra file JSONL nếu có [storage] metrics_log hoặc GIATUI_METRICS_LOG.
+    """
+    return Metrics(log_path=metrics_log(storage_config()))
 
-# --- HÀM KẾT NỐI ---
 @st.cache_resource
 def get_gspread_client():
     try:
-        scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-        creds_dict = dict(st.secrets["gcp_service_account"])
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-        client = gspread.authorize(creds)
-        return client
+        return instrument_client(gspread_client(st.secrets["gcp_service_account"]), get_metrics())
     except Exception as e:
         st.error(f"⚠️ Lỗi kết nối: {str(e)}")
         st.stop()
 
-def get_sheet(worksheet_name="Sheet1"):
-    client = get_gspread_client()
+def storage_config():
+    return dict(st.secrets.get("storage", {}))
+
+@st.cache_resource
+def get_storage():
+    """Chọn backend lưu trữ: Google Sheets (mặc định) hoặc SQLite cục bộ.
+
+    Cấu hình trong secrets.toml:
+        [storage]
+        backend = "sqlite"
+        path = "giatui.db"
+    Hoặc biến môi trường GIATUI_STORAGE=sqlite, GIATUI_SQLITE_PATH=... (xem datastore.py)
+    """
+    return MeasuredBackend(open_backend(storage_config(), get_gspread_client), get_metrics())
+
+@st.cache_resource
+def get_write_queue():
+    """Hàng đợi ghi chung: gom lệnh ghi của mọi phiên, tự thử lại khi gặp lỗi 429/5xx."""
+    return WriteQueue(get_storage())
+
+@st.cache_resource
+def get_journal():
+    """Nhật ký ghi cục bộ: lưu phiếu xuống đĩa trước, luồng nền đẩy lên Sheet sau.
+
+    Đường dẫn lấy từ [storage] journal hoặc GIATUI_JOURNAL; để chuỗi rỗng để tắt
+    (khi đó mỗi lần lưu chờ ghi xong lên Sheet). Nhiều tiến trình trên cùng máy thì
+    mỗi tiến trình tự nhận một file riêng (path, path.1, ...), xem open_journal.
+    """
+    return start_journal(storage_config(), get_write_queue())
+
+@st.cache_resource
+def get_snapshots():
+    """Ảnh chụp bảng dùng chung giữa các tiến trình / bản chạy trên cùng máy.
+
+    Thư mục lấy từ [storage] snapshots hoặc GIATUI_SNAPSHOTS; để chuỗi rỗng để tắt.
+    """
+    return open_snapshots(storage_config())
+
+@st.cache_resource
+def get_table(worksheet_name):
+    """Cache dùng chung mọi phiên; ghi xong thì vá thẳng vào bảng, không tải lại.
+
+    Bảng phiếu chia theo tháng (PartitionedTable): chỉ tải các tháng đang xem.
+    """
+    return open_table(get_storage(), worksheet_name, ttl=60, queue=get_write_queue(),
+                      journal=get_journal(), snapshots=get_snapshots(), metrics=get_metrics())
+
+@st.cache_resource
+def get_credentials():
+    """Chỉ mục Username -> mật khẩu đã băm, tự cập nhật theo cache Users."""
+    return CredentialIndex(get_table(USERS_SHEET))
+
+@st.cache_resource
+def get_rollups():
+    """Bảng tổng hợp ngày/tháng × khách hàng, tự cập nhật theo cache phiếu."""
+    return Rollups(get_table(INVOICES_SHEET))
+
+@st.cache_resource
+def get_analytics():
+    """Chuỗi thời gian đã gộp (tab Phân tích), tính từ bảng tổng hợp."""
+    return Analytics(get_rollups())
+
+@st.cache_resource
+def get_partitions():
+    """Phiếu chia theo khách hàng (màn hình lịch sử của khách)."""
+    return CustomerPartitions(get_table(INVOICES_SHEET))
+
+HISTORY_PAGE_SIZE = 50
+
+@st.cache_resource
+def get_search():
+    """Chỉ mục tìm phiếu theo tiền tố cho chế độ Sửa / Xóa."""
+    return InvoiceSearch(get_table(INVOICES_SHEET))
+
+SEARCH_PAGE_SIZE = 20
+
+@st.cache_resource
+def get_exports():
+    return ExportCache()
+
+EXPORT_EXTRAS = ["Theo khách hàng", "Theo mặt hàng"]
+
+def excel_report(d1, d2, extras):
+    """Trả về hàm dựng file Excel; chỉ chạy khi bấm tải về (luồng riêng của Streamlit)."""
+    extras = tuple(extras)
+
+    def build(path):
+        sheets = [("Phiếu", get_table(INVOICES_SHEET).between(d1, d2).iloc[::-1])]
+        if "Theo khách hàng" in extras:
+            sheets.append(("Theo khách hàng", get_rollups().by_customer(d1, d2)))
+        if "Theo mặt hàng" in extras:
+            items = get_rollups().totals(d1, d2)[ITEMS].astype(int)
+            sheets.append(("Theo mặt hàng", items.rename_axis("Mặt hàng").reset_index(name="Số lượng")))
+        write_workbook(path, sheets)
+
+    def data():
+        # Khóa gồm version của bảng: dữ liệu đổi thì xuất file mới
+        return get_exports().open((d1, d2, get_table(INVOICES_SHEET).version, extras), build)
+    return data
+
+def read_table(worksheet_name):
     try:
-        sheet = client.open(SHEET_NAME).worksheet(worksheet_name)
-        return sheet
-    except gspread.exceptions.WorksheetNotFound:
-        st.error(f"❌ Không tìm thấy trang tính '{worksheet_name}'.")
+        return get_table(worksheet_name).frame()
+    except StorageError as e:
+        st.error(f"❌ {e}")
         st.stop()
 
 # --- HÀM DỮ LIỆU ---
-@st.cache_data(ttl=60)
 def load_users():
-    sheet = get_sheet("Users")
-    data = sheet.get_all_records()
-    return pd.DataFrame(data)
+    return read_table(USERS_SHEET)
 
-@st.cache_data(ttl=60)
 def load_invoices():
-    sheet = get_sheet("Sheet1")
-    data = sheet.get_all_records()
-    return pd.DataFrame(data)
+    return read_table(INVOICES_SHEET)
+
+def warm_tables():
+    """Tải lần đầu: Users + Catalog chung một lệnh đọc, rồi mọi tháng phiếu chung một lệnh nữa."""
+    try:
+        invoices = get_table(INVOICES_SHEET)
+        warm([get_table(USERS_SHEET)], also=[CATALOG_SHEET] if invoices.catalog_stale else [])
+        warm(invoices.caches())
+    except StorageError as e:
+        st.error(f"❌ {e}")
+        st.stop()
+
+def load_invoices_between(d1, d2):
+    """Phiếu từ d1 đến d2 (sắp tăng dần theo ngày), cắt lát bằng tìm nhị phân."""
+    try:
+        return get_table(INVOICES_SHEET).between(d1, d2)
+    except StorageError as e:
+        st.error(f"❌ {e}")
+        st.stop()
 
 # --- HÀM NGHIỆP VỤ ---
-def authenticate(username, password, df_users):
-    df_users['Password'] = df_users['Password'].astype(str)
-    user = df_users[(df_users['Username'] == username) & (df_users['Password'] == str(password))]
-    if not user.empty:
-        return user.iloc[0]
-    return None
+def authenticate(username, password):
+    """Tra chỉ mục tài khoản trong bộ nhớ; sai quá nhiều lần thì raise LoginThrottled."""
+    try:
+        return get_credentials().authenticate(username, password, client=st.context.ip_address)
+    except StorageError as e:
+        st.error(f"❌ {e}")
+        st.stop()
 
+# Các hàm ghi trả về WriteTicket (ok / result / error / attempts) để giao diện báo kết quả
 def add_new_user(username, password, role, fullname, address):
-    sheet = get_sheet("Users")
-    new_row = [username, password, role, fullname, address]
-    sheet.append_row(new_row)
-    st.cache_data.clear()
+    new_row = [username, hash_password(password), role, fullname, address]
+    return get_table(USERS_SHEET).append(new_row)
 
 def update_user_info(username, new_data_row):
-    sheet = get_sheet("Users")
-    try:
-        cell = sheet.find(username)
-        if cell:
-            sheet.update(range_name=f"A{cell.row}", values=[new_data_row])
-            st.cache_data.clear()
-            return True
-        return False
-    except:
-        return False
+    return get_table(USERS_SHEET).update(username, new_data_row)
 
 def delete_user_by_username(username):
-    sheet = get_sheet("Users")
-    try:
-        cell = sheet.find(username)
-        if cell:
-            sheet.delete_rows(cell.row)
-            st.cache_data.clear()
-            return True
-        return False
-    except:
-        return False
+    return get_table(USERS_SHEET).delete(username)
 
 # --- QUẢN LÝ PHIẾU ---
 def save_invoice(data_row):
-    sheet = get_sheet("Sheet1")
-    sheet.append_row(data_row)
-    st.cache_data.clear()
-
-def update_invoice(old_receipt_no, data_row):
-    sheet = get_sheet("Sheet1")
-    try:
-        cell = sheet.find(str(old_receipt_no))
-        if cell:
-            sheet.update(range_name=f"A{cell.row}", values=[data_row])
-            st.cache_data.clear()
-            return True
-        return False
-    except Exception as e:
-        st.error(f"Lỗi: {e}")
-        return False
+    return get_table(INVOICES_SHEET).append(data_row)
+
+# expected: phiên bản (cột Cập nhật) của phiếu lúc mở ra; phiếu đã bị sửa ở nơi khác thì báo xung đột
+def update_invoice(old_receipt_no, data_row, expected=None):
+    return get_table(INVOICES_SHEET).update(old_receipt_no, data_row, expected=expected)
+
+def delete_invoice(receipt_no, expected=None):
+    return get_table(INVOICES_SHEET).delete(receipt_no, expected=expected)
+
+def import_invoices(rows):
+    """Ghi nhiều phiếu một lần (mỗi trang tính tháng một lệnh append_rows)."""
+    return get_table(INVOICES_SHEET).append_rows(rows)
+
+def price_rows(frame):
+    """Bảng giá -> dict khách hàng -> dòng ghi xuống Sheet (ô trống / NaN -> "")."""
+    rows = {}
+    for record in frame[PRICE_COLUMNS].itertuples(index=False):
+        customer = "" if pd.isna(record[0]) else str(record[0]).strip()
+        if customer:
+            rows.setdefault(customer, []).append(
+                [customer] + ["" if pd.isna(v) else plain_value(v) for v in record[1:]])
+    return rows
+
+def save_prices(old_frame, new_frame):
+    """Ghi phần khác nhau giữa bảng giá cũ và bảng vừa sửa; trả về (list vé ghi, lỗi hoặc None)."""
+    old, new = price_rows(old_frame), price_rows(new_frame)
+    duplicated = [customer for customer, rows in new.items() if len(rows) > 1]
+    if duplicated:
+        return [], f"Mỗi khách chỉ một dòng giá, đang trùng: {', '.join(duplicated)}"
+    table = get_table(PRICES_SHEET)
+    tickets = [table.delete(customer) for customer in old if customer not in new]
+    for customer, (row,) in new.items():
+        if customer not in old:
+            tickets.append(table.append(row))
+        elif old[customer][0] != row:
+            tickets.append(table.update(customer, row))
+    return tickets, None
+
+def is_invoice_sheet(name):
+    return name == INVOICES_SHEET or is_partition(name)
+
+def sync_label(entry):
+    """Số phiếu (trang phiếu), khóa, hoặc ô đầu của dòng (vd. tên trang trong Catalog)."""
+    if entry.row and (is_invoice_sheet(entry.name) or entry.key is None):
+        return str(entry.row[1] if is_invoice_sheet(entry.name) else entry.row[0])
+    return str(entry.key)
+
+def render_sync_status():
+    """Các phiếu đã lưu cục bộ nhưng chưa lên Sheet, và các thao tác bị lỗi."""
+    journal = get_journal()
+    if journal is None:
+        return
+    pending = journal.pending()
+    if pending:
+        labels = [sync_label(e) for e in pending]
+        st.info(f"⏳ {len(pending)} thao tác đang chờ đồng bộ lên Sheet: {', '.join(labels)}")
+    for entry in journal.failed():
+        c_msg, c_btn = st.columns([4, 1])
+        label = sync_label(entry)
+        c_msg.error(f"Không đồng bộ được ({entry.op} {label}): {entry.error}")
+        if c_btn.button("Bỏ qua", key=f"dismiss_{entry.seq}"):
+            journal.dismiss(entry.seq)
+            st.rerun()
 
-def delete_invoice(receipt_no):
-    sheet = get_sheet("Sheet1")
+def report_write(ticket, success_msg, missing_msg="Không tìm thấy dữ liệu cần ghi."):
+    """Báo kết quả ghi: thành công thì chạy lại trang và hiện thông báo, lỗi thì báo ngay."""
+    if ticket.ok and ticket.result:
+        st.session_state.flash = success_msg
+        st.rerun()
+    elif ticket.ok:
+        st.error(missing_msg)
+    elif isinstance(ticket.error, RevisionConflict):
+        st.warning(f"⚠️ {ticket.error} Hãy chọn lại phiếu để xem bản mới nhất rồi sửa lại.")
+    else:
+        st.error(f"Lỗi ghi dữ liệu (đã thử {ticket.attempts} lần): {ticket.error}")
+
+IMPORT_MODE = "📥 Nhập từ file"
+IMPORT_PREVIEW_ROWS = 50
+
+def render_import(customers_list):
+    """Nhập hàng loạt: tải file, xem lỗi từng dòng, ghi các dòng hợp lệ một lần."""
+    # Đổi key sau mỗi lần nhập xong để ô tải file trống lại
+    upload = st.file_uploader("File bảng kê (CSV / Excel)", type=["csv", "xlsx"],
+                              key=f"import_{st.session_state.get('import_round', 0)}")
+    if upload is None:
+        st.caption("Cột bắt buộc: Ngày, Số phiếu, Khách hàng. Cột mặt hàng và Tổng Kg đặt tên như trong phiếu.")
+        return
     try:
-        cell = sheet.find(str(receipt_no))
-        if cell:
-            sheet.delete_rows(cell.row)
-            st.cache_data.clear()
-            return True
-        return False
-    except Exception as e:
-        st.error(f"Lỗi khi xóa: {e}")
-        return False
+        frame, unused = map_columns(read_upload(upload.getvalue(), upload.name))
+    except ImportFileError as e:
+        st.error(f"❌ {e}")
+        return
+    customers = dict(zip(customers_list['FullName'], customers_list['Address']))
+    existing = get_table(INVOICES_SHEET).frame_ref()['Số phiếu']
+    rows, errors = validate_invoices(frame, customers, existing)
+
+    if unused:
+        st.caption(f"Bỏ qua các cột: {', '.join(map(str, unused))}")
+    c1, c2 = st.columns(2)
+    c1.metric("Dòng hợp lệ", len(rows))
+    c2.metric("Dòng lỗi", len(errors))
+    if len(errors):
+        st.dataframe(errors, hide_index=True, use_container_width=True)
+    if not rows:
+        return
+    st.caption(f"Xem trước {min(len(rows), IMPORT_PREVIEW_ROWS)} / {len(rows)} phiếu hợp lệ")
+    st.dataframe(pd.DataFrame(rows[:IMPORT_PREVIEW_ROWS], columns=INVOICE_COLUMNS),
+                 hide_index=True, use_container_width=True)
+    if st.button(f"📥 Nhập {len(rows)} phiếu hợp lệ", type="primary"):
+        tickets = import_invoices(rows)
+        failed = [t for t in tickets if not t.ok]
+        if failed:
+            st.error(f"Lỗi ghi {len(failed)} / {len(tickets)} phiếu: {failed[0].error}")
+        else:
+            st.session_state.import_round = st.session_state.get('import_round', 0) + 1
+            st.session_state.flash = f"Đã nhập {len(tickets)} phiếu!"
+            st.rerun()
 
 # --- VIEW HÓA ĐƠN HTML (FINAL FIX) ---
 def render_invoice_html(data):
-    """Tạo mã HTML hiển thị phiếu - Phiên bản không thụt dòng để tránh lỗi hiển thị"""
-    items_html = ""
-    stt = 1
-    
-    # Tạo các dòng sản phẩm (Viết liền một dòng để tránh lỗi)
-    for item in ITEMS:
-        qty = data.get(item, 0)
-        try:
-            qty_val = int(qty)
-        except:
-            qty_val = 0
-            
-        if qty_val > 0:
-            items_html += f"<tr><td style='text-align:center'>{stt}</td><td>{item}</td><td style='text-align:center'>{qty_val}</td><td></td><td></td></tr>"
-            stt += 1
-    
-    # Lấp đầy bảng cho đủ dòng
-    while stt <= 10:
-         items_html += f"<tr><td style='text-align:center'>{stt}</td><td></td><td></td><td></td><td></td></tr>"
-         stt += 1
-
-    date_obj = pd.to_datetime(data['Ngày'])
-    day, month, year = date_obj.day, date_obj.month, date_obj.year
-
-    # HTML viết sát lề trái tuyệt đối
-    html_content = f"""
-<div class="printable-area invoice-box">
-<div style="display:flex; align-items:center;">
-<div style="flex:1;">
-<img src="https://cdn-icons-png.flaticon.com/512/2983/2983720.png" width="60" style="float:left; margin-right:10px;">
-<b style="color:#003366">CÔNG TY TNHH GIẶT ỦI HẢI ÂU MŨI NÉ</b><br>
-<small>Thôn Thiện Sơn, Phường Mũi Né, Tỉnh Lâm Đồng</small><br>
-<small>Hotline: 037 808 2088 / 0908 848 393</small>
-</div>
-</div>
-<hr>
-<div class="invoice-header">
-<h2>PHIẾU GIAO HÀNG SẠCH</h2>
-<span>Số: <b style="color:red; font-size:1.2em">{data['Số phiếu']}</b></span>
-</div>
-<table style="width:100%; margin-bottom:10px;">
-<tr>
-<td><b>Tên khách hàng:</b> {data['Khách hàng']}</td>
-<td style="text-align:right"><b>Loại hàng:</b> Hàng Sạch</td>
-</tr>
-<tr>
-<td colspan="2"><b>Địa chỉ:</b> {data['Địa chỉ']}</td>
-</tr>
-</table>
-<table class="invoice-table">
-<thead>
-<tr>
-<th style="width:50px">STT</th>
-<th>Tên mặt hàng</th>
-<th style="width:100px">Số lượng</th>
-<th style="width:150px">Tình trạng</th>
-<th>Ghi chú</th>
-</tr>
-</thead>
-<tbody>
-{items_html}
-</tbody>
-</table>
-<div class="total-section">
-Tổng Cộng (Kg): {data['Tổng Kg']} Kg
-</div>
-<div style="margin-top:10px;">
-<i>Ghi chú chung: {data['Ghi chú']}</i>
-</div>
-<div style="text-align:right; margin-top:20px;">
-<i>Ngày {day} tháng {month} năm {year}</i>
-</div>
-<div class="signature-section">
-<div>
-<b>Người nhận hàng</b><br>
-<i>(Ký, họ tên)</i>
-<br><br><br><br>
-</div>
-<div>
-<b>Người giao hàng</b><br>
-<i>(Ký, họ tên)</i>
-<br><br><br><br>
-</div>
-<div>
-<b>Người lập phiếu</b><br>
-<i>(Ký, họ tên)</i>
-<br><br><br><br>
-
-</div>
-</div>
-</div>
-"""
-    return html_content
-
-# --- GIAO DIỆN LOGIN ---
-if 'logged_in' not in st.session_state:
-    st.session_state.logged_in = False
-    st.session_state.user_info = None
-
-if not st.session_state.logged_in:
-    col1, col2, col3 = st.columns([1, 1, 1])
-    with col2:
-        st.title("🔐 Đăng Nhập")
-        with st.form("login"):
-            u = st.text_input("Username")
-            p = st.text_input("Password", type="password")
-            if st.form_submit_button("Vào hệ thống"):
-                st.cache_data.clear()
-                users = load_users()
-                user = authenticate(u, p, users)
-                if user is not None:
-                    st.session_state.logged_in = True
-                    st.session_state.user_info = user
-                    st.success("OK!")
-                    st.rerun()
-                else:
-                    st.error("Sai thông tin")
-    st.stop()
-
-# --- MAIN APP ---
-user = st.session_state.user_info
-role = user['Role']
-full_name = user['FullName']
-
-with st.sidebar:
-    st.image("https://cdn-icons-png.flaticon.com/512/3003/3003984.png", width=80)
-    st.markdown(f"**Xin chào, {full_name}**")
-    st.caption(f"Vai trò: {role.upper()}")
-    if st.button("Đăng xuất"):
-        st.session_state.logged_in = False
+    """Tạo mã HTML hiển thị phiếu (mẫu dựng sẵn trong receipts.py)"""
+    return render_receipt(receipt_fields(data))
+
+def batch_print_document(d1, d2, receipt_nos):
+    """Hàm dựng file in hàng loạt (chạy khi bấm tải): các phiếu đã chọn, hoặc cả khoảng ngày."""
+    receipt_nos = list(receipt_nos)
+
+    def data():
+        frame = get_table(INVOICES_SHEET).between(d1, d2)
+        if receipt_nos:
+            frame = frame[frame['Số phiếu'].isin(receipt_nos)]
+        return print_document(frame, title=f"Phiếu giao hàng {d1:%d/%m/%Y} - {d2:%d/%m/%Y}")
+    return data
+
+@st.fragment
+def render_performance(metrics):
+    """Tab Hiệu năng: thời gian từng lượt chạy, tách theo API / backend / giao diện, và bảng tổng hợp."""
+    runs = metrics.runs_frame()
+    if runs.empty:
+        st.info("Chưa có số đo.")
+        return
+    recent = runs.tail(PERF_RECENT_RUNS)
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("Lượt trước (ms)", f"{recent['Tổng ms'].iloc[-2]:.0f}" if len(recent) > 1 else "-")
+    c2.metric(f"Trung vị {len(recent)} lượt (ms)", f"{recent['Tổng ms'].median():.0f}")
+    c3.metric("Lệnh API", int(recent['Lệnh API'].sum()))
+    cached = recent['Cache có sẵn'].sum()
+    c4.metric("Cache có sẵn", f"{cached / max(cached + recent['Cache tải / đồng bộ'].sum(), 1):.0%}")
+
+    st.dataframe(recent.iloc[::-1], hide_index=True, use_container_width=True)
+    run_id = st.selectbox("Chi tiết lượt", recent['Lượt'].iloc[::-1].tolist())
+    events = metrics.run_events(run_id)
+    if not events.empty:
+        breakdown = events.groupby(["Loại", "Tên"], as_index=False)["ms"].agg(["count", "sum"])
+        breakdown = breakdown.rename(columns={"count": "Số lần", "sum": "ms"}).sort_values("ms", ascending=False)
+        st.bar_chart(breakdown, x="Tên", y="ms", color="Loại", horizontal=True)
+        st.dataframe(breakdown.round(1), hide_index=True, use_container_width=True)
+
+    st.markdown("**Tổng hợp theo loại**")
+    st.dataframe(metrics.summary_frame(), hide_index=True, use_container_width=True)
+    if st.button("Xóa số đo"):
+        metrics.clear()
         st.rerun()
 
-st.title("HỆ THỐNG QUẢN LÝ GIẶT ỦI")
-
-# === ADMIN: QUẢN LÝ KHÁCH & NHÂN VIÊN ===
-if role == 'admin':
-    tab1, tab2, tab3 = st.tabs(["📊 Báo cáo & In", "📝 Nhập/Sửa/Xóa Phiếu", "👥 Quản trị Người dùng"])
+PERF_RECENT_RUNS = 50
+
+# --- CÁC PHẦN GIAO DIỆN (st.fragment) ---
+# Mỗi phần là một fragment tự tải dữ liệu của mình: đổi widget trong phần
+# nào thì chỉ phần đó chạy lại. Ghi dữ liệu xong report_write vẫn
+# st.rerun() cả trang để các phần khác thấy dữ liệu mới.
+def panel(name):
+    """Biến hàm vẽ thành fragment có đo thời gian; fragment chạy lại một mình được tính là một lượt riêng."""
+    def wrap(render):
+        @functools.wraps(render)
+        def run(*args, **kwargs):
+            metrics = get_metrics()
+            with metrics.run_scope(f"{st.session_state.user_info['Username']} ({name})"), metrics.phase(name):
+                return render(*args, **kwargs)
+        return st.fragment(run)
+    return wrap
+
+@panel("Quản trị người dùng")
+def users_panel(me):
+    st.subheader("Quản lý tài khoản (Nhân viên & Khách)")
     
-    # --- TAB QUẢN TRỊ USER ---
-    with tab3:
-        st.subheader("Quản lý tài khoản (Nhân viên & Khách)")
-        
-        col_user1, col_user2 = st.columns(2)
-        
-        # 1. Thêm mới
-        with col_user1:
-            with st.form("add_user_form"):
-                st.markdown("#### ✨ Thêm người dùng mới")
-                new_u = st.text_input("Tên đăng nhập (Username)")
-                new_p = st.text_input("Mật khẩu", type="password")
-                new_role = st.selectbox("Vai trò", ["customer", "staff", "admin"], help="Customer: Chỉ xem lịch sử | Staff: Nhập liệu | Admin: Toàn quyền")
-                new_fn = st.text_input("Tên hiển thị (Tên Khách/NV)")
-                new_ad = st.text_input("Địa chỉ (Cho khách hàng)")
-                
-                if st.form_submit_button("Tạo tài khoản"):
-                    if new_u and new_fn:
-                        add_new_user(new_u, new_p, new_role, new_fn, new_ad)
-                        st.success(f"Đã tạo user {new_u}!")
-                        time.sleep(1)
-                        st.rerun()
-
-        # 2. Sửa/Xóa User
-        with col_user2:
-            st.markdown("#### 🛠 Sửa / Xóa người dùng")
-            df_users = load_users()
-            user_list = df_users['Username'].tolist()
-            selected_u = st.selectbox("Chọn tài khoản cần sửa:", user_list)
+    col_user1, col_user2 = st.columns(2)
+    
+    # 1. Thêm mới
+    with col_user1:
+        with st.form("add_user_form"):
+            st.markdown("#### ✨ Thêm người dùng mới")
+            new_u = st.text_input("Tên đăng nhập (Username)")
+            new_p = st.text_input("Mật khẩu", type="password")
+            new_role = st.selectbox("Vai trò", ["customer", "staff", "admin"], help="Customer: Chỉ xem lịch sử | Staff: Nhập liệu | Admin: Toàn quyền")
+            new_fn = st.text_input("Tên hiển thị (Tên Khách/NV)")
+            new_ad = st.text_input("Địa chỉ (Cho khách hàng)")
             
-            if selected_u:
-                # Lấy info cũ
-                curr_info = df_users[df_users['Username'] == selected_u].iloc[0]
-                
-                with st.form("edit_user_form"):
-                    e_pass = st.text_input("Mật khẩu mới (Để trống nếu không đổi)", type="password")
-                    e_role = st.selectbox("Vai trò", ["customer", "staff", "admin"], index=["customer", "staff", "admin"].index(curr_info['Role']))
-                    e_fn = st.text_input("Tên hiển thị", value=curr_info['FullName'])
-                    e_ad = st.text_input("Địa chỉ", value=curr_info['Address'])
-                    
-                    c_btn1, c_btn2 = st.columns(2)
-                    save_changes = c_btn1.form_submit_button("Lưu thay đổi")
-                    delete_user = c_btn2.form_submit_button("🗑 XÓA USER NÀY", type="primary")
-                    
-                    if save_changes:
-                        final_pass = e_pass if e_pass else curr_info['Password']
-                        update_user_info(selected_u, [selected_u, final_pass, e_role, e_fn, e_ad])
-                        st.success("Cập nhật thành công!")
-                        time.sleep(1)
-                        st.rerun()
-                        
-                    if delete_user:
-                        if selected_u == user['Username']:
-                            st.error("Không thể tự xóa chính mình!")
-                        else:
-                            delete_user_by_username(selected_u)
-                            st.warning(f"Đã xóa {selected_u}")
-                            time.sleep(1)
-                            st.rerun()
-        
-        st.markdown("---")
-        st.dataframe(df_users, use_container_width=True)
-
-# === STAFF/ADMIN: NHẬP LIỆU ===
-if role in ['staff', 'admin']:
-    # Xác định vị trí hiển thị: Nếu là admin thì tab 2, staff thì trang chính
-    container = tab2 if role == 'admin' else st.container()
-
-    with container:
-        mode = st.radio("Chế độ:", ["✨ Nhập phiếu mới", "🛠 Sửa / Xóa phiếu cũ"], horizontal=True)
-        
-        # Biến khởi tạo
-        default_date = date.today()
-        default_receipt = ""
-        default_customer_idx = 0
-        default_address = ""
-        default_note = ""
-        default_total_kg = 0.0
-        default_items_qty = [0] * len(ITEMS)
-        target_receipt_to_update = None
-        editor_key_suffix = "new"
-
+            if st.form_submit_button("Tạo tài khoản"):
+                if new_u and new_fn:
+                    ticket = add_new_user(new_u, new_p, new_role, new_fn, new_ad)
+                    report_write(ticket, f"Đã tạo user {new_u}!")
+
+    # 2. Sửa/Xóa User
+    with col_user2:
+        st.markdown("#### 🛠 Sửa / Xóa người dùng")
         df_users = load_users()
-        customers_list = df_users[df_users['Role'] == 'customer']
-        customer_names = customers_list['FullName'].tolist()
-
-        if mode == "🛠 Sửa / Xóa phiếu cũ":
-            col_search, col_act = st.columns([3, 1])
-            all_invoices = load_invoices()
+        user_list = df_users['Username'].tolist()
+        selected_u = st.selectbox("Chọn tài khoản cần sửa:", user_list)
+        
+        if selected_u:
+            # Lấy info cũ
+            curr_info = df_users[df_users['Username'] == selected_u].iloc[0]
             
-            if not all_invoices.empty:
-                all_invoices['Display'] = all_invoices['Ngày'].astype(str) + " - Số: " + all_invoices['Số phiếu'].astype(str) + " - " + all_invoices['Khách hàng']
-                invoice_options = all_invoices['Display'].tolist()[::-1]
+            with st.form("edit_user_form"):
+                e_pass = st.text_input("Mật khẩu mới (Để trống nếu không đổi)", type="password")
+                e_role = st.selectbox("Vai trò", ["customer", "staff", "admin"], index=["customer", "staff", "admin"].index(curr_info['Role']))
+                e_fn = st.text_input("Tên hiển thị", value=curr_info['FullName'])
+                e_ad = st.text_input("Địa chỉ", value=curr_info['Address'])
                 
-                selected_invoice_str = col_search.selectbox("Tìm phiếu cần xử lý:", invoice_options)
+                c_btn1, c_btn2 = st.columns(2)
+                save_changes = c_btn1.form_submit_button("Lưu thay đổi")
+                delete_user = c_btn2.form_submit_button("🗑 XÓA USER NÀY", type="primary")
                 
-                if selected_invoice_str:
-                    editor_key_suffix = str(hash(selected_invoice_str))
-                    row_data = all_invoices[all_invoices['Display'] == selected_invoice_str].iloc[0]
-                    target_receipt_to_update = str(row_data['Số phiếu'])
-                    
-                    # Fill dữ liệu cũ vào form
-                    try:
-                        default_date = datetime.strptime(str(row_data['Ngày']), "%Y-%m-%d").date()
-                    except: default_date = date.today()
-                    
-                    default_receipt = str(row_data['Số phiếu'])
-                    if row_data['Khách hàng'] in customer_names:
-                        default_customer_idx = customer_names.index(row_data['Khách hàng'])
-                    default_address = row_data['Địa chỉ']
-                    default_note = row_data['Ghi chú']
-                    default_total_kg = float(row_data['Tổng Kg']) if row_data['Tổng Kg'] else 0.0
+                if save_changes:
+                    final_pass = hash_password(e_pass) if e_pass else curr_info['Password']
+                    ticket = update_user_info(selected_u, [selected_u, final_pass, e_role, e_fn, e_ad])
+                    report_write(ticket, "Cập nhật thành công!", f"Không tìm thấy user {selected_u}.")
                     
-                    loaded_qtys = []
-                    for item in ITEMS:
-                        val = row_data.get(item, 0)
-                        try: loaded_qtys.append(int(val))
-                        except: loaded_qtys.append(0)
-                    default_items_qty = loaded_qtys
-                    
-                    # NÚT XÓA PHIẾU
-                    with col_act:
-                        st.write("") # Spacer
-                        st.write("")
-                        if st.button("🗑 XÓA PHIẾU NÀY", type="primary"):
-                            delete_invoice(target_receipt_to_update)
-                            st.success("Đã xóa phiếu thành công!")
-                            time.sleep(1)
-                            st.rerun()
+                if delete_user:
+                    if selected_u == me:
+                        st.error("Không thể tự xóa chính mình!")
+                    else:
+                        ticket = delete_user_by_username(selected_u)
+                        report_write(ticket, f"Đã xóa {selected_u}", f"Không tìm thấy user {selected_u}.")
+    
+    st.markdown("---")
+    st.dataframe(df_users.drop(columns=["Password"]), use_container_width=True)
 
+@panel("Nhập / sửa phiếu")
+def invoice_panel():
+    mode = st.radio("Chế độ:", ["✨ Nhập phiếu mới", "🛠 Sửa / Xóa phiếu cũ", IMPORT_MODE], horizontal=True)
+    render_sync_status()
+    
+    # Biến khởi tạo
+    default_date = date.today()
+    default_receipt = ""
+    default_customer_idx = 0
+    default_address = ""
+    default_note = ""
+    default_total_kg = 0.0
+    default_items_qty = [0] * len(ITEMS)
+    target_receipt_to_update = None
+    target_revision = None
+    editor_key_suffix = "new"
+
+    df_users = load_users()
+    customers_list = df_users[df_users['Role'] == 'customer']
+    customer_names = customers_list['FullName'].tolist()
+
+    if mode == "🛠 Sửa / Xóa phiếu cũ":
+        col_search, col_act = st.columns([3, 1])
+        # Tìm theo tiền tố (số phiếu / tên khách / ngày), chỉ hiện một trang kết quả
+        query = col_search.text_input("Tìm phiếu (số phiếu, tên khách hoặc ngày dd/mm/yyyy):")
+        searcher = get_search()
+        results, total = searcher.search(query, page=1, per_page=SEARCH_PAGE_SIZE)
+        pages = max(math.ceil(total / SEARCH_PAGE_SIZE), 1)
+        if pages > 1:
+            page = col_act.number_input(f"Trang / {pages}", min_value=1, max_value=pages, value=1)
+            if page > 1:
+                results, total = searcher.search(query, page=page, per_page=SEARCH_PAGE_SIZE)
+
+        def describe(hit):
+            day = hit['day'].strftime('%Y-%m-%d') if hit['day'] is not None else "?"
+            return f"{day} - Số: {hit['key']} - {hit['customer']}"
+
+        hit = col_search.selectbox(f"Tìm thấy {total} phiếu:", results, format_func=describe) if results else None
+        row_data = searcher.row(hit['key'], hit['day']) if hit else None
+
+        if row_data is not None:
+            target_revision = str(row_data[REVISION_COLUMN])
+            # Phiếu đổi phiên bản (vừa được sửa) thì bảng nhập nạp lại số lượng mới
+            editor_key_suffix = f"{hit['key']}_{hit['day']}_{target_revision}"
+            target_receipt_to_update = str(row_data['Số phiếu'])
+            
+            # Fill dữ liệu cũ vào form
+            default_date = row_data['Ngày'].date() if pd.notna(row_data['Ngày']) else date.today()
+            
+            default_receipt = str(row_data['Số phiếu'])
+            if row_data['Khách hàng'] in customer_names:
+                default_customer_idx = customer_names.index(row_data['Khách hàng'])
+            default_address = row_data['Địa chỉ']
+            default_note = row_data['Ghi chú']
+            default_total_kg = float(row_data['Tổng Kg']) if row_data['Tổng Kg'] else 0.0
+            
+            loaded_qtys = []
+            for item in ITEMS:
+                val = row_data.get(item, 0)
+                try: loaded_qtys.append(int(val))
+                except: loaded_qtys.append(0)
+            default_items_qty = loaded_qtys
+            
+            # NÚT XÓA PHIẾU
+            with col_act:
+                st.write("") # Spacer
+                st.write("")
+                if st.button("🗑 XÓA PHIẾU NÀY", type="primary"):
+                    ticket = delete_invoice(target_receipt_to_update, target_revision)
+                    report_write(ticket, "Đã xóa phiếu thành công!", "Không tìm thấy phiếu cần xóa.")
+
+    if mode == IMPORT_MODE:
+        render_import(customers_list)
+    else:
         # FORM NHẬP / SỬA
         form_key = "new_form" if mode == "✨ Nhập phiếu mới" else "edit_form"
         with st.form(form_key):
@@ -506,15 +574,15 @@ if role in ['staff', 'admin']:
             input_date = c1.date_input("Ngày", value=default_date)
             receipt_no = c2.text_input("Số phiếu", value=default_receipt)
             selected_customer = c3.selectbox("Khách hàng", customer_names, index=default_customer_idx)
-            
+        
             # Logic địa chỉ
             curr_addr = default_address
             if mode == "✨ Nhập phiếu mới" and selected_customer:
                 match = customers_list[customers_list['FullName'] == selected_customer]
                 if not match.empty: curr_addr = match.iloc[0]['Address']
-            
+        
             address = st.text_input("Địa chỉ", value=curr_addr)
-            
+        
             # Bảng nhập liệu
             st.markdown("---")
             input_df = pd.DataFrame({"Tên mặt hàng": ITEMS, "Số lượng": default_items_qty})
@@ -527,7 +595,7 @@ if role in ['staff', 'admin']:
                 hide_index=True, use_container_width=True, height=500,
                 key=f"editor_{mode}_{editor_key_suffix}"
             )
-            
+        
             c_bot1, c_bot2 = st.columns([1, 2])
             total_weight = c_bot1.number_input("TỔNG KG", min_value=0.0, format="%.1f", value=default_total_kg)
             note = c_bot2.text_area("Ghi chú", value=default_note, height=1)
@@ -542,88 +610,294 @@ if role in ['staff', 'admin']:
                         input_date.strftime("%Y-%m-%d"), receipt_no, selected_customer, address, note, total_weight
                     ]
                     for item in ITEMS: row_data.append(qty_map.get(item, 0))
-                    
+                
                     if mode == "✨ Nhập phiếu mới":
-                        save_invoice(row_data)
-                        st.success(f"Đã tạo phiếu {receipt_no}!")
+                        ticket = save_invoice(row_data)
+                        report_write(ticket, f"Đã tạo phiếu {receipt_no}!")
                     else:
                         if target_receipt_to_update:
-                            update_invoice(target_receipt_to_update, row_data)
-                            st.success(f"Đã cập nhật phiếu {receipt_no}!")
+                            ticket = update_invoice(target_receipt_to_update, row_data, target_revision)
+                            report_write(ticket, f"Đã cập nhật phiếu {receipt_no}!", "Lỗi xác định phiếu gốc.")
                         else: st.error("Lỗi xác định phiếu gốc.")
-                    time.sleep(1)
-                    st.rerun()
 
-# === TAB BÁO CÁO & IN (ADMIN) ===
-if role == 'admin':
-    with tab1:
-        st.subheader("Báo cáo & In Hóa Đơn")
-        if st.button("🔄 Làm mới dữ liệu"):
-            st.cache_data.clear()
-            st.rerun()
+REPORT_PAGE_SIZE = 100
 
-        df = load_invoices()
-        if not df.empty:
-            df['Ngày'] = pd.to_datetime(df['Ngày'])
-            
-            # 1. Bộ lọc
-            c_date1, c_date2 = st.columns(2)
-            d1 = c_date1.date_input("Từ ngày", value=date.today().replace(day=1))
-            d2 = c_date2.date_input("Đến ngày", value=date.today())
-            
-            mask = (df['Ngày'].dt.date >= d1) & (df['Ngày'].dt.date <= d2)
-            filtered_df = df.loc[mask].sort_values(by='Ngày', ascending=False)
+@panel("Báo cáo")
+def report_panel():
+    st.subheader("Báo cáo & In Hóa Đơn")
+    if st.button("🔄 Làm mới dữ liệu"):
+        get_table(INVOICES_SHEET).invalidate()
+        st.rerun()
+
+    # 1. Bộ lọc
+    c_date1, c_date2 = st.columns(2)
+    d1 = c_date1.date_input("Từ ngày", value=date.today().replace(day=1))
+    d2 = c_date2.date_input("Đến ngày", value=date.today())
+
+    # Bảng đã sắp theo ngày -> chỉ cần đảo ngược lát cắt để phiếu mới nhất lên đầu
+    filtered_df = load_invoices_between(d1, d2).iloc[::-1]
+
+    # Thống kê nhanh: lấy từ bảng tổng hợp, không cộng lại từng phiếu
+    rollups = get_rollups()
+    totals = rollups.totals(d1, d2)
+    m1, m2 = st.columns(2)
+    m1.metric("Số phiếu", int(totals['Số phiếu']))
+    m2.metric("Tổng lượng", f"{totals['Tổng Kg']:,.1f} Kg")
+
+    with st.expander("📈 Tổng hợp theo khách hàng / mặt hàng / tháng"):
+        r_cus, r_item, r_month = st.tabs(["Theo khách hàng", "Theo mặt hàng", "Theo tháng"])
+        r_cus.dataframe(rollups.by_customer(d1, d2), use_container_width=True, hide_index=True)
+        item_totals = totals[ITEMS].astype(int)
+        r_item.dataframe(item_totals[item_totals > 0].rename("Số lượng"), use_container_width=True)
+        r_month.dataframe(rollups.monthly(d1, d2).assign(Tháng=lambda m: m['Tháng'].dt.strftime('%m/%Y')),
+                          use_container_width=True, hide_index=True)
+    
+    # --- HIỂN THỊ DANH SÁCH (ĐÃ KHÔI PHỤC) ---
+    # Chỉ gửi một trang lên trình duyệt, không gửi cả khoảng ngày
+    st.markdown("### 📋 Danh sách đơn hàng chi tiết")
+    pages = max(math.ceil(len(filtered_df) / REPORT_PAGE_SIZE), 1)
+    page = st.number_input(f"Trang / {pages} (tổng {len(filtered_df)} phiếu)", min_value=1, max_value=pages,
+                           value=1, key="report_page") if pages > 1 else 1
+    st.dataframe(filtered_df.iloc[(page - 1) * REPORT_PAGE_SIZE:page * REPORT_PAGE_SIZE], use_container_width=True)
+    
+    # 2. Danh sách phiếu để chọn IN
+    st.markdown("---")
+    st.markdown("### 🖨 In hóa đơn")
+    if not filtered_df.empty:
+        # Tạo cột display để selectbox
+        filtered_df['Display_Print'] = filtered_df['Ngày'].dt.strftime('%d/%m') + " - Số: " + filtered_df['Số phiếu'].astype(str) + " - " + filtered_df['Khách hàng'].astype(str)
+        
+        c_sel, c_view = st.columns([3, 1])
+        
+        # Thêm lựa chọn mặc định để không hiện hóa đơn ngay lập tức
+        options = ["-- Chọn phiếu cần in --"] + filtered_df['Display_Print'].tolist()
+        print_selection = c_sel.selectbox("Tìm và chọn phiếu:", options)
+        
+        # Nút xuất Excel: file chỉ được tạo khi bấm tải (và được cache theo khoảng ngày + dữ liệu)
+        extras = c_view.multiselect("Kèm trang", EXPORT_EXTRAS, placeholder="Kèm trang tổng hợp", label_visibility="collapsed")
+        c_view.download_button("📥 Xuất Excel", excel_report(d1, d2, extras), "baocao.xlsx", XLSX_MIME, on_click="ignore")
+
+        # In hàng loạt: một file HTML, mỗi phiếu một trang (để trống = mọi phiếu trong khoảng ngày)
+        c_batch, c_batch_btn = st.columns([3, 1])
+        batch_selection = c_batch.multiselect("In hàng loạt (để trống = tất cả phiếu đang lọc):", filtered_df['Display_Print'].tolist())
+        batch_nos = filtered_df.loc[filtered_df['Display_Print'].isin(batch_selection), 'Số phiếu'].astype(str).tolist()
+        c_batch_btn.download_button(f"🖨 In {len(batch_nos) or len(filtered_df)} phiếu", batch_print_document(d1, d2, batch_nos),
+                                    f"phieu_giao_hang_{d1:%Y%m%d}_{d2:%Y%m%d}.html", "text/html", on_click="ignore")
+
+        # 3. Hiển thị mẫu in
+        if print_selection and print_selection != "-- Chọn phiếu cần in --":
+            st.markdown("---")
+            # Lấy dòng dữ liệu được chọn
+            selected_row = filtered_df[filtered_df['Display_Print'] == print_selection].iloc[0]
             
-            # Thống kê nhanh
-            m1, m2 = st.columns(2)
-            m1.metric("Số phiếu", len(filtered_df))
-            m2.metric("Tổng lượng", f"{filtered_df['Tổng Kg'].sum() if not filtered_df.empty else 0:,.1f} Kg")
+            # Render HTML
+            invoice_html = render_invoice_html(selected_row)
             
-            # --- HIỂN THỊ DANH SÁCH (ĐÃ KHÔI PHỤC) ---
-            st.markdown("### 📋 Danh sách đơn hàng chi tiết")
-            st.dataframe(filtered_df, use_container_width=True)
+            st.info("💡 Mẹo: Nhấn Ctrl + P (hoặc Command + P) để in trang này thành PDF. Hệ thống sẽ tự động ẩn các thanh menu, chỉ in phần hóa đơn.")
             
-            # 2. Danh sách phiếu để chọn IN
-            st.markdown("---")
-            st.markdown("### 🖨 In hóa đơn")
-            if not filtered_df.empty:
-                # Tạo cột display để selectbox
-                filtered_df['Display_Print'] = filtered_df['Ngày'].dt.strftime('%d/%m') + " - Số: " + filtered_df['Số phiếu'].astype(str) + " - " + filtered_df['Khách hàng']
-                
-                c_sel, c_view = st.columns([3, 1])
-                
-                # Thêm lựa chọn mặc định để không hiện hóa đơn ngay lập tức
-                options = ["-- Chọn phiếu cần in --"] + filtered_df['Display_Print'].tolist()
-                print_selection = c_sel.selectbox("Tìm và chọn phiếu:", options)
-                
-                # Nút xuất Excel
-                buffer = io.BytesIO()
-                with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                    # Bỏ cột Display_Print khi xuất excel để file đẹp hơn
-                    filtered_df.drop(columns=['Display_Print'], errors='ignore').to_excel(writer, index=False)
-                c_view.download_button("📥 Xuất Excel", buffer.getvalue(), "baocao.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-                
-                # 3. Hiển thị mẫu in
-                if print_selection and print_selection != "-- Chọn phiếu cần in --":
-                    st.markdown("---")
-                    # Lấy dòng dữ liệu được chọn
-                    selected_row = filtered_df[filtered_df['Display_Print'] == print_selection].iloc[0]
-                    
-                    # Render HTML
-                    invoice_html = render_invoice_html(selected_row)
-                    
-                    st.info("💡 Mẹo: Nhấn Ctrl + P (hoặc Command + P) để in trang này thành PDF. Hệ thống sẽ tự động ẩn các thanh menu, chỉ in phần hóa đơn.")
-                    
-                    # Hiển thị khung hóa đơn
-                    st.markdown(invoice_html, unsafe_allow_html=True)
+            # Hiển thị khung hóa đơn
+            st.markdown(invoice_html, unsafe_allow_html=True)
+    else:
+        st.warning("Không có phiếu nào trong khoảng thời gian này.")
+
+ANALYTICS_YEARS = 2
+
+@panel("Phân tích")
+def analytics_panel():
+    st.subheader("Phân tích sản lượng")
+    today = date.today()
+    c1, c2, c3, c4 = st.columns([1, 1, 1, 2])
+    d1 = c1.date_input("Từ ngày", value=today.replace(year=today.year - ANALYTICS_YEARS, day=1), key="analytics_from")
+    d2 = c2.date_input("Đến ngày", value=today, key="analytics_to")
+    wanted = c3.selectbox("Gộp theo", LEVELS, index=1)
+    df_users = load_users()
+    customer = c4.selectbox("Khách hàng", ["Tất cả"] + df_users[df_users['Role'] == 'customer']['FullName'].tolist())
+    who = None if customer == "Tất cả" else customer
+
+    # Mọi biểu đồ lấy từ chuỗi đã gộp sẵn (vài trăm điểm), không từ từng phiếu
+    analytics = get_analytics()
+    volume = analytics.volume(d1, d2, wanted, who)
+    level = volume.index.name
+    if level != wanted:
+        st.caption(f"Khoảng ngày dài: gộp theo {level.lower()} để mỗi biểu đồ không quá {MAX_POINTS} điểm.")
+    if not volume['Số phiếu'].sum():
+        st.info("Không có phiếu nào trong khoảng thời gian này.")
+        return
+
+    m1, m2, m3, m4 = st.columns(4)
+    m1.metric("Tổng lượng", f"{volume['Tổng Kg'].sum():,.1f} Kg")
+    m2.metric(f"Trung bình mỗi {level.lower()}", f"{volume['Tổng Kg'].mean():,.1f} Kg")
+    m3.metric(f"Cao nhất một {level.lower()}", f"{volume['Tổng Kg'].max():,.1f} Kg")
+    m4.metric(PIECES, f"{int(volume[PIECES].sum()):,}")
+
+    st.markdown(f"**Kg theo {level.lower()}**")
+    st.line_chart(volume[['Tổng Kg', rolling_label('Tổng Kg', level)]])
+    st.markdown(f"**Số món theo {level.lower()}**")
+    st.line_chart(volume[[PIECES, rolling_label(PIECES, level)]])
+
+    c_item, c_cus = st.columns(2)
+    c_item.markdown("**Theo mặt hàng (số món)**")
+    c_item.bar_chart(analytics.by_item(d1, d2, wanted, who))
+    if who is None:
+        by_customer = analytics.by_customer(d1, d2, wanted)
+        c_cus.markdown(f"**Theo khách hàng (kg, theo {by_customer.index.name.lower()})**")
+        c_cus.area_chart(by_customer)
+    with st.expander("Số liệu"):
+        st.dataframe(volume, use_container_width=True)
+
+BILLING_MONTHS = 24
+
+def billing_documents(first, last, addresses, archive):
+    """Hàm dựng bảng kê cả tháng (chạy khi bấm tải): file zip từng khách, hoặc một file HTML để in."""
+    def data():
+        bill = compute_bill(get_table(INVOICES_SHEET).between(first, last), get_table(PRICES_SHEET).frame_ref())
+        build = statements_archive if archive else print_statements
+        return build(bill, f"{first:%m/%Y}", addresses)
+    return data
+
+@panel("Tính tiền")
+def billing_panel():
+    st.subheader("Tính tiền theo tháng")
+    this_month = date.today().replace(day=1)
+    months = [(pd.Timestamp(this_month) - pd.DateOffset(months=i)).date() for i in range(BILLING_MONTHS)]
+    # Mặc định tháng trước: cuối tháng mới chốt tiền
+    first = st.selectbox("Tháng", months, index=1, format_func=lambda m: m.strftime("%m/%Y"))
+    last = (pd.Timestamp(first) + pd.offsets.MonthEnd(0)).date()
+
+    df_users = load_users()
+    customers_list = df_users[df_users['Role'] == 'customer']
+    addresses = dict(zip(customers_list['FullName'], customers_list['Address']))
+
+    prices_table = get_table(PRICES_SHEET)
+    prices = read_table(PRICES_SHEET)
+    with st.expander("🏷 Bảng giá (đồng; ô để trống = theo giá chung)", expanded=prices.empty):
+        st.caption(f"Dòng '{DEFAULT_PRICE}' là giá áp cho mọi khách; thêm dòng cho khách có giá riêng.")
+        edited = st.data_editor(
+            prices,
+            column_config={
+                "Khách hàng": st.column_config.SelectboxColumn(
+                    "Khách hàng", options=[DEFAULT_PRICE] + customers_list['FullName'].tolist(), required=True),
+                **{col: st.column_config.NumberColumn(col, min_value=0) for col in [KG_PRICE] + ITEMS},
+            },
+            num_rows="dynamic", hide_index=True, use_container_width=True,
+            # Bảng giá đổi (vừa lưu / máy khác sửa) thì nạp lại bảng sửa
+            key=f"prices_{prices_table.version}",
+        )
+        if st.button("💾 Lưu bảng giá"):
+            tickets, error = save_prices(prices, edited)
+            failed = [t for t in tickets if not t.ok]
+            if error:
+                st.error(error)
+            elif failed:
+                st.error(f"Lỗi ghi {len(failed)} / {len(tickets)} dòng giá: {failed[0].error}")
             else:
-                st.warning("Không có phiếu nào trong khoảng thời gian này.")
+                st.session_state.flash = f"Đã lưu bảng giá ({len(tickets)} dòng thay đổi)."
+                st.rerun()
+
+    # Cả tháng tính một lượt trên ma trận số lượng của mọi phiếu
+    bill = compute_bill(load_invoices_between(first, last), prices)
+    summary = bill.summary()
+    m1, m2, m3 = st.columns(3)
+    m1.metric("Khách hàng", len(summary))
+    m2.metric("Số phiếu", int(summary['Số phiếu'].sum()))
+    m3.metric("Tổng tiền", f"{bill.total():,} đ".replace(",", "."))
+    if summary.empty:
+        st.warning("Không có phiếu nào trong tháng này.")
+        return
+    st.dataframe(summary, hide_index=True, use_container_width=True)
+
+    c_zip, c_print = st.columns(2)
+    c_zip.download_button("📥 Bảng kê từng khách (.zip)", billing_documents(first, last, addresses, archive=True),
+                          f"bang_ke_{first:%Y_%m}.zip", "application/zip", on_click="ignore")
+    c_print.download_button("🖨 In tất cả bảng kê", billing_documents(first, last, addresses, archive=False),
+                            f"bang_ke_{first:%Y_%m}.html", "text/html", on_click="ignore")
+
+@panel("Lịch sử khách hàng")
+def history_panel(full_name):
+    st.subheader(f"Lịch sử của {full_name}")
+    # Chỉ lấy phần phiếu của khách này, từng trang một (mới nhất trước)
+    partitions = get_partitions()
+    total = partitions.count(full_name)
+    if total:
+        pages = math.ceil(total / HISTORY_PAGE_SIZE)
+        page = st.number_input(f"Trang (tổng {total} phiếu)", min_value=1, max_value=pages, value=1) if pages > 1 else 1
+        my_inv, _ = partitions.page(full_name, page, HISTORY_PAGE_SIZE)
+        st.dataframe(my_inv, use_container_width=True)
+
+# --- ĐO LƯỢT CHẠY NÀY (tab Hiệu năng) ---
+get_metrics().begin_run(
+    st.session_state.user_info['Username'] if st.session_state.get('logged_in') else "(đăng nhập)"
+)
+
+# --- GIAO DIỆN LOGIN ---
+if 'logged_in' not in st.session_state:
+    st.session_state.logged_in = False
+    st.session_state.user_info = None
+
+if not st.session_state.logged_in:
+    col1, col2, col3 = st.columns([1, 1, 1])
+    with col2, get_metrics().phase("Đăng nhập"):
+        st.title("🔐 Đăng Nhập")
+        with st.form("login"):
+            u = st.text_input("Username")
+            p = st.text_input("Password", type="password")
+            if st.form_submit_button("Vào hệ thống"):
+                # Đọc luôn phiếu cùng lúc với Users: sau khi vào không phải chờ tải nữa
+                warm_tables()
+                try:
+                    user = authenticate(u, p)
+                except LoginThrottled as e:
+                    st.error(f"Sai quá nhiều lần. {e}.")
+                    st.stop()
+                if user is not None:
+                    st.session_state.logged_in = True
+                    st.session_state.user_info = user
+                    st.success("OK!")
+                    st.rerun()
+                else:
+                    st.error("Sai thông tin")
+    st.stop()
+
+# --- MAIN APP ---
+user = st.session_state.user_info
+role = user['Role']
+full_name = user['FullName']
+
+with st.sidebar:
+    st.image("https://cdn-icons-png.flaticon.com/512/3003/3003984.png", width=80)
+    st.markdown(f"**Xin chào, {full_name}**")
+    st.caption(f"Vai trò: {role.upper()}")
+    if st.button("Đăng xuất"):
+        st.session_state.logged_in = False
+        st.rerun()
+
+st.title("HỆ THỐNG QUẢN LÝ GIẶT ỦI")
+if 'flash' in st.session_state:
+    st.success(st.session_state.pop('flash'))
+
+# === ADMIN: BÁO CÁO / PHÂN TÍCH / NHẬP PHIẾU / TÍNH TIỀN / QUẢN TRỊ / HIỆU NĂNG ===
+if role == 'admin':
+    tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(["📊 Báo cáo & In", "📈 Phân tích", "📝 Nhập/Sửa/Xóa Phiếu",
+                                                  "💰 Tính tiền", "👥 Quản trị Người dùng", "⏱ Hiệu năng"])
+    with tab1:
+        report_panel()
+    with tab2:
+        analytics_panel()
+    with tab3:
+        invoice_panel()
+    with tab4:
+        billing_panel()
+    with tab5:
+        users_panel(user['Username'])
+    with tab6:
+        render_performance(get_metrics())
+
+# === STAFF: NHẬP LIỆU ===
+if role == 'staff':
+    invoice_panel()
 
 # === CUSTOMER VIEW ===
 if role == 'customer':
-    st.subheader(f"Lịch sử của {full_name}")
-    df = load_invoices()
-    if not df.empty:
-        my_inv = df[df['Khách hàng'] == full_name].sort_values(by='Ngày', ascending=False)
-        st.dataframe(my_inv, use_container_width=True)
+    history_panel(full_name)
 
+get_metrics().end_run()
@@ -0,0 +1,161 @@
+"""Đăng nhập: chỉ mục tài khoản trong bộ nhớ + băm mật khẩu + giới hạn số lần thử.
+
+CredentialIndex giữ dict Username -> (mật khẩu đã băm, thông tin user) và
+cập nhật theo từng thay đổi của TableCache Users (thêm / sửa / xóa chỉ đụng
+một khóa), nên mỗi lần đăng nhập chỉ là một lần tra dict, không tải lại
+trang tính.
+
+Mật khẩu mới được lưu dạng "pbkdf2_sha256$<số vòng>$<salt>$<hash>". Các
+dòng cũ còn lưu mật khẩu thô vẫn đăng nhập được; trong chỉ mục chúng cũng
+chỉ được giữ dưới dạng hash có salt.
+"""
+import base64
+import collections
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+import pandas as pd
+
+ALGORITHM = "pbkdf2_sha256"
+ITERATIONS = 120_000
+
+
+def _b64(raw):
+    return base64.b64encode(raw).decode("ascii")
+
+
+def hash_password(password, salt=None, iterations=ITERATIONS):
+    salt = salt or os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", str(password).encode("utf-8"), salt, iterations)
+    return f"{ALGORITHM}${iterations}${_b64(salt)}${_b64(digest)}"
+
+
+def is_hashed(stored):
+    return str(stored).startswith(ALGORITHM + "$")
+
+
+def verify_password(password, stored):
+    try:
+        _, iterations, salt, _ = str(stored).split("$")
+        expected = hash_password(password, base64.b64decode(salt), int(iterations))
+    except ValueError:
+        return False
+    return hmac.compare_digest(expected, str(stored))
+
+
+class _LegacySecret:
+    """Mật khẩu thô trên Sheet cũ: chỉ giữ sha256(salt + mật khẩu), so sánh thời gian hằng."""
+
+    def __init__(self, password):
+        self.salt = os.urandom(16)
+        self.digest = self._digest(password)
+
+    def _digest(self, password):
+        return hashlib.sha256(self.salt + str(password).encode("utf-8")).digest()
+
+    def verify(self, password):
+        return hmac.compare_digest(self.digest, self._digest(password))
+
+
+class RateLimiter:
+    """Mỗi khóa (username, địa chỉ IP...) được sai tối đa `max_failures` lần trong `window` giây."""
+
+    def __init__(self, max_failures=5, window=300.0):
+        self.max_failures = max_failures
+        self.window = window
+        self._failures = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + window
+
+    def _recent(self, key, now):
+        failures = self._failures[key]
+        while failures and now - failures[0] > self.window:
+            failures.popleft()
+        return failures
+
+    def _sweep(self, now):
+        # Tối đa mỗi `window` giây một lần: bỏ các khóa có lần sai cuối đã quá cửa sổ
+        # (khóa sai một lần rồi không quay lại sẽ không bao giờ được hỏi tới nữa)
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.window
+        expired = [key for key, failures in self._failures.items() if not failures or now - failures[-1] > self.window]
+        for key in expired:
+            del self._failures[key]
+
+    def retry_after(self, key):
+        """Số giây còn phải chờ (0 nếu được thử)."""
+        with self._lock:
+            now = time.monotonic()
+            failures = self._recent(key, now)
+            if not failures:
+                self._failures.pop(key, None)
+            if len(failures) < self.max_failures:
+                return 0
+            return self.window - (now - failures[0])
+
+    def failed(self, key):
+        with self._lock:
+            now = time.monotonic()
+            self._sweep(now)
+            self._recent(key, now).append(now)
+
+    def reset(self, key):
+        with self._lock:
+            self._failures.pop(key, None)
+
+
+class LoginThrottled(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Thử lại sau {int(retry_after) + 1} giây")
+        self.retry_after = retry_after
+
+
+class CredentialIndex:
+    def __init__(self, table, limiter=None):
+        self.table = table
+        self.limiter = limiter or RateLimiter()
+        self._users = {}
+        self._lock = threading.Lock()
+        table.subscribe(self._on_change)
+
+    # --- CẬP NHẬT THEO CACHE ---
+    def _on_change(self, event, rows):
+        with self._lock:
+            if event == "reset":
+                self._users = {}
+            for row in rows.to_dict("records"):
+                username = str(row["Username"])
+                if event == "removed":
+                    self._users.pop(username, None)
+                    continue
+                stored = str(row.pop("Password"))
+                secret = stored if is_hashed(stored) else _LegacySecret(stored)
+                self._users.setdefault(username, (secret, row))
+
+    # --- ĐĂNG NHẬP ---
+    def authenticate(self, username, password, client=None):
+        """Thông tin user (pd.Series, không có cột Password) hoặc None.
+
+        Raise LoginThrottled nếu username / client đã sai quá nhiều lần gần đây.
+        """
+        keys = [("user", username)] + ([("client", client)] if client else [])
+        wait = max(self.limiter.retry_after(k) for k in keys)
+        if wait > 0:
+            raise LoginThrottled(wait)
+        # Cho cache Users kịp đồng bộ phần mới (theo ttl), không tải lại cả trang tính
+        self.table.frame_ref()
+        with self._lock:
+            found = self._users.get(str(username))
+        if found is not None:
+            secret, info = found
+            ok = verify_password(password, secret) if isinstance(secret, str) else secret.verify(password)
+            if ok:
+                self.limiter.reset(("user", username))
+                return pd.Series(info)
+        for key in keys:
+            self.limiter.failed(key)
+        return None
@@ -0,0 +1,321 @@
+"""Đo thời gian các đường nóng của app trên dữ liệu giả, không cần Google Sheets.
+
+Dữ liệu được sinh theo đúng cấu trúc thật: 21 mặt hàng ITEMS, vài trăm khách
+hàng, nhiều năm phiếu (phần cũ nằm ở Sheet1, phần sau chia trang theo tháng
+kèm Catalog). Các bảng chạy qua GSheetsBackend như thật nhưng client là
+MemoryClient: trang tính giữ trong bộ nhớ, trả chuỗi như get_all_values.
+
+    python bench.py                        # 10k và 100k dòng
+    python bench.py --rows 1000000         # 1 triệu dòng (cần vài GB RAM)
+    python bench.py --json ket_qua.json    # lưu kết quả
+    python bench.py --compare ket_qua.json # so với lần đo trước (tỉ lệ x)
+
+Thời gian tính bằng ms: min và trung vị của `--repeat` lần chạy.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import re
+import statistics
+import tempfile
+import time
+
+import gspread
+import numpy as np
+import pandas as pd
+
+from analytics import WEEK, Analytics
+from auth import CredentialIndex, hash_password
+from billing import compute_bill, statements_archive
+from cache import TableCache, warm
+from export import write_workbook
+from partitioned import PartitionedTable
+from receipts import print_document, receipt_fields, render_receipt
+from rollups import Rollups
+from schema import price_frame
+from search import InvoiceSearch
+from snapshot import SnapshotStore
+from storage import (
+    CATALOG_SHEET, COLUMNS, DEFAULT_PRICE, INVOICE_COLUMNS, INVOICES_SHEET, ITEMS, REVISION_COLUMN, USERS_SHEET,
+    GSheetsBackend, partition_name,
+)
+
+PASSWORD = "bench"
+
+
+# --- GSPREAD TRONG BỘ NHỚ ---
+class MemoryWorksheet:
+    """Các hàm gspread.Worksheet mà GSheetsBackend dùng; ô lưu dạng chuỗi như Sheets hiển thị."""
+
+    def __init__(self, title, rows, cols=None):
+        self.title = title
+        self.rows = rows
+        self.col_count = cols or max((len(row) for row in rows), default=0)
+
+    def get_all_values(self):
+        return [list(row) for row in self.rows]
+
+    def get_values(self, range_name):
+        start = int(re.match(r"[A-Z]+(\d+)", range_name).group(1))
+        return [list(row) for row in self.rows[start - 1:]]
+
+    def col_values(self, col):
+        return [row[col - 1] if col <= len(row) else "" for row in self.rows]
+
+    def batch_get(self, ranges):
+        values = []
+        for name in ranges:
+            row, col = gspread.utils.a1_to_rowcol(name)
+            cell = self.rows[row - 1][col - 1] if row <= len(self.rows) and col <= len(self.rows[row - 1]) else None
+            values.append([[cell]] if cell not in (None, "") else [])
+        return values
+
+    def append_row(self, row, **kwargs):
+        self.append_rows([row])
+
+    def append_rows(self, rows, **kwargs):
+        self.rows.extend([str(v) for v in row] for row in rows)
+
+    def batch_update(self, data, **kwargs):
+        for item in data:
+            row, _ = gspread.utils.a1_to_rowcol(item["range"])
+            self.rows[row - 1] = [str(v) for v in item["values"][0]]
+
+    def add_cols(self, cols):
+        self.col_count += cols
+
+    def update(self, values, range_name):
+        row, col = gspread.utils.a1_to_rowcol(range_name)
+        for r, cells in enumerate(values, start=row - 1):
+            target = self.rows[r]
+            target.extend([""] * (col - 1 + len(cells) - len(target)))
+            target[col - 1:col - 1 + len(cells)] = [str(v) for v in cells]
+
+    def delete_rows(self, start, end=None):
+        del self.rows[start - 1:end or start]
+
+
+class MemorySpreadsheet:
+    def __init__(self):
+        self.sheets = {}
+
+    def worksheets(self):
+        return list(self.sheets.values())
+
+    def worksheet(self, title):
+        if title not in self.sheets:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return self.sheets[title]
+
+    def add_worksheet(self, title, rows=1000, cols=26, **kwargs):
+        sheet = self.sheets[title] = MemoryWorksheet(title, [], cols)
+        return sheet
+
+    def values_batch_get(self, ranges, params=None):
+        names = [name.strip("'").replace("''", "'") for name in ranges]
+        return {"valueRanges": [{"range": r, "values": self.sheets[n].get_all_values()} for r, n in zip(ranges, names)]}
+
+
+class MemoryClient:
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+
+    def open(self, name):
+        return self.spreadsheet
+
+
+# --- SINH DỮ LIỆU ---
+def make_users(customers):
+    """Admin, một nhân viên và các khách hàng; mọi tài khoản chung mật khẩu PASSWORD."""
+    secret = hash_password(PASSWORD)
+    rows = [["admin", secret, "admin", "Quản trị", ""], ["staff", secret, "staff", "Nhân viên", ""]]
+    rows += [[f"kh{i:03d}", secret, "customer", name, f"{i} Trần Phú"] for i, name in enumerate(customers)]
+    return rows
+
+
+def make_invoices(n, customers, years=4, seed=0):
+    """n phiếu rải đều trong `years` năm tới hôm nay, đã sắp theo ngày; mỗi ô là chuỗi."""
+    rng = np.random.default_rng(seed)
+    end = np.datetime64(datetime.date.today())
+    days = np.sort(end - rng.integers(0, years * 365, n).astype("timedelta64[D]"))
+    who = rng.integers(0, len(customers), n)
+    frame = pd.DataFrame({
+        "Ngày": np.datetime_as_string(days, unit="D"),
+        "Số phiếu": np.char.add("P", np.arange(n).astype(str)),
+        "Khách hàng": np.asarray(customers, dtype=object)[who],
+        "Địa chỉ": np.char.add(who.astype(str), " Trần Phú"),
+        "Ghi chú": "",
+        "Tổng Kg": rng.gamma(2.0, 8.0, n).round(1).astype(str),
+    })
+    quantities = rng.poisson(3, (n, len(ITEMS))).astype(str)
+    for pos, item in enumerate(ITEMS):
+        frame[item] = quantities[:, pos]
+    frame[REVISION_COLUMN] = ""
+    return frame[INVOICE_COLUMNS].to_numpy(dtype=object).tolist()
+
+
+def build_spreadsheet(n, n_customers=300, legacy_share=0.3):
+    """Sheet1 giữ `legacy_share` phần phiếu cũ nhất, phần còn lại chia trang theo tháng."""
+    customers = [f"Khách sạn {i:03d}" for i in range(n_customers)]
+    rows = make_invoices(n, customers)
+    book = MemorySpreadsheet()
+    for name in (USERS_SHEET, INVOICES_SHEET, CATALOG_SHEET):
+        book.sheets[name] = MemoryWorksheet(name, [list(COLUMNS[name])])
+    book.sheets[USERS_SHEET].rows += make_users(customers)
+
+    split = int(n * legacy_share)
+    legacy, recent = rows[:split], rows[split:]
+    book.sheets[INVOICES_SHEET].rows += legacy
+    catalog = [[INVOICES_SHEET, legacy[0][0], legacy[-1][0]]] if legacy else []
+    months = {}
+    for row in recent:
+        months.setdefault(partition_name(datetime.date.fromisoformat(row[0])), []).append(row)
+    for name, part in months.items():
+        book.sheets[name] = MemoryWorksheet(name, [list(INVOICE_COLUMNS)] + part)
+        first = datetime.date.fromisoformat(part[0][0]).replace(day=1)
+        last = (pd.Timestamp(first) + pd.offsets.MonthEnd(0)).date()
+        catalog.append([name, first.isoformat(), last.isoformat()])
+    book.sheets[CATALOG_SHEET].rows += catalog
+    return book
+
+
+# --- CÁC PHÉP ĐO ---
+def load_tables(book, snapshots=None):
+    """Như lần đầu mở app: Users + Catalog một lệnh đọc, mọi tháng phiếu một lệnh nữa."""
+    backend = GSheetsBackend(MemoryClient(book))
+    users = TableCache(backend, USERS_SHEET, snapshots=snapshots)
+    invoices = PartitionedTable(backend, snapshots=snapshots)
+    warm([users], also=[CATALOG_SHEET])
+    warm(invoices.caches())
+    return users, invoices
+
+
+def measure(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return min(times), statistics.median(times)
+
+
+def run(rows, repeat):
+    """Chạy mọi phép đo trên `rows` phiếu; trả về list dict {rows, case, min_ms, median_ms}."""
+    book = build_spreadsheet(rows)
+    results = []
+
+    def record(case, fn, times=repeat):
+        best, median = measure(fn, times)
+        results.append({"rows": rows, "case": case, "min_ms": round(best, 3), "median_ms": round(median, 3)})
+
+    def build(case, make):
+        # Dựng một lần và giữ lại để đo tiếp (dựng nhiều lần sẽ có nhiều bên theo dõi cùng bảng)
+        start = time.perf_counter()
+        built = make()
+        elapsed = round((time.perf_counter() - start) * 1000, 3)
+        results.append({"rows": rows, "case": case, "min_ms": elapsed, "median_ms": elapsed})
+        return built
+
+    record("load_invoices (lạnh)", lambda: load_tables(book), max(1, repeat // 2))
+    users, invoices = load_tables(book)
+    record("load_invoices (đã cache)", invoices.frame_ref)
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = SnapshotStore(directory)
+        load_tables(book, store)
+        record("load_invoices (snapshot)", lambda: load_tables(book, store), max(1, repeat // 2))
+
+    credentials = build("dựng chỉ mục tài khoản", lambda: CredentialIndex(users))
+    record("authenticate", lambda: credentials.authenticate("admin", PASSWORD))
+
+    today = datetime.date.today()
+    month_start = today.replace(day=1) - datetime.timedelta(days=1)
+    month_start = month_start.replace(day=1)
+    month_end = today.replace(day=1) - datetime.timedelta(days=1)
+    record("lọc báo cáo 1 tháng", lambda: invoices.between(month_start, month_end))
+    record("lọc báo cáo 1 năm", lambda: invoices.between(today - datetime.timedelta(days=365), today))
+
+    rollups = build("dựng bảng tổng hợp", lambda: Rollups(invoices))
+    record("tổng hợp 1 năm theo ngày", lambda: rollups.daily(today - datetime.timedelta(days=365), today))
+    # Analytics mới mỗi lần: đo phần tính, không đo phần nhớ kết quả
+    four_years = today - datetime.timedelta(days=4 * 365)
+    record("phân tích 4 năm theo tuần", lambda: Analytics(rollups).volume(four_years, today, WEEK))
+    record("phân tích theo khách 4 năm", lambda: Analytics(rollups).by_customer(four_years, today, WEEK))
+
+    search = build("dựng chỉ mục tìm phiếu", lambda: InvoiceSearch(invoices))
+    record("tìm phiếu 'khach san 01'", lambda: search.search("khach san 01"))
+
+    month = invoices.between(month_start, month_end)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bao_cao.xlsx")
+        record("xuất Excel 1 tháng", lambda: write_workbook(path, [("Phiếu", month)]), max(1, repeat // 2))
+
+    row = month.iloc[-1]
+    record("render_invoice_html", lambda: render_receipt(receipt_fields(row)))
+    record("in hàng loạt 1 tháng", lambda: print_document(month), max(1, repeat // 2))
+
+    # Giá chung + giá riêng cho 1/3 số khách (ô trống = giá chung)
+    customers = sorted(set(month["Khách hàng"].astype(str)))
+    prices = price_frame([[DEFAULT_PRICE, 12000] + [3000] * len(ITEMS)] +
+                         [[name, ""] + [2500] * len(ITEMS) for name in customers[::3]])
+    record("tính tiền 1 tháng", lambda: compute_bill(month, prices))
+    bill = compute_bill(month, prices)
+    record("bảng kê 1 tháng (zip)", lambda: statements_archive(bill, "01/2000"), max(1, repeat // 2))
+
+    # Sửa / xóa các phiếu của tháng trước (mỗi lần một phiếu khác nhau)
+    targets = iter(month.to_numpy(dtype=object).tolist())
+    key_pos, note_pos = INVOICE_COLUMNS.index("Số phiếu"), INVOICE_COLUMNS.index("Ghi chú")
+
+    def update():
+        values = next(targets)
+        values[0], values[note_pos] = values[0].strftime("%Y-%m-%d"), "sửa"
+        invoices.update(values[key_pos], values)
+
+    def delete():
+        invoices.delete(next(targets)[key_pos])
+
+    record("sửa phiếu", update)
+    record("xóa phiếu", delete)
+    return results
+
+
+# --- BÁO CÁO ---
+def print_results(results, baseline=None):
+    base = {(r["rows"], r["case"]): r for r in baseline or []}
+    width = max(len(r["case"]) for r in results)
+    header = f"{'dòng':>9}  {'phép đo':<{width}}  {'min ms':>10}  {'trung vị ms':>11}"
+    print(header + ("  so với trước" if baseline else ""))
+    for r in results:
+        line = f"{r['rows']:>9}  {r['case']:<{width}}  {r['min_ms']:>10.2f}  {r['median_ms']:>11.2f}"
+        old = base.get((r["rows"], r["case"]))
+        if old and old["median_ms"] > 0:
+            line += f"  x{r['median_ms'] / old['median_ms']:.2f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Đo thời gian các đường nóng trên dữ liệu giả")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    parser.add_argument("--compare", help="File JSON của lần đo trước để so sánh")
+    args = parser.parse_args()
+
+    results = []
+    for n in args.rows:
+        results += run(n, args.repeat)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "pandas": pd.__version__,
+                "at": datetime.datetime.now().isoformat(timespec="seconds"),
+                "results": results,
+            }, f, ensure_ascii=False, indent=1)
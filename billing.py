@@ -0,0 +1,251 @@
+"""Tính tiền hằng tháng theo bảng giá và dựng bảng kê cho từng khách hàng.
+
+Bảng giá (trang "Bảng giá") có một dòng giá chung và các dòng ghi đè theo
+khách; mỗi dòng có giá theo kg và đơn giá từng mặt hàng, ô trống = giá chung.
+Bảng giá được trải thành ma trận khách hàng × (Tổng Kg + ITEMS) một lần, rồi
+cả tháng được tính trong một lượt: ma trận số lượng của mọi phiếu nhân từng
+phần tử với dòng giá của khách tương ứng, cộng theo khách bằng groupby.
+
+Bảng kê (HTML, mỗi khách một file / một trang in) được dựng từ các giá trị
+thuần nên chia được cho nhiều tiến trình con; khung file in và phần chia
+tiến trình dùng chung với phiếu giao hàng (receipts.py).
+"""
+import html
+import io
+import re
+import zipfile
+from string import Template
+
+import numpy as np
+import pandas as pd
+
+from receipts import html_document, render_parallel
+from search import fold
+from storage import DEFAULT_PRICE, ITEMS, KG_PRICE
+
+QUANTITY_COLUMNS = ["Tổng Kg"] + ITEMS
+RATE_COLUMNS = [KG_PRICE] + ITEMS
+AMOUNT_COLUMN = "Thành tiền"
+
+
+# --- BẢNG GIÁ ---
+def price_matrix(prices, customers):
+    """Bảng giá (schema.price_frame) -> mảng giá (len(customers) x RATE_COLUMNS).
+
+    Ô trống của khách lấy giá chung; giá chung trống (hoặc không có dòng chung) = 0.
+    """
+    table = prices.drop_duplicates("Khách hàng", keep="first").set_index("Khách hàng")[RATE_COLUMNS]
+    default = table.loc[DEFAULT_PRICE] if DEFAULT_PRICE in table.index else pd.Series(np.nan, index=RATE_COLUMNS)
+    matrix = table.reindex(list(customers)).fillna(default).fillna(0.0)
+    return matrix.to_numpy(dtype=np.float64)
+
+
+# --- TÍNH TIỀN ---
+class Bill:
+    """Kết quả tính tiền một khoảng ngày.
+
+    lines: mỗi phiếu một dòng (Ngày, Số phiếu, Khách hàng, Tổng Kg, Số món, Thành tiền);
+    quantities / amounts: mảng (khách x QUANTITY_COLUMNS); rates: giá đã áp cho từng khách.
+    """
+
+    def __init__(self, customers, lines, quantities, amounts, rates):
+        self.customers = customers
+        self.lines = lines
+        self.quantities = quantities
+        self.amounts = amounts
+        self.rates = rates
+
+    def summary(self):
+        """Mỗi khách một dòng: số phiếu, tổng kg, tổng số món, tiền theo kg / theo món, tổng tiền."""
+        counts = self.lines.groupby("Khách hàng", observed=True, sort=False).size()
+        totals = self.amounts.sum(axis=1)
+        return pd.DataFrame({
+            "Khách hàng": self.customers,
+            "Số phiếu": counts.reindex(self.customers).fillna(0).astype("int64").to_numpy(),
+            "Tổng Kg": self.quantities[:, 0].round(2),
+            "Số món": self.quantities[:, 1:].sum(axis=1).round().astype("int64"),
+            "Tiền theo kg": self.amounts[:, 0].round().astype("int64"),
+            "Tiền theo món": self.amounts[:, 1:].sum(axis=1).round().astype("int64"),
+            AMOUNT_COLUMN: totals.round().astype("int64"),
+        }).sort_values(AMOUNT_COLUMN, ascending=False, ignore_index=True)
+
+    def total(self):
+        return int(round(self.amounts.sum()))
+
+
+def compute_bill(invoices, prices):
+    """Tính tiền cho mọi phiếu trong `invoices` (DataFrame phiếu) theo bảng giá `prices`, một lượt."""
+    names = invoices["Khách hàng"].astype(str)
+    codes, customers = pd.factorize(names, sort=True)
+    customers = customers.tolist()
+    rates = price_matrix(prices, customers)
+
+    # Ma trận số lượng (phiếu x cột) nhân với dòng giá của khách từng phiếu
+    quantities = invoices[QUANTITY_COLUMNS].to_numpy(dtype=np.float64)
+    amounts = quantities * rates[codes]
+    per_invoice = amounts.sum(axis=1)
+
+    lines = pd.DataFrame({
+        "Ngày": invoices["Ngày"].to_numpy(),
+        "Số phiếu": invoices["Số phiếu"].astype(str).to_numpy(),
+        "Khách hàng": pd.Categorical.from_codes(codes, customers),
+        "Tổng Kg": quantities[:, 0].round(2),
+        "Số món": quantities[:, 1:].sum(axis=1).round().astype("int64"),
+        AMOUNT_COLUMN: per_invoice.round().astype("int64"),
+    })
+    return Bill(customers, lines, _by_customer(quantities, codes, len(customers)),
+                _by_customer(amounts, codes, len(customers)), rates)
+
+
+def _by_customer(block, codes, n):
+    """Cộng các dòng của `block` theo mã khách (0..n-1) -> mảng (n x cột)."""
+    sums = pd.DataFrame(block).groupby(codes).sum()
+    return sums.reindex(range(n), fill_value=0.0).to_numpy(dtype=np.float64)
+
+
+# --- BẢNG KÊ TỪNG KHÁCH ---
+_LINE_ROW = Template("<tr><td style='text-align:center'>$no</td><td>$day</td><td>$receipt_no</td>"
+                     "<td style='text-align:right'>$kg</td><td style='text-align:right'>$pieces</td>"
+                     "<td style='text-align:right'>$amount</td></tr>")
+_ITEM_ROW = Template("<tr><td>$name</td><td style='text-align:right'>$qty</td>"
+                     "<td style='text-align:right'>$rate</td><td style='text-align:right'>$amount</td></tr>")
+
+# HTML viết sát lề trái tuyệt đối, giống mẫu phiếu trong receipts.py
+_STATEMENT = Template("""
+<div class="printable-area invoice-box">
+<div class="invoice-header">
+<b style="color:#003366">CÔNG TY TNHH GIẶT ỦI HẢI ÂU MŨI NÉ</b><br>
+<small>Thôn Thiện Sơn, Phường Mũi Né, Tỉnh Lâm Đồng</small>
+<h2>BẢNG KÊ THANH TOÁN THÁNG $period</h2>
+</div>
+<table style="width:100%; margin-bottom:10px;">
+<tr><td><b>Khách hàng:</b> $customer</td><td style="text-align:right"><b>Số phiếu:</b> $count</td></tr>
+<tr><td colspan="2"><b>Địa chỉ:</b> $address</td></tr>
+</table>
+<table class="invoice-table">
+<thead>
+<tr><th>Mặt hàng</th><th style="width:110px">Số lượng</th><th style="width:120px">Đơn giá</th><th style="width:140px">Thành tiền</th></tr>
+</thead>
+<tbody>
+$items
+</tbody>
+</table>
+<div class="total-section">
+Tổng cộng: $total đồng
+</div>
+<h4>Chi tiết các phiếu</h4>
+<table class="invoice-table">
+<thead>
+<tr><th style="width:50px">STT</th><th>Ngày</th><th>Số phiếu</th><th>Kg</th><th>Số món</th><th>Thành tiền</th></tr>
+</thead>
+<tbody>
+$lines
+</tbody>
+</table>
+<div class="signature-section">
+<div>
+<b>Khách hàng xác nhận</b><br>
+<i>(Ký, họ tên)</i>
+<br><br><br><br>
+</div>
+<div>
+<b>Người lập bảng kê</b><br>
+<i>(Ký, họ tên)</i>
+<br><br><br><br>
+</div>
+</div>
+</div>
+""")
+
+def _money(value):
+    # 1234567 -> "1.234.567" (cách viết tiền của kế toán)
+    return f"{int(round(value)):,}".replace(",", ".")
+
+
+def _number(value):
+    return f"{value:g}"
+
+
+def statement_fields(bill, period, addresses=None):
+    """Bill -> list dict giá trị thuần, mỗi khách một dict (gửi được sang tiến trình con).
+
+    addresses: dict tên khách -> địa chỉ (khách không có trong dict thì để trống).
+    """
+    addresses = addresses or {}
+    lines = bill.lines
+    # Sắp phiếu theo (khách, ngày) một lần rồi cắt thành từng đoạn liền nhau cho từng khách
+    order = np.lexsort((lines["Ngày"].to_numpy(), lines["Khách hàng"].cat.codes.to_numpy()))
+    lines = lines.iloc[order]
+    days = lines["Ngày"].dt.strftime("%d/%m/%Y").fillna("").tolist()
+    keys, kgs, pieces, money = (lines["Số phiếu"].tolist(), lines["Tổng Kg"].tolist(),
+                                lines["Số món"].tolist(), lines[AMOUNT_COLUMN].tolist())
+    bounds = np.searchsorted(lines["Khách hàng"].cat.codes.to_numpy(), np.arange(len(bill.customers) + 1))
+
+    records = []
+    for code, customer in enumerate(bill.customers):
+        lo, hi = bounds[code], bounds[code + 1]
+        quantities, amounts, rates = bill.quantities[code], bill.amounts[code], bill.rates[code]
+        records.append({
+            "customer": customer,
+            "period": period,
+            "address": addresses.get(customer, ""),
+            "count": int(hi - lo),
+            "total": float(amounts.sum()),
+            # Chỉ liệt kê các dòng có số lượng
+            "items": [(name, float(q), float(r), float(a)) for name, q, r, a in
+                      zip(QUANTITY_COLUMNS, quantities, rates, amounts) if q > 0],
+            "lines": list(zip(days[lo:hi], keys[lo:hi], kgs[lo:hi], pieces[lo:hi], money[lo:hi])),
+        })
+    return records
+
+
+def render_statement(fields):
+    """dict từ statement_fields -> HTML bảng kê của một khách."""
+    items = [_ITEM_ROW.substitute(name=html.escape(name), qty=_number(qty),
+                                  rate=_money(rate) + ("/kg" if name == "Tổng Kg" else ""), amount=_money(amount))
+             for name, qty, rate, amount in fields["items"]]
+    lines = [_LINE_ROW.substitute(no=no, day=day, receipt_no=html.escape(key), kg=_number(kg), pieces=count,
+                                  amount=_money(amount))
+             for no, (day, key, kg, count, amount) in enumerate(fields["lines"], 1)]
+    return _STATEMENT.substitute(
+        period=html.escape(fields["period"]), customer=html.escape(fields["customer"]),
+        address=html.escape(fields["address"]), count=fields["count"], total=_money(fields["total"]),
+        items="".join(items), lines="".join(lines),
+    )
+
+
+def _lines(fields):
+    return len(fields["lines"])
+
+
+def render_statements(records, workers=None):
+    """Dựng HTML bảng kê cho nhiều khách, giữ nguyên thứ tự; nhiều phiếu thì chia cho các tiến trình con."""
+    return render_parallel(render_statement, records, workers, weight=_lines)
+
+
+def _filename(customer):
+    # Tên file không dấu, chỉ chữ số và gạch dưới (mở được trên mọi máy)
+    return re.sub(r"[^a-z0-9]+", "_", fold(customer)).strip("_") or "khach_hang"
+
+
+def statements_archive(bill, period, addresses=None, workers=None):
+    """File zip: mỗi khách một file HTML bảng kê, kèm bang_ke_tong_hop.csv (Bill.summary)."""
+    records = statement_fields(bill, period, addresses)
+    rendered = render_statements(records, workers)
+    buffer = io.BytesIO()
+    used = set()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for fields, statement in zip(records, rendered):
+            name = _filename(fields["customer"])
+            while name in used:
+                name += "_"
+            used.add(name)
+            archive.writestr(f"{name}.html", html_document(f"Bảng kê {fields['customer']} {period}", statement))
+        archive.writestr("bang_ke_tong_hop.csv", bill.summary().to_csv(index=False).encode("utf-8-sig"))
+    return buffer.getvalue()
+
+
+def print_statements(bill, period, addresses=None, workers=None):
+    """Mọi bảng kê trong một file HTML, mỗi khách một trang khi in."""
+    statements = render_statements(statement_fields(bill, period, addresses), workers)
+    return html_document(f"Bảng kê tháng {period}", "".join(statements))
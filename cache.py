@@ -0,0 +1,543 @@
+"""Bộ nhớ đệm ghi xuyên (write-through) cho các trang tính.
+
+Mỗi TableCache giữ một DataFrame dùng chung cho mọi phiên Streamlit.
+Khi ghi (thêm / sửa / xóa), dữ liệu được ghi xuống backend rồi vá
+trực tiếp vào DataFrame đang giữ và tăng `version`, thay vì xóa cache
+và tải lại toàn bộ trang tính.
+
+Hết hạn `ttl` thì chỉ đồng bộ phần đuôi: đọc từ dòng cuối đã biết trở đi.
+Nếu dòng cuối đó không còn khớp (có dòng bị xóa / sửa ở nơi khác) mới tải
+lại toàn bộ. Bảng có cột phiên bản thì cùng lệnh đọc đó lấy luôn cả cột
+phiên bản: có phiên bản bảng chưa biết (dòng bị app / API ở nơi khác sửa,
+dòng nào cũng vậy) thì cũng tải lại toàn bộ. Sửa tay trên Sheet không đổi
+phiên bản nên chỉ được thấy ở lần đối soát toàn bộ, cứ `full_sync_every`
+giây một lần.
+
+Bảng phiếu luôn được giữ sắp theo Ngày (ổn định: cùng ngày thì giữ thứ tự
+trên Sheet), nên lọc theo khoảng ngày chỉ là hai lần tìm nhị phân + cắt lát.
+
+Có `journal` thì thao tác ghi chỉ cần vào nhật ký cục bộ là vá bảng ngay;
+các thao tác chưa lên Sheet được phủ lại lên dữ liệu mỗi lần tải lại.
+
+Có `snapshots` (SnapshotStore) thì các tiến trình trên cùng máy dùng chung
+một ảnh chụp Arrow của bảng: khởi động chỉ là mmap file; hết ttl (hoặc có
+tiến trình vừa ghi) thì chỉ tiến trình giữ được khóa đọc Sheet rồi ghi ảnh
+chụp mới, các tiến trình khác đọc lại ảnh chụp đó. Trang có mật khẩu
+(PRIVATE_SHEETS) không bao giờ dùng ảnh chụp.
+
+Bảng có cột phiên bản (REVISION_COLUMNS) thì mỗi dòng ghi xuống được đóng
+phiên bản mới; sửa / xóa kèm `expected` là ghi có điều kiện, phiên bản đã
+đổi thì trả về vé lỗi RevisionConflict thay vì ghi đè. Nhờ vậy cache sống
+lâu vẫn an toàn: dữ liệu cũ trong bảng không bao giờ đè lên dữ liệu mới.
+"""
+import collections
+import contextlib
+import functools
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from journal import SYNCED
+from metrics import CACHE, table_label
+from schema import FRAME_BUILDERS, SORT_COLUMNS, concat_frames
+from storage import COLUMNS, KEY_COLUMNS, PRIVATE_SHEETS, REVISION_COLUMNS, RevisionConflict, new_revision
+from writequeue import DONE, FAILED, WriteQueue, WriteTicket
+
+
+@functools.lru_cache(maxsize=None)
+def _object_columns(builder):
+    template = builder([])
+    return tuple(col for col in template.columns if template[col].dtype == object)
+
+
+@functools.lru_cache(maxsize=None)
+def _numeric_dtypes(builder):
+    template = builder([])
+    return {col: template[col].dtype for col in template.columns if template[col].dtype.kind in "uifM"}
+
+
+def warm(tables, also=()):
+    """Tải lần đầu nhiều bảng (cùng backend): các trang phải đọc toàn bộ được gộp vào một lệnh prefetch.
+
+    `also`: tên các trang tính khác sắp được đọc bằng read_rows (vd. Catalog), đọc chung lệnh đó.
+    """
+    cold = [t for t in tables if not t.loaded]
+    names = [t.name for t in cold if t.needs_full_read()] + list(also)
+    if len(names) > 1:
+        (cold[0] if cold else tables[0]).backend.prefetch(names)
+    for table in cold:
+        table.frame_ref()
+
+
+class TableCache:
+    def __init__(self, backend, name, ttl=60, full_sync_every=15 * 60, queue=None, journal=None, snapshots=None,
+                 metrics=None):
+        self.backend = backend
+        self.queue = queue or WriteQueue(backend)
+        self.journal = journal
+        self.snapshots = snapshots
+        if name in PRIVATE_SHEETS:
+            # Users có cột mật khẩu: không dùng ảnh chụp, xóa ảnh chụp do bản cũ để lại
+            if snapshots is not None:
+                snapshots.remove(name)
+            self.snapshots = None
+        self.metrics = metrics
+        self.name = name
+        self.ttl = ttl
+        self.full_sync_every = full_sync_every
+        self.columns = COLUMNS[name]
+        self.key_column = KEY_COLUMNS[name]
+        self.revision_column = REVISION_COLUMNS.get(name)
+        self.sort_by = SORT_COLUMNS.get(name)
+        self.version = 0
+        self._frame = None
+        # Bảng mà các bên theo dõi đang giữ khi _frame bị bỏ (để báo "removed" lúc tải lại)
+        self._stale = None
+        self._sort_values = None
+        self._sort_values_of = None
+        self._loaded_at = 0.0
+        self._full_loaded_at = 0.0
+        # Mốc đồng bộ: số dòng dữ liệu đã biết trên Sheet và bản ghi cuối cùng
+        self._synced_rows = 0
+        self._tail = None
+        self._lock = threading.RLock()
+        # Thao tác trong nhật ký vừa lên Sheet (luồng nền báo về, xử lý khi đọc)
+        self._replayed = collections.deque()
+        # Bên theo dõi thay đổi của bảng (vd. bảng tổng hợp), xem subscribe()
+        self._listeners = []
+        # Ảnh chụp dùng chung: stamp đang giữ, version lúc ghi ảnh chụp (None = cần ghi lại),
+        # mtime tín hiệu ghi đã xử lý
+        self._stamp = None
+        self._snapshot_version = None
+        self._signal_seen = 0.0
+        if journal is not None:
+            journal.subscribe(self._on_replayed)
+
+    # --- ĐỌC ---
+    def frame(self):
+        """Trả về bản sao DataFrame (người gọi được phép sửa cột tùy ý)."""
+        with self._lock:
+            return self.frame_ref().copy()
+
+    def frame_ref(self):
+        """Như frame() nhưng không sao chép; người gọi KHÔNG được sửa DataFrame trả về."""
+        with self._lock:
+            self._drain_replayed()
+            if self._frame is None:
+                with self._replay_guard(), self._measure("tải mới"):
+                    self._drain_replayed()
+                    if self.snapshots is None:
+                        self._reload()
+                    else:
+                        self._shared_refresh(blocking=True)
+            elif time.monotonic() - self._loaded_at > self.ttl or self._signalled():
+                with self._replay_guard(blocking=False) as free:
+                    if free:
+                        with self._measure("đồng bộ"):
+                            self._drain_replayed()
+                            if self.snapshots is None:
+                                self._sync()
+                            else:
+                                self._shared_refresh(blocking=False)
+            elif self.metrics is not None:
+                self.metrics.count(CACHE, f"{table_label(self.name)}: có sẵn")
+            return self._frame
+
+    def _measure(self, what):
+        if self.metrics is None:
+            return contextlib.nullcontext()
+        return self.metrics.timed(CACHE, f"{table_label(self.name)}: {what}")
+
+    def between(self, start, end):
+        """Các dòng có sort_by trong [start, end] (tính cả hai đầu, theo ngày).
+
+        Chỉ sao chép lát cắt, không sao chép cả bảng. Kết quả sắp tăng dần.
+        """
+        with self._lock:
+            self.frame_ref()
+            values = self._sorted_values()
+            lo = np.searchsorted(values, np.datetime64(pd.Timestamp(start).normalize()), side="left")
+            hi = np.searchsorted(values, np.datetime64(pd.Timestamp(end).normalize() + pd.Timedelta(days=1)), side="left")
+            return self._frame.iloc[lo:hi].copy()
+
+    def latest(self, n):
+        """(n dòng cuối theo sort_by, tăng dần; tổng số dòng) — chỉ cắt đuôi bảng đã sắp, không sao chép."""
+        with self._lock:
+            frame = self.frame_ref()
+            return frame.iloc[max(len(frame) - n, 0):], len(frame)
+
+    def _sorted_values(self):
+        # Mảng datetime64 của cột sắp xếp, tính lại khi bảng đổi (mỗi lần vá là một DataFrame mới)
+        if self._sort_values_of is not self._frame:
+            self._sort_values = self._frame[self.sort_by].to_numpy()
+            self._sort_values_of = self._frame
+        return self._sort_values
+
+    def subscribe(self, listener):
+        """listener(event, rows) được gọi (trong khóa của cache) mỗi khi bảng đổi.
+
+        event là "reset" (rows = cả bảng, lần tải đầu tiên), "added" hoặc
+        "removed" (rows = các dòng vừa thêm / vừa bỏ). Sửa một dòng = removed + added;
+        tải lại cả bảng = removed (bảng cũ) + added (bảng mới).
+        """
+        with self._lock:
+            self._listeners.append(listener)
+            if self._frame is not None:
+                listener("reset", self._frame)
+
+    def _emit(self, event, rows):
+        for listener in self._listeners:
+            listener(event, rows)
+
+    @property
+    def loaded(self):
+        return self._frame is not None
+
+    def needs_full_read(self):
+        """True nếu lần tải đầu phải đọc cả trang tính từ backend (không có ảnh chụp dùng được)."""
+        if self.loaded:
+            return False
+        if self.snapshots is None:
+            return True
+        meta = self.snapshots.meta(self.name)
+        return meta is None or time.time() - meta["full_at"] > self.full_sync_every
+
+    def sync(self, start=None, end=None):
+        """Đảm bảo bảng đã tải / đồng bộ theo ttl (khoảng ngày chỉ có nghĩa với PartitionedTable)."""
+        self.frame_ref()
+
+    def contains(self, key):
+        with self._lock:
+            self.frame_ref()
+            return self._position(key) is not None
+
+    def invalidate(self):
+        with self._lock:
+            self._discard()
+
+    def _discard(self):
+        if self._frame is not None:
+            self._stale = self._frame
+        self._frame = None
+
+    @contextlib.contextmanager
+    def _replay_guard(self, blocking=True):
+        """Không đọc Sheet khi luồng nhật ký đang ghi dở một lô (tránh đếm trùng dòng)."""
+        if self.journal is None:
+            yield True
+            return
+        acquired = self.journal.replay_lock.acquire(blocking)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self.journal.replay_lock.release()
+
+    def _reload(self):
+        rows = self.backend.read_rows(self.name)
+        self._install(self._sorted(self._to_frame(rows)), len(rows),
+                      self._record(rows[-1]) if rows else None, time.monotonic())
+
+    def _install(self, frame, synced_rows, tail, full_loaded_at):
+        """Thay cả bảng (vừa đọc từ Sheet hoặc từ ảnh chụp) và mốc đồng bộ đi kèm."""
+        old = self._frame if self._frame is not None else self._stale
+        self._frame, self._stale = frame, None
+        if old is None:
+            self._emit("reset", self._frame)
+        else:
+            self._emit("removed", old)
+            self._emit("added", self._frame)
+        self._loaded_at = time.monotonic()
+        self._full_loaded_at = full_loaded_at
+        self._synced_rows = synced_rows
+        self._tail = tail
+        if self.journal is not None:
+            for entry in self.journal.pending(self.name):
+                self._patch_frame(entry.op, entry.key, entry.row)
+        self.version += 1
+
+    def _sync(self):
+        """Chỉ tải các dòng mới thêm vào cuối Sheet kể từ lần đồng bộ trước."""
+        now = time.monotonic()
+        if self._tail is None or now - self._full_loaded_at > self.full_sync_every:
+            return self._reload()
+        if self.revision_column is None:
+            rows, revisions = self.backend.read_rows_from(self.name, self._synced_rows - 1), []
+        else:
+            rows, revisions = self.backend.read_tail(self.name, self._synced_rows - 1, self.revision_column)
+        if not rows or self._record(rows[0]) != self._tail:
+            # Cấu trúc bảng đã đổi (xóa / chèn / sửa dòng cuối) -> đối soát toàn bộ
+            return self._reload()
+        new_rows = rows[1:]
+        if new_rows:
+            self._append_rows(new_rows)
+            self._synced_rows += len(new_rows)
+            self._tail = self._record(new_rows[-1])
+            self.version += 1
+        if self._edited_elsewhere(revisions):
+            return self._reload()
+        self._loaded_at = now
+
+    def _edited_elsewhere(self, revisions):
+        """Sheet có phiên bản dòng mà bảng chưa biết: có dòng vừa bị sửa ở tiến trình / máy khác."""
+        if not revisions or (self.journal is not None and self.journal.pending(self.name)):
+            # Đang có thao tác chưa lên Sheet: Sheet còn giữ phiên bản cũ của chính các dòng đó
+            return False
+        known = set(self._frame[self.revision_column].astype(str))
+        return any(str(revision) not in known for revision in revisions)
+
+    # --- ẢNH CHỤP DÙNG CHUNG ---
+    def _signalled(self):
+        return self.snapshots is not None and self.snapshots.signalled_at(self.name) > self._signal_seen
+
+    def _shared_refresh(self, blocking):
+        """Làm mới qua ảnh chụp: ai giữ khóa thì đọc Sheet và ghi ảnh chụp, còn lại đọc ảnh chụp."""
+        if self._adopt():
+            return
+        with self.snapshots.lock(self.name, blocking) as owner:
+            # Không giữ được khóa: tiến trình khác đang làm mới, tạm dùng bảng đang có
+            if not owner or self._adopt():
+                return
+            started = time.time()
+            if self._frame is None:
+                self._reload()
+            else:
+                self._sync()
+            self._publish(started)
+
+    def _adopt(self):
+        """Nạp ảnh chụp nếu có bản mới hơn; True nếu ảnh chụp còn đủ mới để khỏi đọc Sheet."""
+        meta = self.snapshots.meta(self.name)
+        if meta is None:
+            return False
+        if meta["stamp"] != self._stamp:
+            loaded = self.snapshots.load(self.name)
+            if loaded is None:
+                return False
+            frame, meta = loaded
+            if not self._current_dtypes(frame):
+                return False  # ảnh chụp của bản cũ (vd. Tổng Kg float32): đọc lại từ Sheet
+            # Ảnh chụp còn quá cũ (quá hạn đối soát toàn bộ): đọc lại từ Sheet
+            age = time.time() - meta["full_at"]
+            if age > self.full_sync_every:
+                return False
+            self._install(self._restore_dtypes(frame), meta["synced_rows"], meta["tail"], time.monotonic() - age)
+            self._stamp = meta["stamp"]
+            self._snapshot_version = self.version
+        checked_at = meta["checked_at"]
+        if time.time() - checked_at > self.ttl or checked_at < self.snapshots.signalled_at(self.name):
+            return False
+        self._loaded_at = time.monotonic() - (time.time() - checked_at)
+        self._signal_seen = checked_at
+        return True
+
+    def _current_dtypes(self, frame):
+        numeric = _numeric_dtypes(FRAME_BUILDERS[self.name])
+        return all(col in frame and frame[col].dtype == dtype for col, dtype in numeric.items())
+
+    def _restore_dtypes(self, frame):
+        # Arrow đọc cột chữ thành kiểu string của pandas; trả lại object như FRAME_BUILDERS
+        for col in _object_columns(FRAME_BUILDERS[self.name]):
+            if frame[col].dtype != object:
+                frame[col] = frame[col].astype(object)
+        return frame
+
+    def _publish(self, checked_at):
+        """Ghi ảnh chụp sau khi vừa đối chiếu với Sheet (chỉ ghi meta nếu bảng không đổi)."""
+        if self.journal is not None and self.journal.pending(self.name):
+            return  # bảng đang phủ thao tác chưa lên Sheet, không phải dữ liệu thật của Sheet
+        meta = self.snapshots.meta(self.name)
+        if meta is not None and meta["stamp"] == self._stamp and self._snapshot_version == self.version:
+            meta = self.snapshots.checked(self.name, meta, checked_at)
+        else:
+            full_at = checked_at - (time.monotonic() - self._full_loaded_at)
+            meta = self.snapshots.save(self.name, self._frame, self._synced_rows, self._tail, full_at, checked_at)
+        self._stamp = meta["stamp"]
+        self._snapshot_version = self.version
+        self._signal_seen = checked_at
+
+    def _append_rows(self, rows):
+        self._insert(self._to_frame(rows))
+
+    def _insert(self, new):
+        self._emit("added", new)
+        if self.sort_by is None or not len(self._frame):
+            self._frame = self._sorted(concat_frames([self._frame, new]))
+        elif len(new) == 1:
+            # Một dòng: chèn đúng chỗ bằng tìm nhị phân, sau các dòng cùng ngày
+            pos = np.searchsorted(self._sorted_values(), new[self.sort_by].to_numpy()[0], side="right")
+            self._frame = concat_frames([self._frame.iloc[:pos], new, self._frame.iloc[pos:]])
+        else:
+            self._frame = self._sorted(concat_frames([self._frame, new]))
+
+    def _sorted(self, frame):
+        if self.sort_by is None:
+            return frame
+        return frame.sort_values(self.sort_by, kind="stable", ignore_index=True)
+
+    def _to_frame(self, rows):
+        return FRAME_BUILDERS[self.name](rows)
+
+    def _record(self, row):
+        return self.backend.record_from_row(self.name, row)
+
+    def _position(self, key):
+        """Vị trí dòng đầu tiên có khóa = key trong DataFrame, hoặc None."""
+        matches = (self._frame[self.key_column].astype(str) == str(key)).to_numpy().nonzero()[0]
+        return int(matches[0]) if len(matches) else None
+
+    def _is_tail(self, key):
+        return self._tail is not None and str(self._tail.get(self.key_column)) == str(key)
+
+    # --- GHI XUYÊN ---
+    # Không có nhật ký: ghi qua hàng đợi (gom lệnh, tự thử lại); hàng đợi gọi
+    # _applied theo đúng thứ tự đã ghi xuống Sheet.
+    # Có nhật ký: ghi vào nhật ký, vá bảng ngay, luồng nền đưa lên Sheet sau.
+    def append(self, row):
+        return self._write("append", row=row)
+
+    def append_rows(self, rows):
+        """Thêm nhiều dòng (nhập hàng loạt): một lệnh append_rows lên Sheet, vá bảng một lần.
+
+        Trả về list WriteTicket / JournalEntry theo thứ tự các dòng.
+        """
+        if not rows:
+            return []
+        rows = [self._stamped(row) for row in rows]
+        if self.journal is None:
+            tickets = [self.queue.submit("append", self.name, row=row) for row in rows]
+            self.queue.flush()
+            for ticket in tickets:
+                ticket.wait()
+            done = [ticket.row for ticket in tickets if ticket.ok]
+            with self._lock:
+                if self._frame is not None and done:
+                    self._append_rows(done)
+                    for row in done:
+                        self._track("append", None, row)
+                self.version += 1
+            if self.snapshots is not None:
+                self.snapshots.signal(self.name)
+            return tickets
+        with self._lock:
+            if self._frame is None:
+                self.frame_ref()
+            entries = self.journal.record_many("append", self.name, [(None, row) for row in rows])
+            self._append_rows(rows)
+            self.version += 1
+            return entries
+
+    def update(self, key, row, expected=None):
+        """expected: phiên bản của dòng lúc người dùng mở ra (None = ghi đè không kiểm tra)."""
+        return self._write("update", key=key, row=row, expected=expected)
+
+    def delete(self, key, expected=None):
+        return self._write("delete", key=key, expected=expected)
+
+    def _stamped(self, row):
+        """Dòng kèm phiên bản mới; Sheet và bảng trong bộ nhớ nhận cùng một giá trị."""
+        if self.revision_column is None:
+            return row
+        row = list(row) + [""] * (len(self.columns) - len(row))
+        row[self.columns.index(self.revision_column)] = new_revision()
+        return row
+
+    def _write(self, op, key=None, row=None, expected=None):
+        if row is not None:
+            row = self._stamped(row)
+        if self.revision_column is None:
+            expected = None
+        if self.journal is None:
+            ticket = self.queue.execute(op, self.name, key=key, row=row, on_done=self._applied, expected=expected)
+            if isinstance(ticket.error, RevisionConflict):
+                # Bảng đang giữ đã cũ so với Sheet -> lần đọc sau tải lại
+                self.invalidate()
+            return ticket
+        with self._lock:
+            if self._frame is None:
+                self.frame_ref()
+            pos = self._position(key) if op != "append" else None
+            if op != "append" and pos is None:
+                missing = WriteTicket(op, self.name, key=key, row=row)
+                missing._finish(DONE, False)
+                return missing
+            if expected is not None and str(self._frame[self.revision_column].iat[pos]) != str(expected):
+                # Bảng (đã gồm các thao tác chưa lên Sheet) đã có bản mới hơn bản người dùng sửa
+                conflict = WriteTicket(op, self.name, key=key, row=row, expected=expected)
+                conflict._finish(FAILED, error=RevisionConflict(key))
+                return conflict
+            entry = self.journal.record(op, self.name, key=key, row=row, expected=expected)
+            self._patch_frame(op, key, row)
+            self.version += 1
+            return entry
+
+    def _applied(self, ticket):
+        with self._lock:
+            if self._frame is not None:
+                try:
+                    if self._patch_frame(ticket.op, ticket.key, ticket.row):
+                        self._track(ticket.op, ticket.key, ticket.row)
+                    else:
+                        self._discard()
+                except Exception:
+                    self._discard()
+            self.version += 1
+        if self.snapshots is not None:
+            self.snapshots.signal(self.name)
+
+    def _on_replayed(self, entry):
+        # Gọi từ luồng nhật ký: chỉ xếp hàng, không lấy khóa của cache
+        if entry.name == self.name:
+            self._replayed.append(entry)
+            if entry.status == SYNCED and self.snapshots is not None:
+                self.snapshots.signal(self.name)
+
+    def _drain_replayed(self):
+        while self._replayed:
+            entry = self._replayed.popleft()
+            if self._frame is None:
+                continue
+            if entry.status == SYNCED:
+                self._track(entry.op, entry.key, entry.row)
+                # Bảng không đổi nhưng giờ đã khớp Sheet -> lần làm mới sau ghi ảnh chụp
+                self._snapshot_version = None
+            else:
+                # Thao tác lỗi đã được vá vào bảng -> tải lại để bỏ nó đi
+                self._discard()
+
+    def _patch_frame(self, op, key, row):
+        """Vá một thao tác vào bảng; False nếu không tìm thấy dòng cần vá."""
+        if op == "append":
+            self._append_rows([row])
+            return True
+        pos = self._position(key)
+        if pos is None:
+            return False
+        self._emit("removed", self._frame.iloc[pos:pos + 1])
+        if op == "update" and self.sort_by is not None:
+            # Ngày có thể đổi -> bỏ dòng cũ rồi chèn lại đúng vị trí
+            self._frame = self._frame.drop(self._frame.index[pos]).reset_index(drop=True)
+            self._insert(self._to_frame([row]))
+        elif op == "update":
+            new = self._to_frame([row])
+            self._emit("added", new)
+            self._frame = concat_frames([self._frame.iloc[:pos], new, self._frame.iloc[pos + 1:]])
+        else:
+            self._frame = self._frame.drop(self._frame.index[pos]).reset_index(drop=True)
+        return True
+
+    def _track(self, op, key, row):
+        """Dời mốc đồng bộ theo một thao tác đã thực sự lên Sheet."""
+        if op == "append":
+            self._synced_rows += 1
+            self._tail = self._record(row)
+        elif op == "update":
+            if self._is_tail(key):
+                self._tail = self._record(row)
+        else:
+            self._synced_rows -= 1
+            if self._is_tail(key):
+                # Không biết dòng cuối mới -> lần đồng bộ sau đối soát toàn bộ
+                self._tail = None
@@ -0,0 +1,73 @@
+"""Dựng các tầng dữ liệu từ cấu hình: backend, nhật ký ghi, ảnh chụp, bảng.
+
+Cấu hình là mục [storage] của secrets.toml, biến môi trường GIATUI_* được ưu
+tiên hơn. app.py (bọc trong st.cache_resource) và api.py cùng gọi các hàm ở
+đây nên hai tiến trình luôn chọn cùng backend và cùng thư mục ảnh chụp.
+Module này không dùng Streamlit.
+
+    [storage]
+    backend = "sqlite"            # hoặc "gsheets" (mặc định)      GIATUI_STORAGE
+    path = "giatui.db"                                              GIATUI_SQLITE_PATH
+    journal = "giatui_journal.jsonl"                                GIATUI_JOURNAL
+    api_journal = "giatui_api_journal.jsonl"                        GIATUI_API_JOURNAL
+    snapshots = "giatui_snapshots"                                  GIATUI_SNAPSHOTS
+    metrics_log = ""                                                GIATUI_METRICS_LOG
+
+Đường dẫn để chuỗi rỗng thì tắt tầng tương ứng.
+"""
+import os
+
+import gspread
+from oauth2client.service_account import ServiceAccountCredentials
+
+from cache import TableCache
+from journal import open_journal
+from partitioned import PartitionedTable
+from snapshot import SnapshotStore
+from storage import INVOICES_SHEET, SHEET_NAME, GSheetsBackend, SQLiteBackend
+
+SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+# Mỗi loại tiến trình một nhật ký riêng: (biến môi trường, khóa trong [storage], mặc định)
+JOURNALS = {
+    "app": ("GIATUI_JOURNAL", "journal", "giatui_journal.jsonl"),
+    "api": ("GIATUI_API_JOURNAL", "api_journal", "giatui_api_journal.jsonl"),
+}
+
+
+def _setting(cfg, env, key, default):
+    return os.environ.get(env, cfg.get(key, default))
+
+
+def gspread_client(service_account):
+    """Mục [gcp_service_account] của secrets.toml -> gspread client."""
+    creds = ServiceAccountCredentials.from_json_keyfile_dict(dict(service_account), SCOPE)
+    return gspread.authorize(creds)
+
+
+def open_backend(cfg, client):
+    """Google Sheets (mặc định) hoặc SQLite cục bộ; client() chỉ được gọi khi dùng Sheets."""
+    if _setting(cfg, "GIATUI_STORAGE", "backend", "gsheets") == "sqlite":
+        return SQLiteBackend(_setting(cfg, "GIATUI_SQLITE_PATH", "path", "giatui.db"))
+    return GSheetsBackend(client(), SHEET_NAME)
+
+
+def start_journal(cfg, queue, owner="app"):
+    """Nhật ký ghi của tiến trình (đã chạy luồng nền), hoặc None nếu bị tắt."""
+    path = _setting(cfg, *JOURNALS[owner])
+    return open_journal(path, queue).start() if path else None
+
+
+def open_snapshots(cfg):
+    path = _setting(cfg, "GIATUI_SNAPSHOTS", "snapshots", "giatui_snapshots")
+    return SnapshotStore(path) if path else None
+
+
+def metrics_log(cfg):
+    return _setting(cfg, "GIATUI_METRICS_LOG", "metrics_log", "") or None
+
+
+def open_table(backend, name, **kwargs):
+    """Cache của một trang; bảng phiếu chia theo tháng (PartitionedTable)."""
+    if name == INVOICES_SHEET:
+        return PartitionedTable(backend, name, **kwargs)
+    return TableCache(backend, name, **kwargs)
@@ -0,0 +1,112 @@
+"""Xuất báo cáo ra file Excel, chỉ khi người dùng bấm tải về.
+
+Workbook được ghi bằng chế độ write-only của openpyxl: từng dòng được đẩy
+thẳng xuống file tạm, không dựng cả mô hình ô trong bộ nhớ, nên xuất vài
+năm phiếu vẫn nhẹ. File đã xuất được giữ lại trên đĩa theo khóa (khoảng
+ngày, version của bảng, các trang kèm theo); bấm tải lại cùng khóa thì
+trả ngay file cũ, dạng file đã mở để nút tải về đọc thẳng từ đĩa.
+"""
+import collections
+import os
+import tempfile
+import threading
+
+import pandas as pd
+from openpyxl import Workbook
+
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+# Ghi theo từng khúc để không phải đổi cả bảng sang object Python một lần
+_CHUNK_ROWS = 5000
+
+
+def _cells(series):
+    """Một cột -> list giá trị Python mà openpyxl ghi được (NA -> ô trống)."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return [None if pd.isna(v) else v.to_pydatetime() for v in series]
+    if pd.api.types.is_numeric_dtype(series):
+        return series.tolist()
+    return [None if pd.isna(v) else str(v) for v in series]
+
+
+def _rows(frame):
+    for start in range(0, len(frame), _CHUNK_ROWS):
+        part = frame.iloc[start:start + _CHUNK_ROWS]
+        yield from zip(*(_cells(part[col]) for col in part.columns))
+
+
+def write_workbook(path, sheets):
+    """sheets: list (tên trang, DataFrame); ghi lần lượt vào một workbook write-only."""
+    wb = Workbook(write_only=True)
+    for title, frame in sheets:
+        ws = wb.create_sheet(title[:31])
+        ws.append([str(c) for c in frame.columns])
+        for row in _rows(frame):
+            ws.append(row)
+    wb.save(path)
+
+
+class ExportCache:
+    """Giữ tối đa `max_files` file đã xuất trên đĩa, bỏ file dùng lâu nhất trước.
+
+    Không truyền `directory` thì dùng một thư mục tạm riêng, tự xóa khi
+    ExportCache bị thu hồi hoặc tiến trình dừng. Mỗi khóa dựng file dưới khóa
+    riêng: một file lớn đang dựng không chặn người tải khoảng ngày khác.
+    """
+
+    def __init__(self, directory=None, max_files=8):
+        self._owned = None
+        if directory is None:
+            self._owned = tempfile.TemporaryDirectory(prefix="giatui_export_")
+            directory = self._owned.name
+        self.directory = directory
+        self.max_files = max_files
+        self._files = collections.OrderedDict()
+        # Khóa -> Lock của lần dựng đang chạy (người hỏi cùng khóa chờ, khóa khác không chờ)
+        self._building = {}
+        self._lock = threading.Lock()
+
+    def _cached(self, key, opener):
+        path = self._files.get(key)
+        if path is None or not os.path.exists(path):
+            return None
+        self._files.move_to_end(key)
+        return opener(path)
+
+    def _get(self, key, build, opener):
+        with self._lock:
+            found = self._cached(key, opener)
+            if found is not None:
+                return found
+            building = self._building.setdefault(key, threading.Lock())
+        with building:
+            with self._lock:
+                found = self._cached(key, opener)
+                if found is not None:
+                    return found
+            fd, path = tempfile.mkstemp(suffix=".xlsx", dir=self.directory)
+            os.close(fd)
+            try:
+                build(path)
+            except Exception:
+                os.remove(path)
+                with self._lock:
+                    self._building.pop(key, None)
+                raise
+            with self._lock:
+                # Mở trước khi có thể bị dọn bên dưới (file đã mở vẫn đọc được sau khi xóa)
+                found = opener(path)
+                self._files[key] = path
+                self._building.pop(key, None)
+                while len(self._files) > self.max_files:
+                    _, old = self._files.popitem(last=False)
+                    if os.path.exists(old):
+                        os.remove(old)
+            return found
+
+    def get(self, key, build):
+        """Đường dẫn file ứng với key; chưa có thì gọi build(path) để tạo."""
+        return self._get(key, build, lambda path: path)
+
+    def open(self, key, build):
+        """Như get() nhưng trả về file đã mở (rb): nơi tải về đọc dần, không nạp cả file ở đây."""
+        return self._get(key, build, lambda path: open(path, "rb"))
@@ -0,0 +1,139 @@
+"""Nhập phiếu hàng loạt từ file CSV / Excel (bảng kê của khách sạn đối tác).
+
+Cột trong file được khớp với INVOICE_COLUMNS theo tên đã bỏ dấu, viết
+thường ("so phieu", "khan tam lon trang"...), kèm vài tên hay gặp. Cả
+file được kiểm tra theo từng cột một lượt, không lặp từng dòng: thiếu /
+trùng số phiếu, số phiếu đã có, khách hàng lạ, ngày sai, số lượng âm,
+không phải số hoặc lớn hơn QTY_MAX (cột mặt hàng trong bảng là uint16). Các dòng hợp lệ được ghi bằng một lệnh append_rows
+cho mỗi trang tính tháng.
+"""
+import io
+
+import numpy as np
+import pandas as pd
+
+from schema import QTY_DTYPE, parse_dates
+from search import fold
+from storage import INVOICE_COLUMNS, ITEMS, REVISION_COLUMN
+
+REQUIRED_COLUMNS = ["Ngày", "Số phiếu", "Khách hàng"]
+NUMBER_COLUMNS = ["Tổng Kg"] + ITEMS
+# Số lượng lớn nhất một mặt hàng trên phiếu (vượt quá sẽ bị cắt khi dựng bảng)
+QTY_MAX = int(np.iinfo(QTY_DTYPE).max)
+
+# Tên cột (đã bỏ dấu, viết thường) hay gặp trong bảng kê -> cột của app
+ALIASES = {
+    "ngay giat": "Ngày",
+    "ma phieu": "Số phiếu",
+    "so hd": "Số phiếu",
+    "khach": "Khách hàng",
+    "ten khach hang": "Khách hàng",
+    "kg": "Tổng Kg",
+    "so kg": "Tổng Kg",
+    "tong can": "Tổng Kg",
+}
+
+
+class ImportFileError(Exception):
+    """File không đọc được hoặc thiếu cột bắt buộc."""
+
+
+def _normalize(name):
+    return " ".join(fold(name).split())
+
+
+def read_upload(data, filename):
+    """Nội dung file tải lên (bytes) -> DataFrame thô, giữ nguyên giá trị như trong file."""
+    try:
+        if filename.lower().endswith((".xlsx", ".xlsm")):
+            return pd.read_excel(io.BytesIO(data), dtype=object)
+        # sep=None: tự nhận dấu phân cách (Excel tiếng Việt hay xuất CSV với dấu ;)
+        return pd.read_csv(io.BytesIO(data), dtype=str, keep_default_na=False,
+                           sep=None, engine="python", encoding="utf-8-sig")
+    except Exception as e:
+        raise ImportFileError(f"Không đọc được file {filename}: {e}") from e
+
+
+def map_columns(raw):
+    """Đổi tên cột theo INVOICE_COLUMNS; trả về (DataFrame đủ cột, các cột trong file không dùng)."""
+    lookup = {_normalize(col): col for col in INVOICE_COLUMNS}
+    lookup.update(ALIASES)
+    rename, unused = {}, []
+    for col in raw.columns:
+        target = lookup.get(_normalize(col))
+        if target is None or target in rename.values():
+            unused.append(col)
+        else:
+            rename[col] = target
+    missing = [col for col in REQUIRED_COLUMNS if col not in rename.values()]
+    if missing:
+        raise ImportFileError(f"File thiếu cột: {', '.join(missing)}")
+    frame = raw[list(rename)].rename(columns=rename).reset_index(drop=True)
+    for col in INVOICE_COLUMNS:
+        if col not in frame:
+            frame[col] = 0 if col in NUMBER_COLUMNS else ""
+    return frame[INVOICE_COLUMNS], unused
+
+
+def _text(column):
+    return column.fillna("").astype(str).str.strip()
+
+
+def _numbers(frame):
+    # Ô trống = 0; "2,5" (dấu phẩy thập phân) = 2.5; chữ -> NaN để báo lỗi
+    block = frame[NUMBER_COLUMNS].apply(lambda col: _text(col).str.replace(",", ".", regex=False).replace("", "0"))
+    return block.apply(pd.to_numeric, errors="coerce")
+
+
+def validate_invoices(frame, customers, existing_keys):
+    """Kiểm tra cả bảng đã map_columns.
+
+    customers: dict tên khách hàng -> địa chỉ (điền khi ô Địa chỉ trống);
+    existing_keys: các số phiếu đã có. Trả về (list dòng hợp lệ theo
+    INVOICE_COLUMNS, DataFrame lỗi gồm Dòng / Số phiếu / Lỗi).
+    """
+    keys = _text(frame["Số phiếu"])
+    customer = _text(frame["Khách hàng"])
+    # map_columns trả về chỉ số 0..n-1, cùng chỉ số với Series ngày
+    days = parse_dates(frame["Ngày"].where(frame["Ngày"].notna(), "").to_numpy())
+    numbers = _numbers(frame)
+    items = numbers[ITEMS]
+
+    checks = [
+        ("Thiếu số phiếu", keys == ""),
+        ("Số phiếu trùng trong file", keys.duplicated(keep=False) & (keys != "")),
+        ("Số phiếu đã có", keys.isin(set(map(str, existing_keys)))),
+        ("Khách hàng không có trong danh sách", ~customer.isin(list(customers))),
+        ("Ngày không hợp lệ", days.isna()),
+        ("Số lượng không phải số", numbers.isna().any(axis=1)),
+        ("Số lượng âm", (numbers < 0).any(axis=1)),
+        ("Số lượng mặt hàng phải là số nguyên", (items.fillna(0) % 1 != 0).any(axis=1)),
+        (f"Số lượng mặt hàng không được quá {QTY_MAX}", (items > QTY_MAX).any(axis=1)),
+    ]
+    message = pd.Series("", index=frame.index)
+    for reason, mask in checks:
+        message = message.where(~mask, message + reason + "; ")
+    bad = message != ""
+
+    errors = pd.DataFrame({
+        # Dòng trong file: dòng 1 là tiêu đề
+        "Dòng": frame.index[bad] + 2,
+        "Số phiếu": keys[bad].to_numpy(),
+        "Lỗi": message[bad].str.rstrip("; ").to_numpy(),
+    })
+
+    ok = ~bad
+    address = _text(frame["Địa chỉ"])[ok]
+    address = address.where(address != "", customer[ok].map(customers).fillna(""))
+    valid = pd.DataFrame({
+        "Ngày": days[ok].dt.strftime("%Y-%m-%d"),
+        "Số phiếu": keys[ok],
+        "Khách hàng": customer[ok],
+        "Địa chỉ": address,
+        "Ghi chú": _text(frame["Ghi chú"])[ok],
+        "Tổng Kg": numbers["Tổng Kg"][ok].astype(float),
+        **{item: items[item][ok].astype(np.int64) for item in ITEMS},
+        # Phiên bản do bảng đóng lúc ghi
+        REVISION_COLUMN: "",
+    }, columns=INVOICE_COLUMNS)
+    return valid.to_numpy(dtype=object).tolist(), errors
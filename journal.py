@@ -0,0 +1,324 @@
+"""Nhật ký ghi trước (write-ahead journal) trên đĩa cục bộ.
+
+Mỗi thao tác ghi được nối vào một file JSON Lines (fsync xong mới báo đã
+lưu), nên form nhập phiếu không phải chờ Google Sheets. Một luồng nền đọc
+các thao tác còn treo và phát lại xuống Sheet qua WriteQueue, đúng thứ tự.
+
+Định dạng file (mỗi dòng một JSON):
+    {"seq": 7, "op": "append", "name": "Sheet1", "key": null, "row": [...], "ts": ...}
+    {"seq": 8, "op": "update", "name": "Phiếu 2024-03", "key": "105", "row": [...], "expected": "2024-03-02 ...", ...}
+    {"seq": 7, "done": "synced"}
+    {"seq": 8, "done": "failed", "error": "..."}
+
+Sửa / xóa mang theo `expected` (phiên bản người dùng đã mở): lúc phát lại
+dòng trên Sheet đã đổi thì thao tác bị đánh dấu lỗi, không ghi đè.
+
+Khởi động lại sau sự cố: các thao tác chưa có dòng "done" được phát lại.
+Thao tác đã kịp lên Sheet trước khi sập (chưa kịp ghi "done") được nhận ra
+và đánh dấu đã đồng bộ: dòng thêm mới đã có trên Sheet (không bị nhân đôi),
+dòng sửa đã mang đúng phiên bản của thao tác, dòng xóa không còn khóa trên
+Sheet (không báo lỗi RevisionConflict / "không tìm thấy" cho lần lưu đã thành
+công). Thao tác sau trên cùng khóa đã lên Sheet thì các thao tác trước nó
+cũng vậy.
+
+Mỗi file nhật ký chỉ một tiến trình dùng (khóa độc quyền <file>.lock):
+số thứ tự seq và việc viết lại file khi dọn chỉ đúng khi không ai khác
+cùng ghi. open_journal chọn file còn trống (path, path.1, path.2...);
+tiến trình khởi động lại nhận lại file đó cùng các thao tác còn treo.
+"""
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from storage import COLUMNS, KEY_COLUMNS, REVISION_COLUMNS, is_transient_error, plain_value
+from writequeue import WriteQueue
+
+PENDING = "pending"
+SYNCED = "synced"
+FAILED = "failed"
+DISMISSED = "dismissed"
+
+
+class JournalEntry:
+    def __init__(self, seq, op, name, key=None, row=None, ts=None, recovered=False, expected=None):
+        self.seq = seq
+        self.op = op
+        self.name = name
+        self.key = key
+        self.row = row
+        self.expected = expected
+        self.ts = ts or time.time()
+        self.recovered = recovered
+        self.status = PENDING
+        self.error = None
+        self.attempts = 0
+
+    # Cùng giao diện với WriteTicket để app.report_write dùng chung
+    @property
+    def ok(self):
+        return self.status != FAILED
+
+    @property
+    def result(self):
+        return self.status != FAILED
+
+    def to_json(self):
+        return {"seq": self.seq, "op": self.op, "name": self.name, "key": self.key, "row": self.row, "ts": self.ts,
+                "expected": self.expected}
+
+
+class JournalBusy(Exception):
+    """File nhật ký đang được tiến trình khác dùng."""
+
+
+def _lock_exclusive(path):
+    """Mở và khóa độc quyền file khóa (không chờ); None nếu tiến trình khác đang giữ."""
+    handle = open(path, "a")
+    try:
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        handle.close()
+        return None
+    return handle
+
+
+def open_journal(path, queue, slots=16, **kwargs):
+    """Nhật ký của tiến trình này: file `path`, hoặc path.1, path.2... nếu file trước đang có tiến trình khác giữ."""
+    for slot in range(slots):
+        try:
+            return Journal(path if slot == 0 else f"{path}.{slot}", queue, **kwargs)
+        except JournalBusy:
+            continue
+    raise JournalBusy(f"Cả {slots} file nhật ký {path}* đều đang được dùng.")
+
+
+class Journal:
+    def __init__(self, path, queue, retry_interval=5.0, compact_bytes=1 << 20):
+        # Giữ khóa suốt đời tiến trình; hệ điều hành tự nhả khi tiến trình dừng
+        self._owner = _lock_exclusive(path + ".lock")
+        if self._owner is None:
+            raise JournalBusy(f"Nhật ký {path} đang được tiến trình khác dùng.")
+        self.path = path
+        self.queue = queue
+        self.retry_interval = retry_interval
+        self.compact_bytes = compact_bytes
+        # Giữ trong lúc phát lại một lô; bên đọc Sheet giữ khóa này để không đọc giữa chừng
+        self.replay_lock = threading.Lock()
+        self._entries = {}
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._listeners = []
+        self._thread = None
+        self._recover()
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    # --- ĐỌC LẠI SAU KHI KHỞI ĐỘNG ---
+    def _recover(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    data = json.loads(line)
+                except ValueError:
+                    continue  # dòng cuối bị cắt dở khi sập
+                self._seq = max(self._seq, data["seq"])
+                if "done" not in data:
+                    self._entries[data["seq"]] = JournalEntry(
+                        data["seq"], data["op"], data["name"], data.get("key"), data.get("row"),
+                        data.get("ts"), recovered=True, expected=data.get("expected"),
+                    )
+                elif data["done"] == FAILED and data["seq"] in self._entries:
+                    entry = self._entries[data["seq"]]
+                    entry.status, entry.error, entry.recovered = FAILED, data.get("error"), False
+                else:
+                    self._entries.pop(data["seq"], None)
+
+    # --- GHI ---
+    def _write_lines(self, lines):
+        # Nhiều dòng, một lần fsync
+        self._file.write("".join(json.dumps(data, ensure_ascii=False) + "\n" for data in lines))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def record(self, op, name, key=None, row=None, expected=None):
+        """Lưu thao tác xuống đĩa rồi trả về ngay; việc ghi lên Sheet do luồng nền làm."""
+        return self.record_many(op, name, [(key, row)], expected=[expected])[0]
+
+    def record_many(self, op, name, items, expected=None):
+        """Như record() cho nhiều thao tác cùng loại [(khóa, dòng), ...] (nhập hàng loạt)."""
+        with self._lock:
+            entries = []
+            for (key, row), want in zip(items, expected or [None] * len(items)):
+                self._seq += 1
+                row = [plain_value(v) for v in row] if row is not None else None
+                entries.append(JournalEntry(self._seq, op, name, plain_value(key), row, expected=want))
+            self._write_lines([entry.to_json() for entry in entries])
+            for entry in entries:
+                self._entries[entry.seq] = entry
+        self._wake.set()
+        return entries
+
+    def _mark(self, entry, status, error=None):
+        self._mark_many([(entry, status, error)])
+
+    def _mark_many(self, marks):
+        with self._lock:
+            lines = []
+            for entry, status, error in marks:
+                entry.status, entry.error = status, error
+                line = {"seq": entry.seq, "done": status}
+                if error:
+                    line["error"] = error
+                lines.append(line)
+                if status != FAILED:
+                    self._entries.pop(entry.seq, None)
+            self._write_lines(lines)
+        for entry, _, _ in marks:
+            for listener in self._listeners:
+                listener(entry)
+
+    def dismiss(self, seq):
+        """Bỏ qua một thao tác đã lỗi (người dùng đã xử lý tay)."""
+        entry = self._entries.get(seq)
+        if entry is not None and entry.status == FAILED:
+            self._mark(entry, DISMISSED)
+
+    # --- TRẠNG THÁI ---
+    def subscribe(self, listener):
+        """listener(entry) được gọi khi một thao tác đã lên Sheet hoặc bị lỗi."""
+        self._listeners.append(listener)
+
+    def pending(self, name=None):
+        with self._lock:
+            return [e for e in self._entries.values()
+                    if e.status == PENDING and (name is None or e.name == name)]
+
+    def failed(self):
+        with self._lock:
+            return [e for e in self._entries.values() if e.status == FAILED]
+
+    def close(self):
+        """Đóng file và nhả khóa (tiến trình khác / lần mở sau dùng lại được file này)."""
+        with self._lock:
+            self._file.close()
+            self._owner.close()
+
+    # --- LUỒNG NỀN PHÁT LẠI ---
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="journal-replay", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.retry_interval)
+            self._wake.clear()
+            try:
+                self.replay()
+            except Exception:
+                pass  # lần sau thử lại; thao tác vẫn nằm trong nhật ký
+
+    def replay(self):
+        with self.replay_lock:
+            batch = self.pending()
+            if batch and any(e.recovered for e in batch):
+                self._skip_already_written(batch)
+                batch = self.pending()
+            for segment in WriteQueue.segments(batch):
+                tickets = [self.queue.submit(e.op, e.name, key=e.key, row=e.row, expected=e.expected) for e in segment]
+                self.queue.flush()
+                stalled = False
+                marks = []
+                for entry, ticket in zip(segment, tickets):
+                    entry.attempts += ticket.attempts
+                    if ticket.ok and ticket.result:
+                        marks.append((entry, SYNCED, None))
+                    elif ticket.ok:
+                        marks.append((entry, FAILED, "Không tìm thấy dòng cần ghi trên Sheet."))
+                    elif is_transient_error(ticket.error):
+                        entry.error = str(ticket.error)
+                        stalled = True
+                    else:
+                        marks.append((entry, FAILED, str(ticket.error)))
+                if marks:
+                    self._mark_many(marks)
+                if stalled:
+                    # Giữ đúng thứ tự: chưa ghi được thì chưa phát lại các thao tác sau
+                    break
+            self._compact()
+
+    def _skip_already_written(self, batch):
+        backend = self.queue.backend
+        existing = {}
+        recovered = [entry for entry in batch if entry.recovered]
+        written = []
+        for entry in recovered:
+            entry.recovered = False
+            if entry.name not in existing:
+                existing[entry.name] = [backend.record_from_row(entry.name, r) for r in backend.read_rows(entry.name)]
+            written.append(self._written(entry, existing[entry.name]))
+        # Phát lại theo đúng thứ tự: thao tác sau trên cùng khóa đã lên Sheet thì thao tác trước cũng đã lên
+        later = set()
+        for i in reversed(range(len(recovered))):
+            keys = self._keys(recovered[i])
+            if keys & later:
+                written[i] = True
+            if written[i]:
+                later |= keys
+        for entry, done in zip(recovered, written):
+            if done:
+                self._mark(entry, SYNCED)
+
+    @staticmethod
+    def _keys(entry):
+        # Khóa cũ (sửa / xóa) và khóa trên dòng mới (thêm / sửa có thể đổi Số phiếu)
+        keys = set() if entry.key is None else {(entry.name, str(entry.key))}
+        if entry.row is not None:
+            keys.add((entry.name, str(entry.row[COLUMNS[entry.name].index(KEY_COLUMNS[entry.name])])))
+        return keys
+
+    def _written(self, entry, records):
+        """Thao tác đã có hiệu lực trên Sheet (records = các dòng hiện có, dạng record_from_row)?"""
+        backend = self.queue.backend
+        key_column = KEY_COLUMNS[entry.name]
+        if entry.op == "delete":
+            return all(str(r[key_column]) != str(entry.key) for r in records)
+        record = backend.record_from_row(entry.name, entry.row)
+        revision_column = REVISION_COLUMNS.get(entry.name)
+        if entry.op == "append" or revision_column is None or record.get(revision_column) in (None, ""):
+            return record in records
+        # Sửa: dòng mang khóa mới đã có đúng phiên bản do thao tác này đóng
+        return any(str(r[key_column]) == str(record[key_column]) and r[revision_column] == record[revision_column]
+                   for r in records)
+
+    def _compact(self):
+        # Hết thao tác treo và file đã lớn -> viết lại file chỉ với các thao tác lỗi
+        with self._lock:
+            if any(e.status == PENDING for e in self._entries.values()):
+                return
+            if self._file.tell() < self.compact_bytes:
+                return
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                for entry in self._entries.values():
+                    f.write(json.dumps(entry.to_json(), ensure_ascii=False) + "\n")
+                    f.write(json.dumps({"seq": entry.seq, "done": FAILED, "error": entry.error},
+                                       ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._file.close()
+            os.replace(tmp, self.path)
+            self._file = open(self.path, "a", encoding="utf-8")
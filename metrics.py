@@ -0,0 +1,243 @@
+"""Số đo các đường nóng: lệnh API Google, thao tác backend, cache và từng phần giao diện.
+
+Số đo giữ trong bộ nhớ của tiến trình, trong vòng đệm có giới hạn (deque
+maxlen), nên chạy lâu cũng không phình. Mỗi lần Streamlit chạy lại script
+là một lượt (run): số đo trong luồng của lượt đó được gắn vào lượt, để xem
+một lần bấm tốn thời gian vào đâu; fragment chạy lại một mình cũng là một
+lượt (run_scope). Số đo từ luồng khác (nhật ký, tải file
+về) chỉ có trong bảng tổng hợp.
+
+Tùy chọn ghi thêm từng số đo ra file JSONL; logger "giatui.metrics" nhận
+mọi số đo ở mức DEBUG.
+"""
+import collections
+import contextlib
+import itertools
+import json
+import logging
+import re
+import threading
+import time
+
+import pandas as pd
+
+from storage import PARTITION_PREFIX, is_partition
+
+logger = logging.getLogger("giatui.metrics")
+
+API = "api"
+BACKEND = "backend"
+CACHE = "cache"
+PHASE = "phase"
+
+
+class Run:
+    """Một lần chạy script: các số đo (loại, tên, ms) và số lần đếm trong lượt."""
+
+    def __init__(self, run_id, label):
+        self.id = run_id
+        self.label = label
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._last = self._start
+        self.finished = False
+        self.events = []
+        self.counts = collections.Counter()
+
+    @property
+    def total_ms(self):
+        # Lượt bị cắt ngang (st.stop / st.rerun) tính tới số đo cuối cùng
+        return (self._last - self._start) * 1000
+
+
+class Metrics:
+    def __init__(self, max_events=5000, max_runs=200, log_path=None):
+        self.events = collections.deque(maxlen=max_events)
+        self.runs = collections.deque(maxlen=max_runs)
+        self.counts = collections.Counter()
+        self._ids = itertools.count(1)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._log = open(log_path, "a", encoding="utf-8") if log_path else None
+
+    # --- LƯỢT CHẠY ---
+    def begin_run(self, label):
+        run = Run(next(self._ids), label)
+        with self._lock:
+            self.runs.append(run)
+        self._local.run = run
+        return run
+
+    def end_run(self):
+        run = getattr(self._local, "run", None)
+        if run is None:
+            return
+        run._last = time.perf_counter()
+        run.finished = True
+        self._local.run = None
+        if self._log is not None:
+            with self._lock:
+                self._log.flush()
+
+    @contextlib.contextmanager
+    def run_scope(self, label):
+        """Mở lượt riêng nếu luồng chưa có lượt (fragment chạy lại một mình, không qua begin_run)."""
+        if getattr(self._local, "run", None) is not None:
+            yield
+            return
+        self.begin_run(label)
+        try:
+            yield
+        finally:
+            self.end_run()
+
+    # --- GHI SỐ ĐO ---
+    def record(self, kind, name, ms):
+        run = getattr(self._local, "run", None)
+        event = (time.time(), run.id if run else None, kind, name, ms)
+        with self._lock:
+            self.events.append(event)
+            if run is not None:
+                run.events.append((kind, name, ms))
+                run._last = time.perf_counter()
+            if self._log is not None:
+                self._log.write(json.dumps(dict(zip(("at", "run", "kind", "name", "ms"), event)),
+                                           ensure_ascii=False) + "\n")
+        logger.debug("%s %s %.1f ms", kind, name, ms)
+
+    @contextlib.contextmanager
+    def timed(self, kind, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(kind, name, (time.perf_counter() - start) * 1000)
+
+    def phase(self, name):
+        """Đo một phần giao diện: `with tab1, metrics.phase("Báo cáo"):`."""
+        return self.timed(PHASE, name)
+
+    def count(self, kind, name):
+        """Đếm sự kiện không cần đo thời gian (vd. cache có sẵn dữ liệu)."""
+        run = getattr(self._local, "run", None)
+        with self._lock:
+            self.counts[(kind, name)] += 1
+            if run is not None:
+                run.counts[(kind, name)] += 1
+
+    def clear(self):
+        with self._lock:
+            self.events.clear()
+            self.runs.clear()
+            self.counts.clear()
+
+    # --- TỔNG HỢP ---
+    def runs_frame(self):
+        """Mỗi lượt một dòng: tổng thời gian và phần của API / backend / giao diện."""
+        with self._lock:
+            runs = list(self.runs)
+        records = []
+        for run in runs:
+            events = pd.DataFrame(run.events, columns=["kind", "name", "ms"])
+            by_kind = events.groupby("kind")["ms"]
+            total, calls = by_kind.sum(), by_kind.count()
+            records.append({
+                "Lượt": run.id,
+                "Lúc": pd.Timestamp(run.started, unit="s"),
+                "Người dùng": run.label,
+                "Tổng ms": round(run.total_ms, 1),
+                "Giao diện ms": round(total.get(PHASE, 0.0), 1),
+                "Backend ms": round(total.get(BACKEND, 0.0), 1),
+                "API ms": round(total.get(API, 0.0), 1),
+                "Lệnh API": int(calls.get(API, 0)),
+                "Cache có sẵn": sum(n for (kind, _), n in run.counts.items() if kind == CACHE),
+                "Cache tải / đồng bộ": int(calls.get(CACHE, 0)),
+                "Xong": run.finished,
+            })
+        return pd.DataFrame(records)
+
+    def run_events(self, run_id):
+        with self._lock:
+            run = next((r for r in self.runs if r.id == run_id), None)
+            events = list(run.events) if run is not None else []
+        return pd.DataFrame(events, columns=["Loại", "Tên", "ms"])
+
+    def summary_frame(self):
+        """Theo (loại, tên): số lần, tổng / trung bình / p95 / lớn nhất (ms), trên các số đo còn giữ."""
+        with self._lock:
+            events = pd.DataFrame(list(self.events), columns=["at", "run", "Loại", "Tên", "ms"])
+            counts = dict(self.counts)
+        grouped = events.groupby(["Loại", "Tên"])["ms"]
+        summary = pd.DataFrame({
+            "Số lần": grouped.count(),
+            "Tổng ms": grouped.sum(),
+            "TB ms": grouped.mean(),
+            "p95 ms": grouped.quantile(0.95),
+            "Lớn nhất ms": grouped.max(),
+        }).round(1).reset_index()
+        hits = pd.DataFrame([{"Loại": kind, "Tên": name, "Số lần": n} for (kind, name), n in counts.items()])
+        return pd.concat([summary, hits], ignore_index=True).sort_values(["Loại", "Tên"], ignore_index=True)
+
+
+# --- GẮN VÀO BACKEND / CLIENT ---
+def table_label(name):
+    """Các trang phiếu theo tháng gộp chung một tên trong số đo."""
+    return f"{PARTITION_PREFIX}*" if is_partition(name) else str(name)
+
+
+class MeasuredBackend:
+    """Bọc một backend: đo thời gian các hàm đọc / ghi, còn lại chuyển thẳng."""
+
+    MEASURED = ("read_rows", "read_rows_from", "read_tail", "prefetch", "append_rows", "update_rows", "delete_rows")
+
+    def __init__(self, backend, metrics):
+        self.backend = backend
+        self.metrics = metrics
+
+    def __getattr__(self, attr):
+        value = getattr(self.backend, attr)
+        if attr not in self.MEASURED:
+            return value
+
+        def measured(name, *args, **kwargs):
+            label = "+".join(sorted({table_label(n) for n in name})) if attr == "prefetch" else table_label(name)
+            with self.metrics.timed(BACKEND, f"{attr} {label}"):
+                return value(name, *args, **kwargs)
+        return measured
+
+
+_SPREADSHEET_PATH = re.compile(r"/spreadsheets/[^/:]+(.*)$")
+
+
+def _endpoint(url):
+    """URL của Sheets API -> tên ngắn của lệnh (values:batchGet, values:append, metadata...)."""
+    path = url.split("?")[0]
+    match = _SPREADSHEET_PATH.search(path)
+    if match is None:
+        return "drive" if "/drive/" in path else path
+    rest = match.group(1)
+    if not rest:
+        return "metadata"
+    if rest.startswith(":"):
+        return rest[1:]
+    if rest.startswith("/values:"):
+        return rest[1:]
+    if rest.startswith("/values/"):
+        action = rest.rsplit(":", 1)[-1]
+        return f"values:{action}" if action in ("append", "clear") else "values:range"
+    return rest
+
+
+def instrument_client(client, metrics):
+    """Đo từng request HTTP của gspread (mỗi request là một lệnh tính vào hạn mức API)."""
+    http = getattr(client, "http_client", None)
+    if http is None:
+        return client
+    request = http.request
+
+    def measured(method, endpoint, *args, **kwargs):
+        with metrics.timed(API, f"{method.upper()} {_endpoint(endpoint)}"):
+            return request(method, endpoint, *args, **kwargs)
+
+    http.request = measured
+    return client
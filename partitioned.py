@@ -0,0 +1,301 @@
+"""Bảng phiếu chia theo tháng: mỗi tháng một trang tính, cùng giao diện với TableCache.
+
+Phiếu mới được ghi vào trang của tháng chứa ngày trên phiếu ("Phiếu 2024-03").
+Trang Sheet1 cũ được giữ nguyên làm một phân vùng "đóng băng" chứa toàn bộ
+lịch sử trước khi chia tháng. Trang Catalog ghi các trang tính phiếu cùng
+khoảng ngày của chúng; hỏi một khoảng ngày thì chỉ tải các trang giao với
+khoảng đó, nên thời gian tải phụ thuộc khoảng ngày đang xem chứ không phụ
+thuộc số năm đã kinh doanh.
+
+Mỗi phân vùng là một TableCache riêng. Các tháng đã qua (và Sheet1 cũ) hầu
+như không đổi nên dùng ttl dài; tháng hiện tại đồng bộ theo ttl thường.
+Thay đổi của mọi phân vùng đã tải được chuyển tiếp cho các bên theo dõi
+(Rollups, CustomerPartitions, ...) như thể là một bảng.
+"""
+import datetime
+import threading
+import time
+
+import pandas as pd
+
+from cache import TableCache
+from schema import FRAME_BUILDERS, SORT_COLUMNS, concat_frames
+from storage import (
+    CATALOG_SHEET, COLUMNS, KEY_COLUMNS, INVOICES_SHEET, REVISION_COLUMNS, is_partition, partition_name,
+)
+from writequeue import DONE, WriteQueue, WriteTicket
+
+
+def _date(value):
+    day = pd.to_datetime(value, errors="coerce")
+    return None if pd.isna(day) else day.date()
+
+
+def _month_end(day):
+    return (pd.Timestamp(day) + pd.offsets.MonthEnd(0)).date()
+
+
+class PartitionedTable:
+    def __init__(self, backend, name=INVOICES_SHEET, ttl=60, frozen_ttl=6 * 3600, catalog_ttl=5 * 60,
+                 queue=None, journal=None, snapshots=None, metrics=None):
+        self.backend = backend
+        self.queue = queue or WriteQueue(backend)
+        self.journal = journal
+        self.snapshots = snapshots
+        self.metrics = metrics
+        self.name = name
+        self.ttl = ttl
+        self.frozen_ttl = frozen_ttl
+        self.catalog_ttl = catalog_ttl
+        self.columns = COLUMNS[name]
+        self.key_column = KEY_COLUMNS[name]
+        self.sort_by = SORT_COLUMNS[name]
+        # Tên trang tính -> (từ ngày, đến ngày); (None, None) = trang rỗng
+        self._catalog = {}
+        self._catalog_at = None
+        # Trang đã dùng nhưng ghi Catalog lỗi (không có nhật ký): tên -> (từ ngày, đến ngày)
+        self._unregistered = {}
+        self._caches = {}
+        self._merged = None
+        self._merged_of = None
+        self._listeners = []
+        self._lock = threading.RLock()
+
+    @property
+    def version(self):
+        with self._lock:
+            return len(self._caches) + sum(c.version for c in self._caches.values())
+
+    # --- CATALOG ---
+    @property
+    def catalog_stale(self):
+        """True nếu lần truy cập tới sẽ đọc lại trang Catalog."""
+        return self._catalog_at is None or time.monotonic() - self._catalog_at >= self.catalog_ttl
+
+    def _refresh_catalog(self):
+        if not self.catalog_stale:
+            return
+        rows = self.backend.read_rows(CATALOG_SHEET)
+        if self.journal is not None:
+            # Dòng Catalog còn trong nhật ký (chưa lên Sheet, vd. khởi động lại lúc mất mạng)
+            rows = rows + [e.row for e in self.journal.pending(CATALOG_SHEET) + self.journal.failed()
+                           if e.name == CATALOG_SHEET]
+        catalog = {}
+        for name, start, end in rows:
+            catalog[str(name)] = (_date(start), _date(end))
+        for name, span in list(self._unregistered.items()):
+            # Lần trước ghi Catalog lỗi: ghi lại nếu Sheet vẫn chưa có
+            if name in catalog:
+                del self._unregistered[name]
+            else:
+                self._register(name, *span)
+                catalog[name] = span
+        if self.name not in catalog:
+            # Lần đầu chia tháng: đăng ký trang cũ với khoảng ngày thực tế của nó
+            days = self._cache(self.name).frame_ref()[self.sort_by].dropna()
+            span = (days.iloc[0].date(), days.iloc[-1].date()) if len(days) else (None, None)
+            self._register(self.name, *span)
+            catalog[self.name] = span
+        self._catalog.update(catalog)
+        self._catalog_at = time.monotonic()
+
+    def _register(self, name, start, end):
+        """Đăng ký trang vào Catalog; bảng Catalog trong bộ nhớ nhận ngay, không chờ Sheet.
+
+        Có nhật ký: dòng Catalog đi qua nhật ký như mọi thao tác ghi (và trước dòng phiếu đầu
+        tiên của trang). Không có: ghi lỗi thì nhớ lại, lần làm mới Catalog sau ghi lại.
+        """
+        self._catalog[name] = (start, end)
+        row = [name, "" if start is None else start.isoformat(), "" if end is None else end.isoformat()]
+        if self.journal is not None:
+            self.journal.record("append", CATALOG_SHEET, row=row)
+            return
+        if self.queue.execute("append", CATALOG_SHEET, row=row).ok:
+            self._unregistered.pop(name, None)
+        else:
+            self._unregistered[name] = (start, end)
+
+    def _overlapping(self, start=None, end=None):
+        """Các phân vùng (đã có trong Catalog) giao với [start, end]; None = không giới hạn."""
+        self._refresh_catalog()
+        names = []
+        for name, (first, last) in sorted(self._catalog.items(), key=lambda e: e[1][0] or datetime.date.min):
+            if first is None:
+                continue
+            if (end is None or first <= end) and (start is None or last >= start):
+                names.append(name)
+        return names
+
+    def _cache(self, name):
+        cache = self._caches.get(name)
+        if cache is None:
+            frozen = not is_partition(name) or name < partition_name(datetime.date.today())
+            cache = TableCache(self.backend, name, ttl=self.frozen_ttl if frozen else self.ttl,
+                               queue=self.queue, journal=self.journal, snapshots=self.snapshots,
+                               metrics=self.metrics)
+            cache.subscribe(self._forward)
+            self._caches[name] = cache
+        return cache
+
+    def _forward(self, event, rows):
+        # Phân vùng tải lần đầu = các dòng mới xuất hiện trong bảng chung
+        event = "added" if event == "reset" else event
+        for listener in self._listeners:
+            listener(event, rows)
+
+    # --- ĐỌC ---
+    def subscribe(self, listener):
+        """Như TableCache.subscribe; các phân vùng đã tải được báo như "added"."""
+        with self._lock:
+            self._listeners.append(listener)
+            loaded = [c.frame_ref() for c in self._caches.values() if c.loaded]
+            if loaded:
+                # Các phân vùng nằm theo thứ tự tải, không theo ngày
+                frame = concat_frames(loaded).sort_values(self.sort_by, kind="stable", ignore_index=True)
+                listener("reset", frame)
+
+    def sync(self, start=None, end=None):
+        """Tải / đồng bộ các phân vùng giao với [start, end] (mặc định: tất cả)."""
+        with self._lock:
+            for cache in self.caches(start, end):
+                cache.frame_ref()
+
+    def caches(self, start=None, end=None):
+        """TableCache của các phân vùng giao với [start, end], chưa tải (dùng với cache.warm)."""
+        with self._lock:
+            names = self._overlapping(_date(start) if start is not None else None,
+                                      _date(end) if end is not None else None)
+            return [self._cache(name) for name in names]
+
+    def frame(self):
+        return self.frame_ref().copy()
+
+    def frame_ref(self):
+        """Mọi phân vùng gộp lại, sắp theo ngày; người gọi KHÔNG được sửa DataFrame trả về."""
+        with self._lock:
+            frames = [self._cache(name).frame_ref() for name in self._overlapping()]
+            if self._merged_of is None or len(frames) != len(self._merged_of) \
+                    or any(a is not b for a, b in zip(frames, self._merged_of)):
+                merged = concat_frames(frames) if frames else self._empty()
+                self._merged = merged.sort_values(self.sort_by, kind="stable", ignore_index=True)
+                self._merged_of = frames
+            return self._merged
+
+    def between(self, start, end):
+        """Các dòng có ngày trong [start, end]; chỉ tải các phân vùng giao với khoảng đó."""
+        with self._lock:
+            names = self._overlapping(_date(start), _date(end))
+            parts = [self._cache(name).between(start, end) for name in names]
+        if not parts:
+            return self._empty()
+        if len(parts) == 1:
+            return parts[0]
+        return concat_frames(parts).sort_values(self.sort_by, kind="stable", ignore_index=True)
+
+    def latest(self, n):
+        """Như TableCache.latest: ghép đuôi (n dòng) của từng phân vùng, không gộp cả lịch sử."""
+        with self._lock:
+            tails = [self._cache(name).latest(n) for name in self._overlapping()]
+        total = sum(count for _, count in tails)
+        if not tails:
+            return self._empty(), 0
+        if len(tails) == 1:
+            return tails[0][0], total
+        merged = concat_frames([tail for tail, _ in tails]).sort_values(self.sort_by, kind="stable", ignore_index=True)
+        return merged.iloc[max(len(merged) - n, 0):], total
+
+    def _empty(self):
+        return FRAME_BUILDERS[self.name]([])
+
+    def contains(self, key):
+        return self._holder(key) is not None
+
+    def invalidate(self):
+        with self._lock:
+            self._catalog_at = None
+            for cache in self._caches.values():
+                cache.invalidate()
+
+    # --- GHI ---
+    def _holder(self, key):
+        """Phân vùng chứa khóa: tìm trong các phân vùng đã tải trước (mới nhất trước), rồi mới tải thêm."""
+        with self._lock:
+            loaded = [c for c in self._caches.values() if c.loaded]
+            # Theo ngày bắt đầu trong Catalog: Sheet1 cũ xếp sau mọi trang tháng
+            for cache in sorted(loaded, key=self._start_of, reverse=True):
+                if cache.contains(key):
+                    return cache
+            for name in reversed(self._overlapping()):
+                cache = self._cache(name)
+                if cache not in loaded and cache.contains(key):
+                    return cache
+        return None
+
+    def _start_of(self, cache):
+        return self._catalog.get(cache.name, (None, None))[0] or datetime.date.min
+
+    def _target(self, row):
+        """Phân vùng tháng cho một dòng mới (đăng ký vào Catalog nếu chưa có)."""
+        day = _date(row[self.columns.index(self.sort_by)]) or datetime.date.today()
+        name = partition_name(day)
+        with self._lock:
+            self._refresh_catalog()
+            if name not in self._catalog:
+                self._register(name, day.replace(day=1), _month_end(day))
+            return self._cache(name)
+
+    def _covers(self, cache, row):
+        first, last = self._catalog.get(cache.name, (None, None))
+        day = _date(row[self.columns.index(self.sort_by)])
+        if is_partition(cache.name):
+            return day is not None and partition_name(day) == cache.name
+        return day is not None and first is not None and first <= day <= last
+
+    def append(self, row):
+        return self._target(row).append(row)
+
+    def append_rows(self, rows):
+        """Thêm nhiều dòng: mỗi phân vùng tháng một lệnh append_rows; kết quả theo thứ tự các dòng."""
+        groups = {}
+        for pos, row in enumerate(rows):
+            groups.setdefault(self._target(row), []).append(pos)
+        results = [None] * len(rows)
+        for cache, positions in groups.items():
+            for pos, ticket in zip(positions, cache.append_rows([rows[p] for p in positions])):
+                results[pos] = ticket
+        return results
+
+    def update(self, key, row, expected=None):
+        """expected: phiên bản đã đọc (xem TableCache.update)."""
+        holder = self._holder(key)
+        if holder is None:
+            return self._missing("update", key, row)
+        if self._covers(holder, row):
+            return holder.update(key, row, expected=expected)
+        # Ngày đổi sang tháng khác: thêm vào phân vùng mới trước, thêm xong mới xóa dòng cũ (có điều kiện).
+        # Thêm lỗi thì phiếu cũ còn nguyên; xóa không được (xung đột / mất dòng) thì bỏ dòng vừa thêm.
+        target = self._target(row)
+        added = target.append(row)
+        if not added.ok:
+            return added
+        removed = holder.delete(key, expected=expected)
+        if not (removed.ok and removed.result):
+            # Xóa đúng dòng vừa thêm: phiên bản của nó vừa được đóng, không trùng dòng nào khác
+            target.delete(key, expected=self._revision(added.row))
+            return removed
+        return added
+
+    def _revision(self, row):
+        column = REVISION_COLUMNS.get(self.name)
+        return None if column is None else row[self.columns.index(column)]
+
+    def delete(self, key, expected=None):
+        holder = self._holder(key)
+        if holder is None:
+            return self._missing("delete", key)
+        return holder.delete(key, expected=expected)
+
+    def _missing(self, op, key, row=None):
+        ticket = WriteTicket(op, self.name, key=key, row=row)
+        ticket._finish(DONE, False)
+        return ticket
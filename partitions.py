@@ -0,0 +1,85 @@
+"""Phiếu chia theo khách hàng cho màn hình lịch sử của khách.
+
+Mỗi khách hàng có một DataFrame riêng, sắp theo Ngày, được cập nhật theo
+từng thay đổi của TableCache phiếu (chỉ đụng phần của khách có phiếu vừa
+thêm / sửa / xóa). Phiên của khách chỉ lấy đúng một trang trong phần của
+mình, không quét cả bảng của mọi khách sạn.
+"""
+import threading
+
+import numpy as np
+
+from schema import FRAME_BUILDERS, concat_frames
+
+
+class CustomerPartitions:
+    def __init__(self, table, column="Khách hàng"):
+        self.table = table
+        self.column = column
+        self._parts = {}
+        self._lock = threading.Lock()
+        table.subscribe(self._on_change)
+
+    # --- CẬP NHẬT THEO CACHE ---
+    def _on_change(self, event, rows):
+        with self._lock:
+            if event == "reset":
+                # Bảng gốc đã sắp theo ngày -> từng phần tách ra cũng đã sắp
+                self._parts = {
+                    str(name): part.reset_index(drop=True)
+                    for name, part in rows.groupby(rows[self.column].astype(str), sort=False)
+                }
+                return
+            for name, part in rows.groupby(rows[self.column].astype(str), sort=False):
+                name = str(name)
+                if event == "added":
+                    self._insert(name, part)
+                else:
+                    self._remove(name, part)
+
+    def _insert(self, name, rows):
+        current = self._parts.get(name)
+        if current is None or not len(current):
+            self._parts[name] = rows.sort_values("Ngày", kind="stable", ignore_index=True)
+        elif len(rows) == 1:
+            pos = np.searchsorted(current["Ngày"].to_numpy(), rows["Ngày"].to_numpy()[0], side="right")
+            self._parts[name] = concat_frames([current.iloc[:pos], rows, current.iloc[pos:]])
+        else:
+            merged = concat_frames([current, rows])
+            self._parts[name] = merged.sort_values("Ngày", kind="stable", ignore_index=True)
+
+    def _remove(self, name, rows):
+        current = self._parts.get(name)
+        if current is None:
+            return
+        keys = current[self.table.key_column].astype(str).to_numpy()
+        drop = []
+        for key in rows[self.table.key_column].astype(str):
+            matches = np.flatnonzero(keys == key)
+            matches = [m for m in matches if m not in drop]
+            if matches:
+                drop.append(matches[0])
+        if len(drop) == len(current):
+            del self._parts[name]
+        elif drop:
+            self._parts[name] = current.drop(current.index[drop]).reset_index(drop=True)
+
+    # --- TRUY VẤN ---
+    def count(self, customer):
+        self.table.sync()
+        with self._lock:
+            part = self._parts.get(str(customer))
+            return 0 if part is None else len(part)
+
+    def page(self, customer, page=1, per_page=50):
+        """Trang thứ `page` (từ 1) các phiếu của khách, mới nhất trước; trả về (DataFrame, tổng số phiếu)."""
+        self.table.sync()
+        with self._lock:
+            part = self._parts.get(str(customer))
+        if part is None:
+            return FRAME_BUILDERS[self.table.name]([]), 0
+        total = len(part)
+        # Phần đã sắp tăng dần: trang 1 là đuôi của phần
+        end = max(total - (page - 1) * per_page, 0)
+        start = max(end - per_page, 0)
+        return part.iloc[start:end].iloc[::-1].copy(), total
@@ -0,0 +1,251 @@
+"""Dựng HTML phiếu giao hàng, từng phiếu hoặc cả loạt để in một lần.
+
+Mẫu phiếu là một string.Template dựng sẵn lúc import; mỗi phiếu chỉ còn là
+một lần substitute. In hàng loạt thì ghép các phiếu thành một file HTML
+độc lập (mỗi phiếu một trang khi in), đủ lớn thì chia cho nhiều tiến
+trình con dựng song song. Khung file in và phần chia tiến trình dùng chung
+cho các loại giấy tờ khác (bảng kê trong billing.py). Module này không dùng
+Streamlit để tiến trình con import được nhanh.
+"""
+import html
+import os
+from concurrent.futures import ProcessPoolExecutor
+from string import Template
+
+import pandas as pd
+
+from storage import ITEMS
+
+# Số dòng tối thiểu của bảng mặt hàng (để trống cho ghi tay)
+MIN_ITEM_ROWS = 10
+# Ít hơn chừng này phiếu thì dựng tuần tự (khởi động tiến trình con còn tốn hơn)
+PARALLEL_MIN = 5000
+
+# Style của phần thân phiếu; dùng chung cho trang web và file in hàng loạt
+RECEIPT_CSS = """
+    .invoice-box {
+        max-width: 800px;
+        margin: auto;
+        padding: 30px;
+        border: 1px solid #eee;
+        box-shadow: 0 0 10px rgba(0, 0, 0, .15);
+        font-size: 16px;
+        line-height: 24px;
+        font-family: 'Times New Roman', serif;
+        color: #555;
+        background-color: white;
+    }
+    .invoice-header {
+        text-align: center;
+        color: #003366;
+        margin-bottom: 20px;
+    }
+    .invoice-table {
+        width: 100%;
+        border-collapse: collapse;
+        margin-top: 20px;
+    }
+    .invoice-table th, .invoice-table td {
+        border: 1px solid #333;
+        padding: 8px;
+        text-align: left;
+    }
+    .invoice-table th {
+        background-color: #f2f2f2;
+        text-align: center;
+        -webkit-print-color-adjust: exact; /* Giữ màu nền xám khi in */
+    }
+    .total-section {
+        margin-top: 20px;
+        text-align: right;
+        font-weight: bold;
+        font-size: 18px;
+    }
+    .signature-section {
+        display: flex;
+        justify-content: space-between;
+        margin-top: 40px;
+        text-align: center;
+    }
+"""
+
+_ITEM_ROW = Template("<tr><td style='text-align:center'>$no</td><td>$name</td><td style='text-align:center'>$qty</td><td></td><td></td></tr>")
+_BLANK_ROW = Template("<tr><td style='text-align:center'>$no</td><td></td><td></td><td></td><td></td></tr>")
+
+# HTML viết sát lề trái tuyệt đối (st.markdown hiểu dòng thụt vào là khối code)
+_RECEIPT = Template("""
+<div class="printable-area invoice-box">
+<div style="display:flex; align-items:center;">
+<div style="flex:1;">
+<img src="https://cdn-icons-png.flaticon.com/512/2983/2983720.png" width="60" style="float:left; margin-right:10px;">
+<b style="color:#003366">CÔNG TY TNHH GIẶT ỦI HẢI ÂU MŨI NÉ</b><br>
+<small>Thôn Thiện Sơn, Phường Mũi Né, Tỉnh Lâm Đồng</small><br>
+<small>Hotline: 037 808 2088 / 0908 848 393</small>
+</div>
+</div>
+<hr>
+<div class="invoice-header">
+<h2>PHIẾU GIAO HÀNG SẠCH</h2>
+<span>Số: <b style="color:red; font-size:1.2em">$receipt_no</b></span>
+</div>
+<table style="width:100%; margin-bottom:10px;">
+<tr>
+<td><b>Tên khách hàng:</b> $customer</td>
+<td style="text-align:right"><b>Loại hàng:</b> Hàng Sạch</td>
+</tr>
+<tr>
+<td colspan="2"><b>Địa chỉ:</b> $address</td>
+</tr>
+</table>
+<table class="invoice-table">
+<thead>
+<tr>
+<th style="width:50px">STT</th>
+<th>Tên mặt hàng</th>
+<th style="width:100px">Số lượng</th>
+<th style="width:150px">Tình trạng</th>
+<th>Ghi chú</th>
+</tr>
+</thead>
+<tbody>
+$rows
+</tbody>
+</table>
+<div class="total-section">
+Tổng Cộng (Kg): $total_kg Kg
+</div>
+<div style="margin-top:10px;">
+<i>Ghi chú chung: $note</i>
+</div>
+<div style="text-align:right; margin-top:20px;">
+<i>Ngày $day tháng $month năm $year</i>
+</div>
+<div class="signature-section">
+<div>
+<b>Người nhận hàng</b><br>
+<i>(Ký, họ tên)</i>
+<br><br><br><br>
+</div>
+<div>
+<b>Người giao hàng</b><br>
+<i>(Ký, họ tên)</i>
+<br><br><br><br>
+</div>
+<div>
+<b>Người lập phiếu</b><br>
+<i>(Ký, họ tên)</i>
+<br><br><br><br>
+
+</div>
+</div>
+</div>
+""")
+
+_DOCUMENT = Template("""<!DOCTYPE html>
+<html lang="vi">
+<head>
+<meta charset="utf-8">
+<title>$title</title>
+<style>
+$css
+    body { margin: 0; background: #f5f5f5; }
+    .invoice-box { margin: 20px auto; }
+    @media print {
+        body { background: white; }
+        .invoice-box {
+            margin: 0;
+            max-width: none;
+            border: none;
+            box-shadow: none;
+            break-after: page;
+            page-break-after: always;
+        }
+        .invoice-box:last-child { break-after: auto; page-break-after: auto; }
+        @page { size: A4; margin: 10mm; }
+    }
+</style>
+</head>
+<body>
+$body
+</body>
+</html>
+""")
+
+
+def _text(value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ""
+    return html.escape(str(value))
+
+
+def _quantity(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def receipt_fields(data):
+    """Một dòng phiếu (Series / dict) -> dict giá trị thuần để điền vào mẫu (gửi được sang tiến trình con)."""
+    day = pd.to_datetime(data["Ngày"], errors="coerce")
+    kg = pd.to_numeric(data["Tổng Kg"], errors="coerce")
+    return {
+        "receipt_no": _text(data["Số phiếu"]),
+        "customer": _text(data["Khách hàng"]),
+        "address": _text(data["Địa chỉ"]),
+        "note": _text(data["Ghi chú"]),
+        "total_kg": "" if pd.isna(kg) else f"{float(kg):g}",
+        "day": "" if pd.isna(day) else day.day,
+        "month": "" if pd.isna(day) else day.month,
+        "year": "" if pd.isna(day) else day.year,
+        "items": [(item, q) for item, q in ((item, _quantity(data.get(item, 0))) for item in ITEMS) if q > 0],
+    }
+
+
+def render_receipt(fields):
+    """dict từ receipt_fields -> HTML một phiếu."""
+    rows = [_ITEM_ROW.substitute(no=no, name=html.escape(name), qty=qty)
+            for no, (name, qty) in enumerate(fields["items"], 1)]
+    # Lấp đầy bảng cho đủ dòng
+    rows += [_BLANK_ROW.substitute(no=no) for no in range(len(rows) + 1, MIN_ITEM_ROWS + 1)]
+    return _RECEIPT.substitute(fields, rows="".join(rows))
+
+
+def _render_chunk(render, chunk):
+    return [render(fields) for fields in chunk]
+
+
+def render_parallel(render, records, workers=None, weight=None):
+    """render(fields) cho từng record, giữ nguyên thứ tự; đủ lớn thì chia cho các tiến trình con.
+
+    render phải là hàm cấp module (tiến trình con import được); weight(record) là số
+    dòng của record khi so với PARALLEL_MIN (mặc định mỗi record một dòng).
+    """
+    workers = workers or os.cpu_count() or 1
+    size = len(records) if weight is None else sum(weight(r) for r in records)
+    if workers < 2 or size < PARALLEL_MIN:
+        return _render_chunk(render, records)
+    # Chia xen kẽ (record i vào phần i % n) để record lớn / nhỏ rải đều các tiến trình
+    n = min(workers, len(records))
+    with ProcessPoolExecutor(max_workers=n) as pool:
+        rendered = list(pool.map(_render_chunk, [render] * n, [records[i::n] for i in range(n)]))
+    result = [None] * len(records)
+    for i, part in enumerate(rendered):
+        result[i::n] = part
+    return result
+
+
+def render_receipts(records, workers=None):
+    """Dựng HTML cho nhiều phiếu, giữ nguyên thứ tự; nhiều phiếu thì chia cho các tiến trình con."""
+    return render_parallel(render_receipt, records, workers)
+
+
+def html_document(title, body):
+    """File HTML độc lập quanh các khối .invoice-box, mỗi khối một trang khi in (Ctrl+P / lưu PDF)."""
+    return _DOCUMENT.substitute(title=html.escape(title), css=RECEIPT_CSS, body=body)
+
+
+def print_document(frame, title="Phiếu giao hàng", workers=None):
+    """DataFrame phiếu -> một file HTML, mỗi phiếu một trang khi in."""
+    records = [receipt_fields(row) for row in frame.to_dict("records")]
+    return html_document(title, "".join(render_receipts(records, workers)))
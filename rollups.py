@@ -0,0 +1,148 @@
+"""Bảng tổng hợp theo ngày × khách hàng, theo tháng × khách hàng và theo ngày (mọi khách).
+
+Mỗi ô tổng hợp giữ: số phiếu, tổng kg và số lượng của từng mặt hàng trong
+ITEMS. Bảng được cập nhật dần theo từng thay đổi của TableCache phiếu (thêm /
+sửa / xóa chỉ cộng hoặc trừ đúng phần chênh lệch), chỉ dựng lại toàn bộ khi
+cache tải lại cả trang tính.
+
+Truy vấn một khoảng ngày chỉ đụng tới các ô của những ngày trong khoảng đó
+(vài trăm ô), dù lịch sử phiếu dài bao nhiêu. Chuỗi theo ngày của mọi khách
+(series) giữ sẵn một ô mỗi ngày, nên xu hướng nhiều năm chỉ là vài nghìn ô.
+"""
+import bisect
+import threading
+
+import numpy as np
+import pandas as pd
+
+from storage import ITEMS
+
+COUNT_COLUMN = "Số phiếu"
+MEASURES = [COUNT_COLUMN, "Tổng Kg"] + ITEMS
+_SUMMED = ["Tổng Kg"] + ITEMS
+# "Khách hàng" của các ô cộng mọi khách
+ALL = ""
+
+
+class _Grid:
+    """Các ô (kỳ, khách hàng) -> vector MEASURES; danh sách kỳ giữ sắp sẵn để cắt theo khoảng."""
+
+    def __init__(self):
+        self.cells = {}
+        self.periods = []
+
+    def add(self, period, customer, values):
+        by_customer = self.cells.get(period)
+        if by_customer is None:
+            by_customer = self.cells[period] = {}
+            bisect.insort(self.periods, period)
+        current = by_customer.get(customer)
+        current = values.copy() if current is None else current + values
+        if current[0] <= 0:
+            # Hết phiếu trong ô -> bỏ ô (và bỏ kỳ nếu không còn khách nào)
+            by_customer.pop(customer, None)
+            if not by_customer:
+                del self.cells[period]
+                self.periods.pop(bisect.bisect_left(self.periods, period))
+        else:
+            by_customer[customer] = current
+
+    def between(self, start, end, customer=None):
+        lo = bisect.bisect_left(self.periods, start)
+        hi = bisect.bisect_right(self.periods, end)
+        if customer is None:
+            return [(p, c, v) for p in self.periods[lo:hi] for c, v in self.cells[p].items()]
+        return [(p, customer, self.cells[p][customer]) for p in self.periods[lo:hi] if customer in self.cells[p]]
+
+
+class Rollups:
+    def __init__(self, table):
+        self._lock = threading.Lock()
+        self._days = _Grid()
+        self._months = _Grid()
+        self._totals = _Grid()
+        self.table = table
+        table.subscribe(self._on_change)
+
+    # --- CẬP NHẬT THEO CACHE ---
+    def _on_change(self, event, rows):
+        with self._lock:
+            if event == "reset":
+                self._days, self._months, self._totals = _Grid(), _Grid(), _Grid()
+            sign = -1.0 if event == "removed" else 1.0
+            totals = {}
+            for (day, customer), values in self._group(rows).items():
+                self._days.add(day, customer, sign * values)
+                self._months.add(day.replace(day=1), customer, sign * values)
+                totals[day] = totals[day] + values if day in totals else values
+            for day, values in totals.items():
+                self._totals.add(day, ALL, sign * values)
+
+    @staticmethod
+    def _group(rows):
+        """Dòng phiếu -> {(ngày, khách hàng): vector MEASURES}; bỏ các dòng không có ngày."""
+        if not len(rows):
+            return {}
+        days = rows["Ngày"].dt.normalize()
+        keep = days.notna().to_numpy()
+        if not keep.all():
+            rows, days = rows[keep], days[keep]
+        if len(rows) == 1:
+            # Trường hợp thường gặp (lưu / sửa / xóa một phiếu): khỏi groupby
+            values = np.concatenate(([1.0], rows[_SUMMED].to_numpy(dtype=np.float64)[0]))
+            return {(days.iloc[0].date(), str(rows["Khách hàng"].iloc[0])): values}
+        values = rows[_SUMMED].astype(np.float64)
+        values.insert(0, COUNT_COLUMN, 1.0)
+        sums = values.groupby([days.dt.date.to_numpy(), rows["Khách hàng"].astype(str).to_numpy()], sort=False).sum()
+        block = sums.to_numpy()
+        return dict(zip(sums.index, block))
+
+    # --- TRUY VẤN ---
+    def daily(self, start, end):
+        """Các ô ngày × khách hàng trong [start, end], sắp theo ngày."""
+        # Cho cache kịp đồng bộ (hết ttl / tải các phân vùng còn thiếu) trước khi đọc các ô
+        self.table.sync(start, end)
+        with self._lock:
+            return self._frame("Ngày", self._days.between(_as_date(start), _as_date(end)))
+
+    def monthly(self, start, end):
+        """Các ô tháng × khách hàng của những tháng chạm vào [start, end]."""
+        start = _as_date(start).replace(day=1)
+        self.table.sync(start, (pd.Timestamp(end) + pd.offsets.MonthEnd(0)).date())
+        with self._lock:
+            return self._frame("Tháng", self._months.between(start, _as_date(end)))
+
+    def series(self, start, end, customer=None):
+        """Chuỗi theo ngày trong [start, end] (chỉ các ngày có phiếu): cộng mọi khách, hoặc riêng `customer`."""
+        self.table.sync(start, end)
+        with self._lock:
+            if customer is None:
+                cells = self._totals.between(_as_date(start), _as_date(end))
+            else:
+                cells = self._days.between(_as_date(start), _as_date(end), str(customer))
+            return self._frame("Ngày", cells).drop(columns="Khách hàng")
+
+    def by_customer(self, start, end):
+        """Cộng dồn theo khách hàng trong [start, end], nhiều kg nhất lên đầu."""
+        daily = self.daily(start, end)
+        return (daily.drop(columns="Ngày").groupby("Khách hàng", sort=False).sum()
+                .sort_values("Tổng Kg", ascending=False).reset_index())
+
+    def totals(self, start, end):
+        """Một Series MEASURES: tổng của cả khoảng [start, end]."""
+        return self.daily(start, end)[MEASURES].sum()
+
+    @staticmethod
+    def _frame(period_column, cells):
+        block = np.array([v for _, _, v in cells]).reshape(len(cells), len(MEASURES))
+        frame = pd.DataFrame(block, columns=MEASURES)
+        frame.insert(0, period_column, pd.to_datetime([p for p, _, _ in cells]))
+        frame.insert(1, "Khách hàng", [c for _, c, _ in cells])
+        counts = [COUNT_COLUMN] + ITEMS
+        frame[counts] = frame[counts].round().astype("int64")
+        frame["Tổng Kg"] = frame["Tổng Kg"].round(2)
+        return frame
+
+
+def _as_date(value):
+    return pd.Timestamp(value).date()
@@ -0,0 +1,151 @@
+"""Tìm phiếu theo tiền tố: số phiếu, tên khách hàng (từng chữ hoặc cả tên), ngày.
+
+Chỉ mục gồm từ khóa -> tập số phiếu và danh sách từ khóa luôn sắp sẵn;
+tìm một tiền tố là hai lần tìm nhị phân. Từ khóa được bỏ dấu và viết
+thường nên gõ "hai au" vẫn ra "Hải Âu". Chỉ mục cập nhật theo từng thay
+đổi của TableCache phiếu, giống Rollups / CustomerPartitions.
+"""
+import bisect
+import functools
+import heapq
+import threading
+import unicodedata
+
+import pandas as pd
+
+# Ký tự lớn hơn mọi ký tự thường gặp: mọi từ khóa bắt đầu bằng p đều < p + _END
+_END = "\U0010ffff"
+
+
+def fold(text):
+    """Viết thường, bỏ dấu tiếng Việt (đ -> d)."""
+    text = unicodedata.normalize("NFD", str(text).lower().replace("đ", "d"))
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+@functools.lru_cache(maxsize=4096)
+def _name_terms(name):
+    # Tên khách lặp lại rất nhiều lần -> chỉ bỏ dấu một lần mỗi tên
+    folded = fold(name)
+    return frozenset([folded, *folded.split()])
+
+
+@functools.lru_cache(maxsize=8192)
+def _day_terms(day):
+    return (day.strftime("%Y-%m-%d"), day.strftime("%d/%m/%Y"))
+
+
+def _terms(key, day, customer):
+    terms = {key.lower() if key.isascii() else fold(key), *_name_terms(customer)}
+    if day is not None:
+        terms.update(_day_terms(day))
+    terms.discard("")
+    return terms
+
+
+def _newest_first(match):
+    day, key, _ = match
+    return (-1 if day is None else day.value, key)
+
+
+class InvoiceSearch:
+    def __init__(self, table):
+        self.table = table
+        # Từ khóa -> tập số phiếu, và danh sách các từ khóa giữ sắp sẵn để tìm tiền tố
+        self._postings = {}
+        self._terms = []
+        # Số phiếu -> list (ngày, khách hàng); một số phiếu có thể bị nhập trùng
+        self._entries = {}
+        self._lock = threading.Lock()
+        table.subscribe(self._on_change)
+
+    # --- CẬP NHẬT THEO CACHE ---
+    def _on_change(self, event, rows):
+        keys = rows[self.table.key_column].astype(str).tolist()
+        days = [None if pd.isna(d) else d for d in rows["Ngày"]]
+        customers = rows["Khách hàng"].astype(str).tolist()
+        with self._lock:
+            if event == "reset":
+                self._postings, self._entries = {}, {}
+                for key, day, customer in zip(keys, days, customers):
+                    self._entries.setdefault(key, []).append((day, customer))
+                    for term in _terms(key, day, customer):
+                        self._postings.setdefault(term, set()).add(key)
+                self._terms = sorted(self._postings)
+                return
+            for key, day, customer in zip(keys, days, customers):
+                if event == "added":
+                    self._entries.setdefault(key, []).append((day, customer))
+                    for term in _terms(key, day, customer):
+                        if term not in self._postings:
+                            self._postings[term] = set()
+                            bisect.insort(self._terms, term)
+                        self._postings[term].add(key)
+                    continue
+                entries = self._entries.get(key, [])
+                if (day, customer) not in entries:
+                    continue
+                entries.remove((day, customer))
+                if entries:
+                    continue  # còn phiếu trùng số: giữ nguyên các từ khóa
+                del self._entries[key]
+                for term in _terms(key, day, customer):
+                    posting = self._postings.get(term)
+                    if posting is None:
+                        continue
+                    posting.discard(key)
+                    if not posting:
+                        del self._postings[term]
+                        del self._terms[bisect.bisect_left(self._terms, term)]
+
+    def _prefix(self, prefix):
+        lo = bisect.bisect_left(self._terms, prefix)
+        hi = bisect.bisect_left(self._terms, prefix + _END)
+        keys = set()
+        for term in self._terms[lo:hi]:
+            keys |= self._postings[term]
+        return keys
+
+    # --- TRUY VẤN ---
+    def search(self, query, page=1, per_page=20):
+        """Các phiếu khớp mọi chữ trong query (theo tiền tố), mới nhất trước.
+
+        Trả về (list dict {"key", "day", "customer"} của trang `page`, tổng số phiếu khớp).
+        Query rỗng thì trả về các phiếu mới nhất.
+        """
+        words = fold(query).split()
+        if not words:
+            return self._latest(page, per_page)
+        self.table.sync()
+        with self._lock:
+            keys = self._prefix(words[0])
+            for word in words[1:]:
+                keys &= self._prefix(word)
+            matches = [(day, key, customer) for key in keys for day, customer in self._entries.get(key, [])]
+        top = heapq.nlargest(page * per_page, matches, key=_newest_first)
+        return [{"key": key, "day": day, "customer": customer}
+                for day, key, customer in top[(page - 1) * per_page:]], len(matches)
+
+    def _latest(self, page, per_page):
+        # Bảng đã sắp theo ngày: các phiếu mới nhất nằm ở đuôi, chỉ lấy đủ đuôi cho tới trang này
+        tail, total = self.table.latest(page * per_page)
+        end = max(len(tail) - (page - 1) * per_page, 0)
+        part = tail.iloc[max(end - per_page, 0):end].iloc[::-1]
+        days = [None if pd.isna(d) else d for d in part["Ngày"]]
+        return [{"key": key, "day": day, "customer": customer} for key, day, customer in
+                zip(part[self.table.key_column].astype(str), days, part["Khách hàng"].astype(str))], total
+
+    def days_of(self, key):
+        """Các ngày có phiếu mang số `key` (thường chỉ một; rỗng nếu không có)."""
+        self.table.sync()
+        with self._lock:
+            return [day for day, _ in self._entries.get(str(key), [])]
+
+    def row(self, key, day):
+        """Mở đúng một phiếu theo số phiếu: chỉ quét các phiếu trong ngày đó (bảng đã sắp theo ngày)."""
+        if day is None:
+            frame = self.table.frame_ref()
+        else:
+            frame = self.table.between(day, day)
+        match = frame[frame[self.table.key_column].astype(str) == str(key)]
+        return match.iloc[0] if len(match) else None
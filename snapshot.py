@@ -0,0 +1,139 @@
+"""Ảnh chụp (snapshot) bảng dùng chung giữa các tiến trình trên cùng máy.
+
+Mỗi trang tính có ba file trong thư mục snapshot:
+    <tên>.arrow   DataFrame đã có kiểu, định dạng Arrow IPC (đọc bằng mmap)
+    <tên>.json    stamp (số phiên bản), mốc đồng bộ, thời điểm kiểm tra gần nhất
+    <tên>.signal  file rỗng; tiến trình nào vừa ghi lên Sheet thì "chạm" vào
+                  (đổi mtime) để các tiến trình khác đồng bộ ngay, kể cả
+                  trang có ttl dài (tháng cũ); lần đồng bộ đó so cả cột
+                  phiên bản nên thấy được dòng bị sửa ở bất kỳ vị trí nào
+Khóa <tên>.lock (flock) bảo đảm mỗi lúc chỉ một tiến trình đọc Google Sheets
+để làm mới; các tiến trình khác chờ rồi đọc lại snapshot vừa ghi.
+
+File snapshot chỉ chủ tiến trình đọc / ghi được (0600, thư mục 0700).
+
+Hệ điều hành không có fcntl (Windows) thì không khóa được: mỗi tiến trình
+tự làm mới như trước, snapshot chỉ còn giúp khởi động nhanh.
+"""
+import contextlib
+import json
+import os
+import time
+import urllib.parse
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class SnapshotStore:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def _path(self, name, ext):
+        return os.path.join(self.directory, urllib.parse.quote(name, safe="") + ext)
+
+    def _write(self, path, write):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        # Tạo trước với quyền 0600; ghi sau đó (mở "wb" / "w") giữ nguyên quyền của file
+        os.close(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600))
+        write(tmp)
+        os.replace(tmp, path)
+
+    def remove(self, name):
+        """Xóa snapshot của một trang (nếu có)."""
+        for ext in (".arrow", ".json"):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self._path(name, ext))
+
+    # --- ĐỌC ---
+    def meta(self, name):
+        """Thông tin của snapshot (dict), hoặc None nếu chưa có."""
+        try:
+            with open(self._path(name, ".json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def load(self, name):
+        """(DataFrame, meta) đọc qua mmap, hoặc None nếu chưa có / file không khớp stamp."""
+        meta = self.meta(name)
+        if meta is None:
+            return None
+        try:
+            with pa.memory_map(self._path(name, ".arrow")) as source:
+                table = ipc.open_file(source).read_all()
+        except (OSError, pa.ArrowInvalid):
+            return None
+        stamp = (table.schema.metadata or {}).get(b"stamp")
+        if stamp is None or int(stamp) != meta["stamp"]:
+            return None  # đang bị ghi đè dở, lần sau đọc lại
+        return table.to_pandas(), meta
+
+    # --- GHI ---
+    def save(self, name, frame, synced_rows, tail, full_at, checked_at):
+        """Ghi DataFrame mới (stamp tăng 1); file Arrow được thay trước rồi mới tới meta.
+
+        full_at / checked_at: thời điểm (time.time()) đối soát toàn bộ / đối chiếu gần nhất với Sheet.
+        """
+        meta = self.meta(name) or {"stamp": 0}
+        stamp = meta["stamp"] + 1
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"stamp": str(stamp).encode()})
+
+        def write_arrow(path):
+            with pa.OSFile(path, "wb") as sink, ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+        self._write(self._path(name, ".arrow"), write_arrow)
+        meta = {"stamp": stamp, "synced_rows": synced_rows, "tail": tail, "full_at": full_at, "checked_at": checked_at}
+        self._write_meta(name, meta)
+        return meta
+
+    def checked(self, name, meta, checked_at):
+        """Báo đã đối chiếu với Sheet mà dữ liệu không đổi (chỉ cập nhật thời điểm kiểm tra)."""
+        meta = dict(meta, checked_at=checked_at)
+        self._write_meta(name, meta)
+        return meta
+
+    def _write_meta(self, name, meta):
+        def write_json(path):
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False, default=str)
+
+        self._write(self._path(name, ".json"), write_json)
+
+    # --- TÍN HIỆU & KHÓA ---
+    def signal(self, name):
+        path = self._path(name, ".signal")
+        now = time.time()
+        with open(path, "a"):
+            os.utime(path, (now, now))
+
+    def signalled_at(self, name):
+        try:
+            return os.stat(self._path(name, ".signal")).st_mtime
+        except OSError:
+            return 0.0
+
+    @contextlib.contextmanager
+    def lock(self, name, blocking=True):
+        """Khóa làm mới giữa các tiến trình; yield True nếu giữ được khóa."""
+        if fcntl is None:
+            yield True
+            return
+        with open(self._path(name, ".lock"), "a") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,640 @@
+"""Tầng lưu trữ dữ liệu: Google Sheets (gspread) hoặc SQLite cục bộ.
+
+Mọi hàm dữ liệu trong app.py đi qua một "backend" có chung các hàm:
+read_rows / append_row(s) / update_row(s) / delete_row(s). Khóa của mỗi bảng
+là cột đầu tiên mang tính định danh (Username cho Users, Số phiếu cho Sheet1).
+
+Phiếu được chia theo tháng: mỗi tháng một trang tính "Phiếu YYYY-MM" (tạo
+tự động khi ghi lần đầu), danh sách nằm ở trang Catalog; xem partitioned.py.
+
+prefetch(names) đọc sẵn nhiều trang tính bằng một lệnh (Sheets: values_batch_get)
+để các read_rows ngay sau đó không phải gọi API riêng.
+
+read_rows trả về dòng thô theo đúng thứ tự COLUMNS (Sheets: chuỗi như hiển
+thị; SQLite: giá trị đã lưu); việc ép kiểu nằm ở schema.py.
+
+Mỗi phiếu mang một phiên bản ở cột "Cập nhật" (thời điểm ghi gần nhất).
+update_rows / delete_rows nhận thêm `expected`: phiên bản người sửa đã đọc;
+dòng trên kho đã mang phiên bản khác thì không ghi mà trả về CONFLICT.
+"""
+import argparse
+import datetime
+import sqlite3
+import threading
+import time
+
+import gspread
+
+SHEET_NAME = "QuanLyGiatUi_HaiAu"
+
+# --- DANH SÁCH MẶT HÀNG ---
+ITEMS = [
+    "Áo gối", "Áo choàng", "Bọc lớn", "Bọc nhỏ", "Bảo vệ nệm",
+    "Bọc mền", "Drap lớn", "Drap nhỏ", "Drap thun", "Khăn hồ bơi",
+    "Khăn tắm lớn trắng", "Khăn tay", "Khăn mặt", "Khăn Welcome",
+    "Khăn bàn", "Mền", "Thảm chân", "Tấm trang trí", "Rèm cửa",
+    "Mùng", "Gối ghế"
+]
+
+# --- CẤU TRÚC CÁC TRANG TÍNH ---
+USERS_SHEET = "Users"
+INVOICES_SHEET = "Sheet1"
+
+USER_COLUMNS = ["Username", "Password", "Role", "FullName", "Address"]
+# Cột phiên bản luôn nằm cuối: trang tính cũ chỉ cần thêm một cột
+REVISION_COLUMN = "Cập nhật"
+INVOICE_COLUMNS = ["Ngày", "Số phiếu", "Khách hàng", "Địa chỉ", "Ghi chú", "Tổng Kg"] + ITEMS + [REVISION_COLUMN]
+
+# Phiếu mới được ghi vào trang tính theo tháng ("Phiếu 2024-03"); INVOICES_SHEET
+# giữ lại lịch sử cũ. Catalog ghi danh sách các trang tính phiếu và khoảng ngày.
+PARTITION_PREFIX = "Phiếu "
+CATALOG_SHEET = "Catalog"
+CATALOG_COLUMNS = ["Trang tính", "Từ ngày", "Đến ngày"]
+
+# Bảng giá: mỗi khách một dòng ghi đè giá riêng, dòng DEFAULT_PRICE là giá chung.
+# Ô để trống = dùng giá của dòng chung. Cột mặt hàng là đơn giá một cái (đồng).
+PRICES_SHEET = "Bảng giá"
+KG_PRICE = "Giá/Kg"
+PRICE_COLUMNS = ["Khách hàng", KG_PRICE] + ITEMS
+DEFAULT_PRICE = "(Giá chung)"
+
+
+def partition_name(day):
+    """Tên trang tính phiếu của tháng chứa `day`."""
+    return f"{PARTITION_PREFIX}{day:%Y-%m}"
+
+
+def is_partition(name):
+    return str(name).startswith(PARTITION_PREFIX)
+
+
+class SheetMap(dict):
+    """dict theo tên trang tính; các trang phiếu theo tháng dùng chung mục của INVOICES_SHEET."""
+
+    def __missing__(self, name):
+        if is_partition(name):
+            return self[INVOICES_SHEET]
+        raise KeyError(name)
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+
+COLUMNS = SheetMap({USERS_SHEET: USER_COLUMNS, INVOICES_SHEET: INVOICE_COLUMNS, CATALOG_SHEET: CATALOG_COLUMNS,
+                    PRICES_SHEET: PRICE_COLUMNS})
+KEY_COLUMNS = SheetMap({USERS_SHEET: "Username", INVOICES_SHEET: "Số phiếu", CATALOG_SHEET: "Trang tính",
+                        PRICES_SHEET: "Khách hàng"})
+# Trang có mật khẩu: không bao giờ ghi ra ảnh chụp trên đĩa (SnapshotStore)
+PRIVATE_SHEETS = {USERS_SHEET}
+# Bảng có phiên bản dòng (ghi có điều kiện); bảng khác ghi đè như cũ
+REVISION_COLUMNS = SheetMap({INVOICES_SHEET: REVISION_COLUMN})
+
+# Kết quả của update_rows / delete_rows khi phiên bản không khớp (bên cạnh True / False)
+CONFLICT = "conflict"
+
+
+class StorageError(Exception):
+    """Lỗi truy cập kho dữ liệu (không tìm thấy trang tính, mất kết nối...)."""
+
+
+class RevisionConflict(StorageError):
+    """Dòng đã bị sửa / xóa ở nơi khác sau khi người dùng mở ra."""
+
+    def __init__(self, key):
+        super().__init__(f"Phiếu {key} vừa được sửa ở nơi khác sau khi bạn mở ra, chưa ghi thay đổi.")
+        self.key = key
+
+
+def new_revision():
+    """Phiên bản mới cho một dòng: thời điểm ghi, tới micro giây."""
+    return datetime.datetime.now().isoformat(sep=" ", timespec="microseconds")
+
+
+def _expected_list(items, expected):
+    # expected=None -> mọi dòng ghi không điều kiện
+    return [None] * len(items) if expected is None else list(expected)
+
+
+def plain_value(value):
+    # Giá trị numpy (từ DataFrame/data_editor) -> kiểu Python để ghi được
+    return value.item() if hasattr(value, "item") else value
+
+
+# --- CHỈ MỤC KHÓA -> SỐ DÒNG ---
+class RowIndex:
+    """Khóa -> số dòng trên Sheet (dòng 1 là tiêu đề, dữ liệu bắt đầu từ dòng 2).
+
+    Khóa trùng nhau thì trỏ tới dòng đầu tiên, giống sheet.find() trước đây.
+    """
+
+    def __init__(self, keys=()):
+        self.rebuild(keys)
+
+    def rebuild(self, keys):
+        self._keys = [str(k) for k in keys]
+        self._rows = {}
+        for pos, key in enumerate(self._keys):
+            self._rows.setdefault(key, pos + 2)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def row_of(self, key):
+        return self._rows.get(str(key))
+
+    def key_at(self, row):
+        pos = row - 2
+        return self._keys[pos] if 0 <= pos < len(self._keys) else None
+
+    def appended(self, key):
+        key = str(key)
+        self._keys.append(key)
+        self._rows.setdefault(key, len(self._keys) + 1)
+
+    def replaced(self, row, new_key):
+        old_key, new_key = self._keys[row - 2], str(new_key)
+        self._keys[row - 2] = new_key
+        if old_key != new_key:
+            if self._rows.get(old_key) == row:
+                self._rows.pop(old_key)
+                self._relink(old_key, row - 1)
+            if self._rows.get(new_key, row + 1) > row:
+                self._rows[new_key] = row
+
+    def deleted(self, row):
+        pos = row - 2
+        key = self._keys.pop(pos)
+        # Các dòng phía dưới bị dồn lên một dòng
+        for other in set(self._keys[pos:]):
+            if self._rows.get(other, 0) > row:
+                self._rows[other] -= 1
+        if self._rows.get(key) == row:
+            self._rows.pop(key)
+            self._relink(key, pos)
+
+    def _relink(self, key, start):
+        # Khóa trùng: trỏ sang lần xuất hiện kế tiếp (nếu còn)
+        for pos in range(start, len(self._keys)):
+            if self._keys[pos] == key:
+                self._rows[key] = pos + 2
+                return
+
+
+# --- BACKEND GOOGLE SHEETS ---
+# Kết quả prefetch chỉ dùng cho read_rows ngay sau đó; quá hạn thì đọc lại
+PREFETCH_TTL = 30
+
+
+class GSheetsBackend:
+    def __init__(self, client, sheet_name=SHEET_NAME):
+        self.client = client
+        self.sheet_name = sheet_name
+        self._indexes = {}
+        # Mở file một lần và giữ danh sách trang tính (mỗi lần client.open là một lệnh tra Drive + metadata)
+        self._spreadsheet = None
+        self._worksheets = None
+        # Tên trang tính -> (giá trị đọc sẵn bằng prefetch, lúc đọc)
+        self._prefetched = {}
+        self._lock = threading.RLock()
+
+    def _handles(self, refresh=False):
+        with self._lock:
+            if self._spreadsheet is None:
+                self._spreadsheet = self.client.open(self.sheet_name)
+            if self._worksheets is None or refresh:
+                self._worksheets = {sheet.title: sheet for sheet in self._spreadsheet.worksheets()}
+            return self._spreadsheet, self._worksheets
+
+    def forget_worksheets(self):
+        """Bỏ danh sách trang tính đang giữ (trang bị đổi tên / xóa từ nơi khác)."""
+        with self._lock:
+            self._worksheets = None
+
+    def worksheet(self, name):
+        spreadsheet, sheets = self._handles()
+        if name not in sheets:
+            # Có thể máy khác vừa tạo trang này
+            spreadsheet, sheets = self._handles(refresh=True)
+        if name in sheets:
+            sheet = sheets[name]
+            if sheet.col_count < len(COLUMNS.get(name, ())):
+                self._add_columns(name, sheet)
+            return sheet
+        if not (is_partition(name) or name in (CATALOG_SHEET, PRICES_SHEET)):
+            raise StorageError(f"Không tìm thấy trang tính '{name}'.")
+        # Trang phiếu của tháng mới / Catalog / Bảng giá: tạo lần đầu, kèm dòng tiêu đề
+        try:
+            sheet = spreadsheet.add_worksheet(title=name, rows=1000, cols=len(COLUMNS[name]))
+        except gspread.exceptions.APIError:
+            # Máy khác vừa tạo trước
+            sheet = spreadsheet.worksheet(name)
+        else:
+            sheet.append_row(COLUMNS[name])
+        with self._lock:
+            sheets[name] = sheet
+        return sheet
+
+    def _add_columns(self, name, sheet, have=None):
+        """Trang tính tạo trước khi có cột mới (vd. Cập nhật): nới lưới và ghi thêm ô tiêu đề."""
+        columns = COLUMNS[name]
+        have = sheet.col_count if have is None else have
+        with self._lock:
+            if sheet.col_count < len(columns):
+                sheet.add_cols(len(columns) - sheet.col_count)
+            sheet.update([columns[have:]], gspread.utils.rowcol_to_a1(1, have + 1))
+
+    def prefetch(self, names):
+        """Đọc nhiều trang tính bằng một lệnh values_batch_get; read_rows ngay sau đó dùng lại kết quả.
+
+        Trang chưa tồn tại thì bỏ qua (read_rows sẽ tạo / báo lỗi như thường).
+        """
+        spreadsheet, sheets = self._handles()
+        names = [name for name in names if name in sheets]
+        if not names:
+            return
+        try:
+            response = spreadsheet.values_batch_get([gspread.utils.absolute_range_name(n) for n in names])
+        except gspread.exceptions.APIError:
+            self.forget_worksheets()
+            raise
+        now = time.monotonic()
+        with self._lock:
+            for name, value_range in zip(names, response.get("valueRanges", [])):
+                self._prefetched[name] = (value_range.get("values", []), now)
+
+    def _take_prefetched(self, name):
+        with self._lock:
+            values, at = self._prefetched.pop(name, (None, 0.0))
+        return values if time.monotonic() - at <= PREFETCH_TTL else None
+
+    def read_rows(self, name):
+        """Toàn bộ dữ liệu (get_all_values), sắp lại cột theo tiêu đề trên Sheet."""
+        columns = COLUMNS[name]
+        values = self._take_prefetched(name)
+        if values is None:
+            try:
+                values = self.worksheet(name).get_all_values()
+            except gspread.exceptions.APIError:
+                self.forget_worksheets()
+                raise
+        header, rows = (values[0], values[1:]) if values else ([], [])
+        named = list(header)
+        while named and not named[-1]:
+            named.pop()
+        if named and len(named) < len(columns) and named == columns[:len(named)]:
+            # Tiêu đề cũ thiếu các cột cuối: thêm tiêu đề, các ô trống coi như ""
+            self._add_columns(name, self.worksheet(name), have=len(named))
+            header = columns
+        if header[:len(columns)] == columns:
+            rows = [_pad(row[:len(columns)], len(columns)) for row in rows]
+        else:
+            pos = [header.index(c) if c in header else None for c in columns]
+            rows = [[row[p] if p is not None and p < len(row) else "" for p in pos] for row in rows]
+        key_pos = columns.index(KEY_COLUMNS[name])
+        with self._lock:
+            self._indexes[name] = RowIndex(row[key_pos] for row in rows)
+        return rows
+
+    def read_rows_from(self, name, start):
+        """Các dòng từ vị trí `start` (0 = dòng dữ liệu đầu tiên) tới cuối Sheet.
+
+        Chỉ tải đúng vùng A{start+2}:<cột cuối>, không tải lại lịch sử.
+        """
+        last_col = _column_letter(len(COLUMNS[name]))
+        return self._rows_from(name, start, self.worksheet(name).get_values(f"A{start + 2}:{last_col}"))
+
+    def read_tail(self, name, start, column):
+        """Như read_rows_from, kèm mọi ô của cột `column` (vd. Cập nhật) từ dòng đầu; một lệnh batch_get."""
+        columns = COLUMNS[name]
+        letter = _column_letter(columns.index(column) + 1)
+        tail, cells = self.worksheet(name).batch_get(
+            [f"A{start + 2}:{_column_letter(len(columns))}", f"{letter}2:{letter}"])
+        return self._rows_from(name, start, tail), [row[0] if row else "" for row in cells]
+
+    def _rows_from(self, name, start, values):
+        columns = COLUMNS[name]
+        rows = [_pad(row, len(columns)) for row in values]
+        key_pos = columns.index(KEY_COLUMNS[name])
+        with self._lock:
+            index = self._indexes.get(name)
+            if index is not None and rows and len(index) == start + 1 \
+                    and index.key_at(start + 2) == str(rows[0][key_pos]):
+                for row in rows[1:]:
+                    index.appended(row[key_pos])
+            else:
+                self._indexes.pop(name, None)
+        return rows
+
+    def record_from_row(self, name, row):
+        """Dòng (vừa ghi hoặc vừa đọc) -> dict đã chuẩn hóa số, để so sánh hai dòng."""
+        columns = COLUMNS[name]
+        values = [gspread.utils.numericise("" if v is None else str(plain_value(v))) for v in row]
+        values += [""] * (len(columns) - len(values))
+        return dict(zip(columns, values))
+
+    def _key_col(self, name):
+        return COLUMNS[name].index(KEY_COLUMNS[name]) + 1
+
+    def _locate_many(self, name, sheet, keys, revisions=False):
+        """Chỉ mục đã kiểm tra: đọc lại ô khóa của các dòng sắp ghi (một lệnh batch_get).
+
+        Lệch chỉ mục (dòng bị thêm/xóa từ nơi khác) thì dựng lại chỉ mục từ
+        riêng cột khóa. revisions=True: đọc luôn ô phiên bản của các dòng đó;
+        trả về (chỉ mục, dict khóa -> phiên bản hiện tại trên Sheet).
+        """
+        col = self._key_col(name)
+        letter = _column_letter(col)
+        revision_letter = _column_letter(COLUMNS[name].index(REVISION_COLUMNS[name]) + 1) if revisions else None
+        index = self._indexes.get(name)
+        if index is not None:
+            rows = [index.row_of(k) for k in keys]
+            if all(r is not None for r in rows):
+                ranges = [f"{letter}{r}" for r in rows]
+                if revisions:
+                    ranges += [f"{revision_letter}{r}" for r in rows]
+                cells = sheet.batch_get(ranges)
+                if all(_first_value(c) == str(k) for c, k in zip(cells, keys)):
+                    found = {str(k): _first_value(c) or "" for c, k in zip(cells[len(keys):], keys)}
+                    return index, found
+        index = self._indexes[name] = RowIndex(sheet.col_values(col)[1:])
+        found = {}
+        rows = {str(k): index.row_of(k) for k in keys if index.row_of(k) is not None}
+        if revisions and rows:
+            cells = sheet.batch_get([f"{revision_letter}{r}" for r in rows.values()])
+            found = {k: _first_value(c) or "" for k, c in zip(rows, cells)}
+        return index, found
+
+    def append_rows(self, name, rows):
+        rows = [[plain_value(v) for v in row] for row in rows]
+        with self._lock:
+            self.worksheet(name).append_rows(rows)
+            index = self._indexes.get(name)
+            if index is not None:
+                for row in rows:
+                    index.appended(row[self._key_col(name) - 1])
+
+    def update_rows(self, name, items, expected=None):
+        """Ghi đè nhiều dòng [(khóa, dòng mới), ...] bằng một lệnh batch_update.
+
+        expected: phiên bản mong đợi của từng dòng (None = không kiểm tra). Ô phiên
+        bản được đọc cùng lệnh kiểm tra chỉ mục, ngay trước khi ghi; giữa hai lệnh
+        đó máy khác vẫn có thể chen vào (Sheets không có ghi có điều kiện thật).
+        """
+        expected = _expected_list(items, expected)
+        with self._lock:
+            sheet = self.worksheet(name)
+            index, current = self._locate_many(name, sheet, [key for key, _ in items],
+                                               revisions=any(e is not None for e in expected))
+            data, results = [], []
+            try:
+                for (key, row), want in zip(items, expected):
+                    target = index.row_of(key)
+                    if target is None:
+                        results.append(False)
+                        continue
+                    if want is not None and current.get(str(key)) != str(want):
+                        results.append(CONFLICT)
+                        continue
+                    row = [plain_value(v) for v in row]
+                    data.append({"range": f"A{target}", "values": [row]})
+                    index.replaced(target, row[self._key_col(name) - 1])
+                    if str(key) in current:
+                        # Cùng lô có thể sửa tiếp dòng này, mong đợi đúng phiên bản vừa ghi
+                        current[str(key)] = str(dict(zip(COLUMNS[name], row)).get(REVISION_COLUMNS[name], ""))
+                    results.append(True)
+                if data:
+                    sheet.batch_update(data)
+            except Exception:
+                self._indexes.pop(name, None)
+                raise
+            return results
+
+    def delete_rows(self, name, keys, expected=None):
+        expected = _expected_list(keys, expected)
+        with self._lock:
+            sheet = self.worksheet(name)
+            index, current = self._locate_many(name, sheet, keys, revisions=any(e is not None for e in expected))
+            results = []
+            try:
+                for key, want in zip(keys, expected):
+                    target = index.row_of(key)
+                    if target is not None and want is not None and current.get(str(key)) != str(want):
+                        results.append(CONFLICT)
+                        continue
+                    if target is not None:
+                        sheet.delete_rows(target)
+                        index.deleted(target)
+                    results.append(target is not None)
+            except Exception:
+                self._indexes.pop(name, None)
+                raise
+            return results
+
+    def append_row(self, name, row):
+        self.append_rows(name, [row])
+
+    def update_row(self, name, key, row):
+        return self.update_rows(name, [(key, row)])[0]
+
+    def delete_row(self, name, key):
+        return self.delete_rows(name, [key])[0]
+
+
+def _pad(row, width):
+    return list(row) + [""] * (width - len(row))
+
+
+def _column_letter(col):
+    return gspread.utils.rowcol_to_a1(1, col)[:-1]
+
+
+def _first_value(value_range):
+    return str(value_range[0][0]) if value_range and value_range[0] else None
+
+
+# --- BACKEND SQLITE (CHẠY OFFLINE / KIỂM THỬ) ---
+def _sql_type(column):
+    if column in ("Tổng Kg", KG_PRICE):
+        return "REAL"
+    if column in ITEMS:
+        return "INTEGER"
+    return "TEXT"
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+class SQLiteBackend:
+    """Mỗi trang tính là một bảng; thứ tự dòng theo rowid giống thứ tự trên Sheet."""
+
+    INDEXES = {
+        USERS_SHEET: ["Username"],
+        INVOICES_SHEET: ["Số phiếu", "Ngày", "Khách hàng"],
+    }
+
+    def __init__(self, path="giatui.db"):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        # Bảng phiếu theo tháng đã tạo (tạo dần khi ghi / đọc lần đầu)
+        self._partitions = set()
+        self._create_tables()
+
+    def _create_tables(self):
+        with self._lock, self._conn:
+            for name, columns in COLUMNS.items():
+                self._create_table(name, columns, self.INDEXES.get(name, []))
+
+    def _create_table(self, name, columns, indexes):
+        cols = ", ".join(f"{_quote(c)} {_sql_type(c)}" for c in columns)
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS {_quote(name)} ({cols})")
+        # CSDL tạo trước khi có cột mới (vd. Cập nhật): thêm cột, dòng cũ để trống
+        existing = {row[1] for row in self._conn.execute(f"PRAGMA table_info({_quote(name)})")}
+        for col in columns:
+            if col not in existing:
+                self._conn.execute(f"ALTER TABLE {_quote(name)} ADD COLUMN {_quote(col)} {_sql_type(col)}")
+        for col in indexes:
+            idx = _quote(f"idx_{name}_{col}")
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS {idx} ON {_quote(name)} ({_quote(col)})")
+
+    def _table(self, name):
+        columns = COLUMNS.get(name)
+        if columns is None:
+            raise StorageError(f"Không tìm thấy trang tính '{name}'.")
+        if is_partition(name) and name not in self._partitions:
+            with self._lock, self._conn:
+                self._create_table(name, columns, self.INDEXES[INVOICES_SHEET])
+            self._partitions.add(name)
+        return _quote(name), columns
+
+    def prefetch(self, names):
+        """Không cần với SQLite: mỗi lần đọc đã là một truy vấn cục bộ."""
+
+    def read_rows(self, name):
+        return self.read_rows_from(name, 0)
+
+    def read_rows_from(self, name, start):
+        table, columns = self._table(name)
+        cols = ", ".join(_quote(c) for c in columns)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {cols} FROM {table} ORDER BY rowid LIMIT -1 OFFSET ?", (start,)
+            ).fetchall()
+        return [list(row) for row in rows]
+
+    def read_tail(self, name, start, column):
+        table, _ = self._table(name)
+        with self._lock:
+            cells = self._conn.execute(f"SELECT {_quote(column)} FROM {table} ORDER BY rowid").fetchall()
+        return self.read_rows_from(name, start), ["" if row[0] is None else row[0] for row in cells]
+
+    def record_from_row(self, name, row):
+        """Dòng (vừa ghi hoặc vừa đọc) -> dict theo kiểu cột SQLite, để so sánh hai dòng."""
+        _, columns = self._table(name)
+        record = {}
+        for col, value in zip(columns, list(row) + [None] * (len(columns) - len(row))):
+            value = plain_value(value)
+            if value is None or value == "":
+                record[col] = value
+            elif _sql_type(col) == "REAL":
+                record[col] = float(value)
+            elif _sql_type(col) == "INTEGER":
+                record[col] = int(value)
+            else:
+                record[col] = str(value)
+        return record
+
+    def _values(self, columns, row):
+        return [plain_value(v) for v in row][:len(columns)]
+
+    def append_rows(self, name, rows):
+        table, columns = self._table(name)
+        with self._lock, self._conn:
+            for row in rows:
+                values = self._values(columns, row)
+                cols = ", ".join(_quote(c) for c in columns[:len(values)])
+                marks = ", ".join("?" * len(values))
+                self._conn.execute(f"INSERT INTO {table} ({cols}) VALUES ({marks})", values)
+
+    def _first_rowid(self, name, key, want=None):
+        """rowid của dòng đầu tiên có khóa = key, None nếu không có, CONFLICT nếu phiên bản khác `want`."""
+        table, _ = self._table(name)
+        key_col = _quote(KEY_COLUMNS[name])
+        revision = f"COALESCE({_quote(REVISION_COLUMNS[name])}, '')" if want is not None else "''"
+        found = self._conn.execute(
+            f"SELECT rowid, {revision} FROM {table} WHERE CAST({key_col} AS TEXT) = ? ORDER BY rowid LIMIT 1",
+            (str(key),),
+        ).fetchone()
+        if found is None:
+            return None
+        return CONFLICT if want is not None and found[1] != str(want) else found[0]
+
+    def update_rows(self, name, items, expected=None):
+        """Như GSheetsBackend.update_rows; kiểm tra phiên bản và ghi trong cùng một giao dịch."""
+        table, columns = self._table(name)
+        results = []
+        with self._lock, self._conn:
+            for (key, row), want in zip(items, _expected_list(items, expected)):
+                rowid = self._first_rowid(name, key, want)
+                if rowid is CONFLICT:
+                    results.append(CONFLICT)
+                    continue
+                if rowid is not None:
+                    values = self._values(columns, row)
+                    sets = ", ".join(f"{_quote(c)} = ?" for c in columns[:len(values)])
+                    self._conn.execute(f"UPDATE {table} SET {sets} WHERE rowid = ?", values + [rowid])
+                results.append(rowid is not None)
+        return results
+
+    def delete_rows(self, name, keys, expected=None):
+        table, _ = self._table(name)
+        results = []
+        with self._lock, self._conn:
+            for key, want in zip(keys, _expected_list(keys, expected)):
+                rowid = self._first_rowid(name, key, want)
+                if rowid is CONFLICT:
+                    results.append(CONFLICT)
+                    continue
+                if rowid is not None:
+                    self._conn.execute(f"DELETE FROM {table} WHERE rowid = ?", (rowid,))
+                results.append(rowid is not None)
+        return results
+
+    def append_row(self, name, row):
+        self.append_rows(name, [row])
+
+    def update_row(self, name, key, row):
+        return self.update_rows(name, [(key, row)])[0]
+
+    def delete_row(self, name, key):
+        return self.delete_rows(name, [key])[0]
+
+
+def is_transient_error(exc):
+    """Lỗi tạm thời, nên thử lại: hết hạn mức (429), lỗi máy chủ 5xx, mất mạng, CSDL đang khóa."""
+    if isinstance(exc, gspread.exceptions.APIError):
+        code = getattr(exc, "code", None) or getattr(getattr(exc, "response", None), "status_code", None)
+        return code == 429 or (code is not None and 500 <= int(code) < 600)
+    return isinstance(exc, (OSError, sqlite3.OperationalError))
+
+
+# --- KHỞI TẠO CSDL SQLITE TỪ DÒNG LỆNH ---
+# python storage.py giatui.db --admin admin:matkhau
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tạo CSDL SQLite cho chế độ chạy offline")
+    parser.add_argument("path", nargs="?", default="giatui.db")
+    parser.add_argument("--admin", help="Tạo tài khoản admin dạng username:password")
+    args = parser.parse_args()
+
+    db = SQLiteBackend(args.path)
+    if args.admin:
+        from auth import hash_password
+
+        username, _, password = args.admin.partition(":")
+        db.append_row(USERS_SHEET, [username, hash_password(password), "admin", username, ""])
+    print(f"Đã khởi tạo {args.path}")
@@ -0,0 +1,52 @@
+import pytest
+
+from api import InvoiceApi, Request
+from auth import hash_password
+from datastore import open_table
+from storage import INVOICE_COLUMNS, INVOICES_SHEET, ITEMS, REVISION_COLUMN, USERS_SHEET, SQLiteBackend
+from writequeue import WriteQueue
+
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "giatui.db"))
+    backend.append_row(USERS_SHEET, ["nv", hash_password("1"), "staff", "Nhân viên", ""])
+    backend.append_row(USERS_SHEET, ["kh", hash_password("2"), "customer", "Resort A", "Mũi Né"])
+    backend.append_row(INVOICES_SHEET, ["2026-09-01", "101", "Resort A", "Mũi Né", "", 12.3] + [1] * len(ITEMS))
+    return backend
+
+
+@pytest.fixture
+def api(backend):
+    queue = WriteQueue(backend)
+    return InvoiceApi(open_table(backend, USERS_SHEET, queue=queue), open_table(backend, INVOICES_SHEET, queue=queue))
+
+
+def _login(api):
+    token = api.login(Request("POST", {}, {}, {}, {"username": "nv", "password": "1"})).body["token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+def _stored(backend, key):
+    return next(row for row in backend.read_rows(INVOICES_SHEET) if str(row[1]) == key)
+
+
+def test_invoice_kg_is_not_altered(api):
+    headers = _login(api)
+    body = api.get_invoice(Request("GET", {"key": "101"}, {}, headers)).body
+    assert body["Tổng Kg"] == 12.3
+
+
+def test_patch_keeps_other_fields(api, backend):
+    headers = _login(api)
+    before = _stored(backend, "101")
+    etag = api.get_invoice(Request("GET", {"key": "101"}, {}, headers)).headers["ETag"]
+    response = api.update_invoice(Request("PATCH", {"key": "101"}, {}, dict(headers, **{"If-Match": etag}),
+                                          {"Ghi chú": "giao trễ"}))
+    assert response.status == 200
+    after = _stored(backend, "101")
+    changed = {INVOICE_COLUMNS.index("Ghi chú"), INVOICE_COLUMNS.index(REVISION_COLUMN)}
+    for pos, column in enumerate(INVOICE_COLUMNS):
+        if pos not in changed:
+            assert repr(after[pos]) == repr(before[pos]), column
+    assert after[INVOICE_COLUMNS.index("Ghi chú")] == "giao trễ"
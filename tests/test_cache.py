@@ -0,0 +1,94 @@
+import pytest
+
+from cache import TableCache
+from snapshot import SnapshotStore
+from storage import INVOICE_COLUMNS, INVOICES_SHEET, ITEMS, REVISION_COLUMN, SQLiteBackend
+
+
+class CountingBackend:
+    """SQLiteBackend, đếm số lần đọc cả trang / đọc phần đuôi."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.full_reads = 0
+        self.tail_reads = 0
+
+    def __getattr__(self, attr):
+        return getattr(self.backend, attr)
+
+    def read_rows(self, name):
+        self.full_reads += 1
+        return self.backend.read_rows(name)
+
+    def read_tail(self, name, start, column):
+        self.tail_reads += 1
+        return self.backend.read_tail(name, start, column)
+
+
+def _row(key, day="2026-09-01", kg=1.5):
+    return [day, key, "Resort A", "Mũi Né", "", kg] + [1] * len(ITEMS)
+
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "giatui.db"))
+    backend.append_rows(INVOICES_SHEET, [_row(str(100 + i), f"2026-09-{i + 1:02d}") for i in range(5)])
+    return backend
+
+
+def _kg(cache, key):
+    frame = cache.frame_ref()
+    return float(frame.loc[frame["Số phiếu"] == key, "Tổng Kg"].iloc[0])
+
+
+def test_sync_reads_only_new_rows(backend):
+    counting = CountingBackend(backend)
+    cache = TableCache(counting, INVOICES_SHEET, ttl=0)
+    cache.frame_ref()
+    backend.append_row(INVOICES_SHEET, _row("200", "2026-09-20"))
+    assert "200" in set(cache.frame_ref()["Số phiếu"])
+    assert (counting.full_reads, counting.tail_reads) == (1, 1)
+
+
+def test_sync_sees_edit_of_non_tail_row(backend):
+    counting = CountingBackend(backend)
+    cache = TableCache(counting, INVOICES_SHEET, ttl=0)
+    other = TableCache(backend, INVOICES_SHEET)
+    cache.frame_ref()
+    assert other.update("101", _row("101", "2026-09-02", kg=9.5)).ok
+    assert _kg(cache, "101") == 9.5
+    assert counting.full_reads == 2
+    # Không có gì đổi: lần đồng bộ sau chỉ đọc phần đuôi
+    cache.frame_ref()
+    assert counting.full_reads == 2
+
+
+def test_sync_sees_delete_of_non_tail_row(backend):
+    cache = TableCache(backend, INVOICES_SHEET, ttl=0)
+    other = TableCache(backend, INVOICES_SHEET)
+    cache.frame_ref()
+    assert other.delete("101").result
+    assert "101" not in set(cache.frame_ref()["Số phiếu"])
+    assert len(cache.frame_ref()) == 4
+
+
+def test_own_writes_do_not_force_reload(backend):
+    counting = CountingBackend(backend)
+    cache = TableCache(counting, INVOICES_SHEET, ttl=0)
+    cache.frame_ref()
+    revision = cache.frame_ref()[REVISION_COLUMN].iloc[1]
+    assert cache.update("101", _row("101", "2026-09-02", kg=7.0), expected=revision).ok
+    assert _kg(cache, "101") == 7.0
+    assert counting.full_reads == 1
+
+
+def test_write_signal_reaches_other_process(backend, tmp_path):
+    # ttl dài như phân vùng tháng cũ: chỉ tín hiệu ghi mới làm bảng đồng bộ sớm
+    directory = str(tmp_path / "snapshots")
+    cache = TableCache(backend, INVOICES_SHEET, ttl=6 * 3600, snapshots=SnapshotStore(directory))
+    other = TableCache(backend, INVOICES_SHEET, ttl=6 * 3600, snapshots=SnapshotStore(directory))
+    cache.frame_ref()
+    other.frame_ref()
+    assert other.update("101", _row("101", "2026-09-02", kg=9.5)).ok
+    assert _kg(cache, "101") == 9.5
+    assert list(cache.frame_ref().columns) == INVOICE_COLUMNS
@@ -0,0 +1,60 @@
+import gc
+import os
+import threading
+
+import pandas as pd
+from openpyxl import load_workbook
+
+from export import ExportCache, write_workbook
+
+
+def _build(frame):
+    return lambda path: write_workbook(path, [("Phiếu", frame)])
+
+
+def test_open_returns_cached_file():
+    cache = ExportCache()
+    frame = pd.DataFrame({"Số phiếu": ["101", "102"], "Tổng Kg": [12.3, 4.5]})
+    with cache.open(("a",), _build(frame)) as f:
+        rows = list(load_workbook(f).active.values)
+    assert rows == [("Số phiếu", "Tổng Kg"), ("101", 12.3), ("102", 4.5)]
+    # Cùng khóa: không dựng lại
+    with cache.open(("a",), None) as f:
+        assert f.read(2) == b"PK"
+
+
+def test_owned_directory_is_removed():
+    cache = ExportCache()
+    directory = cache.directory
+    cache.get(("a",), _build(pd.DataFrame({"x": [1]})))
+    assert os.listdir(directory)
+    del cache
+    gc.collect()
+    assert not os.path.exists(directory)
+
+
+def test_old_files_are_evicted(tmp_path):
+    cache = ExportCache(str(tmp_path), max_files=2)
+    for key in "abc":
+        cache.get((key,), _build(pd.DataFrame({"x": [1]})))
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_slow_build_does_not_block_other_keys(tmp_path):
+    cache = ExportCache(str(tmp_path))
+    started, release = threading.Event(), threading.Event()
+
+    def slow(path):
+        started.set()
+        release.wait(5)
+        write_workbook(path, [("x", pd.DataFrame({"x": [1]}))])
+
+    worker = threading.Thread(target=cache.get, args=(("slow",), slow))
+    worker.start()
+    started.wait(5)
+    try:
+        assert os.path.exists(cache.get(("fast",), _build(pd.DataFrame({"x": [2]}))))
+        assert worker.is_alive()
+    finally:
+        release.set()
+        worker.join()
@@ -0,0 +1,24 @@
+import pandas as pd
+
+from importer import QTY_MAX, map_columns, validate_invoices
+from storage import ITEMS
+
+
+def _validate(quantity):
+    frame, _ = map_columns(pd.DataFrame({
+        "Ngày": ["2026-09-01"], "Số phiếu": ["101"], "Khách hàng": ["Resort A"], "Tổng Kg": [12.3],
+        ITEMS[0]: [quantity],
+    }))
+    return validate_invoices(frame, {"Resort A": "Mũi Né"}, [])
+
+
+def test_largest_quantity_is_accepted():
+    rows, errors = _validate(QTY_MAX)
+    assert errors.empty
+    assert rows[0][6] == QTY_MAX
+
+
+def test_quantity_over_limit_is_rejected():
+    rows, errors = _validate(QTY_MAX + 1)
+    assert rows == []
+    assert errors["Lỗi"].tolist() == [f"Số lượng mặt hàng không được quá {QTY_MAX}"]
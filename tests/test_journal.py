@@ -0,0 +1,80 @@
+import pytest
+
+from journal import FAILED, SYNCED, Journal
+from storage import INVOICE_COLUMNS, INVOICES_SHEET, ITEMS, REVISION_COLUMN, SQLiteBackend, new_revision
+from writequeue import WriteQueue
+
+REVISION = INVOICE_COLUMNS.index(REVISION_COLUMN)
+
+
+def _row(key, kg=1.5, revision=""):
+    row = ["2026-09-01", key, "Resort A", "Mũi Né", "", kg] + [1] * len(ITEMS)
+    row += [""] * (len(INVOICE_COLUMNS) - len(row))
+    row[REVISION] = revision
+    return row
+
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "giatui.db"))
+    backend.append_rows(INVOICES_SHEET, [_row("101", revision="r1"), _row("102", revision="r1")])
+    return backend
+
+
+def _crash_after_write(tmp_path, backend, op, key=None, row=None, expected=None):
+    """Ghi thao tác vào nhật ký và lên Sheet nhưng "sập" trước khi kịp ghi dòng done."""
+    path = str(tmp_path / "journal.jsonl")
+    journal = Journal(path, WriteQueue(backend))
+    journal.record(op, INVOICES_SHEET, key=key, row=row, expected=expected)
+    journal.close()
+    if op == "update":
+        backend.update_rows(INVOICES_SHEET, [(key, row)])
+    elif op == "delete":
+        backend.delete_rows(INVOICES_SHEET, [key])
+    else:
+        backend.append_rows(INVOICES_SHEET, [row])
+    return Journal(path, WriteQueue(backend))
+
+
+def _statuses(journal):
+    seen = []
+    journal.subscribe(lambda entry: seen.append(entry.status))
+    journal.replay()
+    return seen
+
+
+def test_recovered_update_already_written(tmp_path, backend):
+    journal = _crash_after_write(tmp_path, backend, "update", "101", _row("101", 9.5, new_revision()), "r1")
+    assert _statuses(journal) == [SYNCED]
+    assert not journal.failed()
+
+
+def test_recovered_delete_already_written(tmp_path, backend):
+    journal = _crash_after_write(tmp_path, backend, "delete", "101", expected="r1")
+    assert _statuses(journal) == [SYNCED]
+    assert [row[1] for row in backend.read_rows(INVOICES_SHEET)] == ["102"]
+
+
+def test_recovered_append_not_duplicated(tmp_path, backend):
+    journal = _crash_after_write(tmp_path, backend, "append", row=_row("103", revision=new_revision()))
+    assert _statuses(journal) == [SYNCED]
+    assert len(backend.read_rows(INVOICES_SHEET)) == 3
+
+
+def test_recovered_update_not_written_is_replayed(tmp_path, backend):
+    path = str(tmp_path / "journal.jsonl")
+    journal = Journal(path, WriteQueue(backend))
+    journal.record("update", INVOICES_SHEET, key="101", row=_row("101", 9.5, new_revision()), expected="r1")
+    journal.close()
+    journal = Journal(path, WriteQueue(backend))
+    assert _statuses(journal) == [SYNCED]
+    assert backend.read_rows(INVOICES_SHEET)[0][5] == 9.5
+
+
+def test_recovered_stale_update_still_conflicts(tmp_path, backend):
+    path = str(tmp_path / "journal.jsonl")
+    journal = Journal(path, WriteQueue(backend))
+    journal.record("update", INVOICES_SHEET, key="101", row=_row("101", 9.5, new_revision()), expected="r0")
+    journal.close()
+    journal = Journal(path, WriteQueue(backend))
+    assert _statuses(journal) == [FAILED]
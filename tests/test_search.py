@@ -0,0 +1,36 @@
+import pytest
+
+from partitioned import PartitionedTable
+from search import InvoiceSearch
+from storage import INVOICES_SHEET, ITEMS, SQLiteBackend
+
+
+@pytest.fixture
+def table(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "giatui.db"))
+    table = PartitionedTable(backend, INVOICES_SHEET)
+    for i in range(30):
+        # Xen kẽ ba tháng để thứ tự ghi khác thứ tự ngày
+        day = f"2026-{7 + i % 3:02d}-{i // 3 + 1:02d}"
+        assert table.append([day, str(100 + i), f"Khách {i % 4}", "", "", 1.0] + [1] * len(ITEMS)).ok
+    return table
+
+
+def _expected(table, page, per_page):
+    frame = table.frame_ref().iloc[::-1]
+    return frame["Số phiếu"].astype(str).tolist()[(page - 1) * per_page:page * per_page]
+
+
+@pytest.mark.parametrize("page", [1, 2, 3, 4])
+def test_latest_pages_match_full_history(table, page):
+    search = InvoiceSearch(table)
+    found, total = search.search("", page=page, per_page=8)
+    assert total == 30
+    assert [match["key"] for match in found] == _expected(table, page, 8)
+
+
+def test_latest_does_not_merge_history(table):
+    search = InvoiceSearch(table)
+    table._merged = table._merged_of = None
+    search.search("", per_page=5)
+    assert table._merged is None
@@ -0,0 +1,127 @@
+"""Hàng đợi ghi dùng chung cho mọi phiên.
+
+Các thao tác ghi được xếp hàng rồi gom lại: nhiều dòng thêm mới liên tiếp
+thành một lệnh append_rows, nhiều dòng sửa liên tiếp thành một lệnh
+batch_update. Phiên nào tới lượt xả hàng đợi thì ghi luôn phần của các
+phiên khác đang chờ (group commit), nên lúc đông người nhập phiếu số lệnh
+API tăng chậm hơn nhiều so với số phiếu.
+
+Lỗi tạm thời (429 hết hạn mức, 5xx, mất mạng) được thử lại với thời gian
+chờ tăng theo cấp số nhân có jitter. Mỗi thao tác có một WriteTicket để
+giao diện biết kết quả. Sửa / xóa kèm `expected` (phiên bản đã đọc) mà
+dòng trên kho đã đổi thì vé kết thúc FAILED với lỗi RevisionConflict.
+"""
+import random
+import threading
+import time
+
+from storage import CONFLICT, RevisionConflict, is_transient_error
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+
+class WriteTicket:
+    def __init__(self, op, name, key=None, row=None, on_done=None, expected=None):
+        self.op = op
+        self.name = name
+        self.key = key
+        self.row = row
+        self.expected = expected
+        self.on_done = on_done
+        self.status = PENDING
+        self.result = None
+        self.error = None
+        self.attempts = 0
+        self._event = threading.Event()
+
+    @property
+    def ok(self):
+        return self.status == DONE
+
+    def wait(self, timeout=None):
+        self._event.wait(timeout)
+        return self
+
+    def _finish(self, status, result=None, error=None):
+        self.status, self.result, self.error = status, result, error
+        self._event.set()
+
+
+class WriteQueue:
+    def __init__(self, backend, max_attempts=5, base_delay=0.5, max_delay=16.0):
+        self.backend = backend
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._pending = []
+        self._mutex = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def submit(self, op, name, key=None, row=None, on_done=None, expected=None):
+        ticket = WriteTicket(op, name, key=key, row=row, on_done=on_done, expected=expected)
+        with self._mutex:
+            self._pending.append(ticket)
+        return ticket
+
+    def execute(self, op, name, key=None, row=None, on_done=None, expected=None):
+        """Xếp hàng, xả hàng đợi và chờ kết quả của đúng thao tác này."""
+        ticket = self.submit(op, name, key=key, row=row, on_done=on_done, expected=expected)
+        self.flush()
+        return ticket.wait()
+
+    def pending(self):
+        with self._mutex:
+            return list(self._pending)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._mutex:
+                batch, self._pending = self._pending, []
+            for segment in self.segments(batch):
+                self._run(segment)
+
+    @staticmethod
+    def segments(batch):
+        # Giữ nguyên thứ tự ghi; chỉ gom các thao tác liền nhau cùng loại, cùng trang tính.
+        # Xóa dòng làm dồn số dòng nên mỗi lệnh xóa đi riêng.
+        segments = []
+        for ticket in batch:
+            last = segments[-1] if segments else None
+            if last and ticket.op != "delete" and (last[0].op, last[0].name) == (ticket.op, ticket.name):
+                last.append(ticket)
+            else:
+                segments.append([ticket])
+        return segments
+
+    def _apply(self, segment):
+        op, name = segment[0].op, segment[0].name
+        if op == "append":
+            self.backend.append_rows(name, [t.row for t in segment])
+            return [True] * len(segment)
+        expected = [t.expected for t in segment]
+        if op == "update":
+            return self.backend.update_rows(name, [(t.key, t.row) for t in segment], expected=expected)
+        return self.backend.delete_rows(name, [t.key for t in segment], expected=expected)
+
+    def _run(self, segment):
+        for attempt in range(1, self.max_attempts + 1):
+            for ticket in segment:
+                ticket.attempts = attempt
+            try:
+                results = self._apply(segment)
+                break
+            except Exception as e:
+                if attempt == self.max_attempts or not is_transient_error(e):
+                    for ticket in segment:
+                        ticket._finish(FAILED, error=e)
+                    return
+                time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1))))
+        for ticket, result in zip(segment, results):
+            if result == CONFLICT:
+                ticket._finish(FAILED, error=RevisionConflict(ticket.key))
+                continue
+            if result and ticket.on_done is not None:
+                ticket.on_done(ticket)
+            ticket._finish(DONE, result)